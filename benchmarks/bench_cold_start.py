@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Cold start of a server process with each Index layout.
+
+Writes a synthetic Index (83,000 reports, Zipf-like term frequencies) into a
+temporary snapshot cache, then starts a fresh Python process per run that does what
+the app's `import_index()` does (`shared_index.get()`) and runs one search. Each
+layout ('memory' parses the JSON snapshot as `import_index()` always has, 'mapped'
+and 'sharded' open the binary files built from it) is run once first to build its
+files, so the timings are for a server restart, with the files in the page cache.
+
+Run from the repository root:
+    python benchmarks/bench_cold_start.py
+
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from gsq_search.index_cache import IndexCache  # noqa: E402
+
+url = 'https://example.invalid/v02_bench_index.json'
+layouts = ('memory', 'mapped', 'sharded')
+
+
+def synthetic_index(reports=83000, terms=200000, seed=1):
+    random.seed(seed)
+    pids = ['CR%06d' % i for i in range(reports)]
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    index = {}
+    for rank in range(1, terms + 1):
+        term = ''.join(random.choice(letters) for _ in range(random.randint(3, 12)))
+        count = max(1, min(reports, int(reports * 0.5 / rank ** 0.8)))
+        index[term] = random.sample(pids, count)
+    return index
+
+
+def write_snapshot(index, cache_dir):
+    cache = IndexCache(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    # the Index is published as a JSON string holding the JSON object
+    with gzip.open(cache.snapshot_path(url), 'wt', encoding='utf-8', compresslevel=1) as f:
+        f.write(json.dumps(json.dumps(index)))
+    with open(cache.meta_path(url), 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'etag': '"bench"', 'last_modified': None}, f)
+
+
+def child(query):
+    start = time.perf_counter()
+    from gsq_search.index import process_rss, shared_index
+    from gsq_search.planner import run_query
+    index = shared_index.get(url)
+    ready = time.perf_counter()
+    results = run_query(index, query)
+    done = time.perf_counter()
+    print(json.dumps({
+        'ready_s': ready - start,
+        'first_query_s': done - ready,
+        'results': len(results),
+        'rss_bytes': process_rss(),
+    }))
+
+
+def run_child(layout, cache_dir, query):
+    env = dict(os.environ, GSQ_INDEX_LAYOUT=layout, GSQ_INDEX_CACHE_DIR=cache_dir, GSQ_INDEX_OFFLINE='1')
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', query],
+        env=env, cwd=root, check=True, stdout=subprocess.PIPE).stdout
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=83000)
+    parser.add_argument('--terms', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', metavar='QUERY', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    index = synthetic_index(args.reports, args.terms)
+    dfs = {term: len(pids) for term, pids in index.items()}
+    by_df = sorted(dfs, key=dfs.get)
+    # a rare, a mid-frequency and the most common term, so several shards are read
+    query = '"%s" OR "%s" AND "%s"' % (by_df[0], by_df[len(by_df) // 2], by_df[-1])
+    cache_dir = tempfile.mkdtemp(prefix='gsq_bench_')
+    write_snapshot(index, cache_dir)
+    del index
+    print('snapshot: %.1f MB compressed' % (os.path.getsize(IndexCache(cache_dir).snapshot_path(url)) / 1e6))
+
+    print('%-8s %12s %12s %12s %10s' % ('layout', 'ready (s)', 'query (ms)', 'process (s)', 'RSS (MB)'))
+    try:
+        for layout in layouts:
+            # the first run builds the layout's files
+            run_child(layout, cache_dir, query)
+            runs = [run_child(layout, cache_dir, query) for _ in range(args.repeat)]
+            best = min(runs, key=lambda run: run['ready_s'])
+            print('%-8s %12.3f %12.2f %12.3f %10.1f' % (
+                layout, best['ready_s'], best['first_query_s'] * 1000, best['process_s'],
+                (best['rss_bytes'] or 0) / 1e6))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
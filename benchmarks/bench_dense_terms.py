@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Query latency for combinations of very common terms, with and without bitmaps.
+
+Builds a synthetic index of 83,000 reports with terms found in 5% to 80% of them,
+then times AND/OR/NOT between pairs of those terms with every term stored as a
+sorted array ('arrays') and with the dense terms stored as Bitmaps ('hybrid').
+Times include turning the result back into a sorted list of report IDs.
+
+Run from the repository root:
+    python benchmarks/bench_dense_terms.py
+
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gsq_search.bitmap import Bitmap  # noqa: E402
+from gsq_search.compact_index import from_dict  # noqa: E402
+from gsq_search.planner import query_ids  # noqa: E402
+from gsq_search.query import Operation, Term  # noqa: E402
+
+
+def synthetic_index(reports=83000, shares=(0.8, 0.6, 0.4, 0.2, 0.05), seed=1):
+    random.seed(seed)
+    pids = ['CR%06d' % i for i in range(reports)]
+    index = {}
+    for share in shares:
+        index['share_%02d' % round(share * 100)] = random.sample(pids, int(reports * share))
+    return index
+
+
+def time_query(index, query, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = query_ids(index, query)
+        # include turning a Bitmap result back into a sorted list of report IDs
+        if isinstance(result, Bitmap):
+            result.to_array()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=83000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    raw = synthetic_index(args.reports)
+    arrays = from_dict(raw, dense_fraction=None)
+    hybrid = from_dict(raw)
+    terms = sorted(raw, reverse=True)
+
+    print('%-28s %12s %12s %8s' % ('query', 'arrays (ms)', 'hybrid (ms)', 'speedup'))
+    for i, left in enumerate(terms):
+        for right in terms[i + 1:]:
+            for op in ('AND', 'OR', 'NOT'):
+                query = Operation(op, Term(left), Term(right))
+                before = time_query(arrays, query, args.repeat)
+                after = time_query(hybrid, query, args.repeat)
+                print('%-28s %12.2f %12.2f %7.1fx' % (query, before * 1000, after * 1000, before / after))
+
+    print()
+    print('memory (MB): arrays %.1f, hybrid %.1f' % (
+        arrays.memory_usage()['total'] / 1e6, hybrid.memory_usage()['total'] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Build time, memory and lookup latency of the close-spellings index (fuzzy.py).
+
+By default the v02 Index is loaded as the app loads it (`shared_index.get()`, so the
+GSQ_INDEX_* settings apply and a cached copy is used if there is one) and the
+FuzzyIndex is built over its whole vocabulary. `--synthetic N` uses N random words
+instead, for a machine without the Index.
+
+Lookups are timed for Index words with one and with two random OCR-like errors
+(a letter inserted, removed, changed or swapped with its neighbour). `--check`
+also compares a sample of them against a brute-force scan of the vocabulary.
+
+Run from the repository root:
+    python benchmarks/bench_fuzzy.py
+
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gsq_search.fuzzy import FuzzyIndex, edit_distance, long_word, word_distance  # noqa: E402
+
+
+def synthetic_terms(words, seed=1):
+    random.seed(seed)
+    found = set()
+    while len(found) < words:
+        found.add(''.join(random.choice(string.ascii_lowercase) for _ in range(random.randint(3, 12))))
+    return sorted(found)
+
+
+def misspell(word, errors):
+    letters = list(word)
+    for _ in range(errors):
+        op = random.randrange(4)
+        i = random.randrange(len(letters))
+        if op == 0:
+            letters.insert(i, random.choice(string.ascii_lowercase))
+        elif op == 1 and len(letters) > 2:
+            del letters[i]
+        elif op == 2:
+            letters[i] = random.choice(string.ascii_lowercase)
+        elif i + 1 < len(letters):
+            letters[i], letters[i + 1] = letters[i + 1], letters[i]
+    return ''.join(letters)
+
+
+def percentile(times, share):
+    return times[min(len(times) - 1, int(len(times) * share))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--synthetic', type=int, metavar='WORDS',
+                        help='use this many random words instead of the v02 Index')
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--check', type=int, default=0, metavar='LOOKUPS',
+                        help='compare this many lookups against a brute-force scan')
+    parser.add_argument('--trace', action='store_true',
+                        help='measure peak memory while building (slows the build down)')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        terms = synthetic_terms(args.synthetic)
+    else:
+        from gsq_search.index import shared_index
+        terms = shared_index.get().terms
+    words = [term for term in terms if ' ' not in term]
+    print('terms: %d, single words: %d' % (len(terms), len(words)))
+
+    if args.trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    fuzzy = FuzzyIndex(terms)
+    build = time.perf_counter() - start
+    print('build: %.2f s, %d deletions, %.1f MB' % (build, len(fuzzy.keys), fuzzy.memory_usage() / 1e6))
+    if args.trace:
+        print('peak memory while building: %.1f MB' % (tracemalloc.get_traced_memory()[1] / 1e6))
+        tracemalloc.stop()
+
+    random.seed(2)
+    print('%-8s %10s %10s %10s %10s' % ('errors', 'p50 (ms)', 'p99 (ms)', 'found (%)', 'matches'))
+    for errors in (1, 2):
+        times = []
+        found = matches = 0
+        samples = []
+        for _ in range(args.lookups):
+            word = random.choice(words)
+            typo = misspell(word, errors)
+            start = time.perf_counter()
+            result = fuzzy.lookup(typo)
+            times.append(time.perf_counter() - start)
+            found += word in [term for term, distance in result]
+            matches += len(result)
+            samples.append(typo)
+        times.sort()
+        print('%-8d %10.2f %10.2f %10.1f %10.1f' % (
+            errors, percentile(times, 0.5) * 1000, percentile(times, 0.99) * 1000,
+            100.0 * found / args.lookups, matches / args.lookups))
+
+        for typo in samples[:args.check]:
+            limit = word_distance(typo)
+            brute = sorted((edit_distance(typo, word, limit), word) for word in words
+                           if edit_distance(typo, word, limit) <= limit)
+            if [(word, distance) for distance, word in brute] != fuzzy.lookup(typo):
+                print('mismatch for %r' % typo)
+    # a word with two errors is only found if it is long enough to be searched within 2 edits
+    print('(words under %d letters are searched within 1 edit)' % long_word)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Latency and throughput of the HTTP search service under concurrent clients.
+
+Each client is a thread with its own keep-alive `requests.Session`, sending
+requests to one endpoint of a running service (`python -m gsq_search.service`)
+as fast as it gets answers, with queries drawn in turn from a queries file (one
+search expression per line, as for `python -m gsq_search.batch`) or a built-in
+list of common searches. `--start` starts a service for the run first, on the
+Index the GSQ_INDEX_* settings pick.
+
+Run from the repository root:
+    python benchmarks/bench_service.py --start --clients 1 4 16
+
+"""
+
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from gsq_search.batch import percentile, read_queries  # noqa: E402
+from gsq_search.service import default_port  # noqa: E402
+
+default_queries = [
+    'gold', 'copper', 'coal', 'uranium', 'bauxite', '"coal seam gas"', '"drill hole"',
+    'gold OR silver', 'copper AND gold NOT coal', 'granit*', '*stone', 'magnetic survey',
+    '(gold OR silver) AND "drill hole" NOT alluvial', 'bowen AND basin', 'exploration',
+]
+
+
+def request(session, url, endpoint, query):
+    if endpoint == 'batch':
+        return session.post(url + '/batch', json={'queries': [query] * 10, 'count_only': True})
+    return session.get(url + '/' + endpoint, params={'q': query})
+
+
+def client(url, endpoint, queries, requests_each, times, errors):
+    session = requests.Session()
+    for query in itertools.islice(queries, requests_each):
+        start = time.perf_counter()
+        try:
+            response = request(session, url, endpoint, query)
+            # a search word that isn't in the Index is still an answer
+            if response.status_code not in (200, 404):
+                errors.append(response.status_code)
+        except requests.RequestException as error:
+            errors.append(error)
+        times.append(time.perf_counter() - start)
+
+
+def run(url, endpoint, queries, clients, requests_each):
+    times, errors = [], []
+    threads = []
+    for i in range(clients):
+        # each client starts at a different query
+        own = itertools.islice(itertools.cycle(queries), i, None)
+        threads.append(threading.Thread(target=client, args=(url, endpoint, own, requests_each, times, errors)))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, times, errors
+
+
+def wait_for(url, process, seconds=600):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The search service stopped while starting')
+        try:
+            if requests.get(url + '/health', timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('The search service did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:%d' % default_port, help='service to send requests to')
+    parser.add_argument('--start', action='store_true', help='start a service on the --url port for the run')
+    parser.add_argument('--endpoint', choices=('search', 'count', 'batch', 'pids'), default='search')
+    parser.add_argument('--queries', help='file of search expressions, one per line')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16], help='concurrent clients per run')
+    parser.add_argument('--requests', type=int, default=200, help='requests sent by each client')
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, encoding='utf-8') as f:
+            queries = [query for number, query in read_queries(f)]
+    else:
+        queries = default_queries
+    url = args.url.rstrip('/')
+
+    process = None
+    if args.start:
+        port = url.rsplit(':', 1)[-1]
+        process = subprocess.Popen([sys.executable, '-m', 'gsq_search.service', '--port', port], cwd=root)
+        wait_for(url, process)
+    try:
+        # one pass over the queries first, so the results cache is as warm as in use
+        run(url, args.endpoint, queries, 1, len(queries))
+        print('%-8s %10s %10s %10s %8s' % ('clients', 'req/s', 'p50 (ms)', 'p99 (ms)', 'errors'))
+        for clients in args.clients:
+            elapsed, times, errors = run(url, args.endpoint, queries, clients, args.requests)
+            print('%-8d %10.1f %10.2f %10.2f %8d' % (
+                clients, len(times) / elapsed, percentile(times, 0.5) * 1000,
+                percentile(times, 0.99) * 1000, len(errors)))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite over a synthetic Index, with a stored baseline to compare against.
+
+Writes a synthetic Index shaped like v02 (see synthetic.py) into a temporary
+snapshot cache, then measures:
+
+    load_s.<layout>        time for a fresh process to load the Index as the app's
+                           `import_index()` does, with the layout's files built
+    build_s.<layout>       the same, the first time (parse and build the files)
+    peak_rss_mb.<layout>   peak memory of that process
+    lookup_ms.<class>      one term's report PIDs, for rare, common and very common terms
+    query_ms.<a> <op> <b>  AND, OR and NOT of a term of each class with one of each
+                           class (report IDs and count, as the app's count is made)
+    complete_build_s       building the type-ahead completions (see autocomplete.py)
+    complete_ms.<n>        the top 10 completions of the first n letters of a term
+
+Latencies are the median over several terms of each class (rare: in at most 0.02% of
+the reports, or 5; common: 1-5%; very common: at least 30%), each the best of
+`--repeat`.
+
+`--save` stores the results as the baseline (benchmarks/baseline.json by default),
+and every run is compared with the baseline: a result more than `--tolerance`
+(default 25%) slower than it is reported as a regression, and the exit status is 1.
+A baseline is only comparable on the same machine and at the same `--scale`.
+
+Run from the repository root:
+    python benchmarks/bench_suite.py                    # compare with the baseline
+    python benchmarks/bench_suite.py --save             # store a new baseline
+    python benchmarks/bench_suite.py --scale 10 --no-compare --layouts mapped
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows; psutil is used instead
+    resource = None
+
+benchmarks = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(benchmarks)
+sys.path.insert(0, root)
+
+import synthetic  # noqa: E402
+
+url = 'https://example.invalid/v02_bench_suite_index.json'
+layouts = ('memory', 'mapped', 'sharded')
+default_baseline = os.path.join(benchmarks, 'baseline.json')
+
+# share of the reports a term of each class is found in
+classes = {
+    'rare': (0.0, 0.0002),
+    'common': (0.01, 0.05),
+    'very_common': (0.3, 1.0),
+}
+
+# terms in at most this many reports are rare, however few reports there are
+rare_df = 5
+
+# terms of each class timed
+samples = 5
+
+# differences smaller than these are noise, whatever the ratio
+floors = {'_s': 0.05, '_ms': 0.05, '_mb': 5.0}
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes, except on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    from gsq_search.index import psutil
+    if psutil is not None:
+        return getattr(psutil.Process().memory_info(), 'peak_wset', None)
+    return None
+
+
+def child():
+    start = time.perf_counter()
+    from gsq_search.index import shared_index
+    index = shared_index.get(url)
+    seconds = time.perf_counter() - start
+    print(json.dumps({'seconds': seconds, 'terms': len(index), 'peak_rss_bytes': peak_rss()}))
+
+
+def run_child(layout, cache_dir):
+    env = dict(os.environ, GSQ_INDEX_LAYOUT=layout, GSQ_INDEX_CACHE_DIR=cache_dir, GSQ_INDEX_OFFLINE='1')
+    env.pop('GSQ_INDEX_SEGMENTS_URL', None)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'],
+                            env=env, cwd=root, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def best_time(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def class_terms(index):
+    """Up to `samples` single words of each class, spread over the class."""
+    reports = index.doc_count
+    found = {name: [] for name in classes}
+    for term in index.terms:
+        if ' ' in term:
+            continue
+        df = index.df(term)
+        for name, (low, high) in classes.items():
+            if low * reports <= df <= max(high * reports, rare_df if name == 'rare' else 0):
+                found[name].append(term)
+    picked = {}
+    for name, terms in found.items():
+        step = max(1, len(terms) // samples)
+        picked[name] = terms[::step][:samples]
+        if not picked[name]:
+            print('no %s terms in the synthetic Index' % name, file=sys.stderr)
+    return picked
+
+
+def completion_benchmarks(index, words, repeat):
+    from gsq_search import autocomplete
+
+    start = time.perf_counter()
+    completions = autocomplete.completions(index)
+    results = {'complete_build_s': time.perf_counter() - start}
+    for letters in (1, 2, 3, 5):
+        results['complete_ms.%d' % letters] = 1000 * statistics.median(
+            best_time(lambda: completions.complete(word[:letters]), repeat) for word in words)
+    return results
+
+
+def query_benchmarks(index, repeat):
+    from gsq_search.planner import count_query
+    from gsq_search.query import Operation, Term
+
+    results = {}
+    terms = class_terms(index)
+    for name, words in terms.items():
+        if words:
+            results['lookup_ms.' + name] = 1000 * statistics.median(
+                best_time(lambda: index[word], repeat) for word in words)
+    for left in classes:
+        for right in classes:
+            pairs = [(a, b) for a, b in zip(terms[left], reversed(terms[right])) if a != b]
+            if not pairs:
+                continue
+            for op in ('AND', 'OR', 'NOT'):
+                results['query_ms.%s %s %s' % (left, op, right)] = 1000 * statistics.median(
+                    best_time(lambda: count_query(index, Operation(op, Term(a), Term(b))), repeat)
+                    for a, b in pairs)
+    results.update(completion_benchmarks(index, [word for words in terms.values() for word in words], repeat))
+    return results
+
+
+def run_suite(shape, layouts, repeat, seed=1):
+    cache_dir = tempfile.mkdtemp(prefix='gsq_suite_')
+    results = {}
+    try:
+        start = time.perf_counter()
+        terms = synthetic.write_snapshot(cache_dir, url, shape, seed)
+        print('synthetic Index: %d terms, %d reports (%.0f s)' % (
+            terms, shape['reports'], time.perf_counter() - start), file=sys.stderr)
+        for layout in layouts:
+            results['build_s.' + layout] = run_child(layout, cache_dir)['seconds']
+            runs = [run_child(layout, cache_dir) for _ in range(repeat)]
+            results['load_s.' + layout] = min(run['seconds'] for run in runs)
+            peaks = [run['peak_rss_bytes'] for run in runs if run['peak_rss_bytes']]
+            if peaks:
+                results['peak_rss_mb.' + layout] = min(peaks) / 1e6
+            print('%s: loaded in %.2f s' % (layout, results['load_s.' + layout]), file=sys.stderr)
+
+        from gsq_search.index import load_index_with_stats
+        from gsq_search.index_cache import IndexCache
+        os.environ['GSQ_INDEX_OFFLINE'] = '1'
+        index, _ = load_index_with_stats(url, IndexCache(cache_dir))
+        results.update(query_benchmarks(index, repeat))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def _floor(name):
+    for suffix, floor in floors.items():
+        if name.split('.')[0].endswith(suffix):
+            return floor
+    return 0.0
+
+
+def compare(results, baseline, tolerance):
+    """Print each result against the baseline; returns the names of the regressions."""
+    regressions = []
+    print('%-38s %12s %12s %8s' % ('benchmark', 'baseline', 'now', 'change'))
+    for name in sorted(results):
+        now = results[name]
+        before = baseline.get(name)
+        if before is None:
+            print('%-38s %12s %12.3f' % (name, '-', now))
+            continue
+        change = (now - before) / before if before else 0.0
+        flag = ''
+        if change > tolerance and now - before > _floor(name):
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-38s %12.3f %12.3f %+7.0f%%%s' % (name, before, now, change * 100, flag))
+    return regressions
+
+
+def machine():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.machine()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='times the v02 reports and terms')
+    parser.add_argument('--shape', help='JSON file of the Index shape (see synthetic.py --describe)')
+    parser.add_argument('--layouts', nargs='+', choices=layouts, default=list(layouts))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=default_baseline, help='baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--no-compare', action='store_true', help='only print the results')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slow-down reported as a regression')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    shape = synthetic.load_shape(args.shape, args.scale)
+    results = run_suite(shape, args.layouts, args.repeat)
+
+    baseline = None
+    if not args.no_compare and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('shape') != shape:
+            print('The baseline was measured on a different Index shape or scale; not comparing', file=sys.stderr)
+            baseline = None
+        elif baseline.get('machine') != machine():
+            print('Note: the baseline was measured on another machine (%s)' % baseline.get('machine'),
+                  file=sys.stderr)
+    regressions = compare(results, baseline['results'] if baseline else {}, args.tolerance)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'shape': shape, 'machine': machine(), 'date': time.strftime('%Y-%m-%d'),
+                       'results': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved the baseline to %s' % args.baseline, file=sys.stderr)
+    if regressions:
+        print('%d regressions: %s' % (len(regressions), ', '.join(regressions)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
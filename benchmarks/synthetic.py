@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic GSQ OCR Report Index with the shape of v02, for benchmarks without S3.
+
+The shape is the number of reports, single words and word pairs/triples (n-grams),
+the average number of distinct words and n-grams per report, and the Zipf exponent
+of the postings lengths: the term of rank r is found in `C / r ** exponent` reports
+(at most all of them), with C set so the postings add up to the per-report
+averages. N-grams are made from the more common words, as in the real Index.
+
+`v02` is an estimate; on a machine that can load the real Index,
+`python benchmarks/synthetic.py --describe > v02_shape.json` measures it, and
+`--shape v02_shape.json` (here and in bench_suite.py) uses the measured shape.
+`--scale` multiplies the reports, terms and postings, e.g. `--scale 10` for ten
+times the current corpus.
+
+Terms are generated (reproducibly, from `seed`) and written one at a time, so even a
+10x Index is never held in memory as a dict:
+
+    python benchmarks/synthetic.py synthetic_v02.json.gz --scale 10
+
+"""
+
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from gsq_search.index_cache import IndexCache  # noqa: E402
+
+# estimated shape of the v02 Index
+v02 = {
+    'reports': 83500,
+    'words': 200000,
+    'ngrams': 300000,
+    'words_per_report': 250,
+    'ngrams_per_report': 100,
+    'exponent': 1.1,
+}
+
+letters = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def scaled(shape, scale):
+    """`shape` with `scale` times the reports and terms (the per-report averages stay)."""
+    shape = dict(shape)
+    for key in ('reports', 'words', 'ngrams'):
+        shape[key] = int(shape[key] * scale)
+    return shape
+
+
+def _total(c, terms, reports, exponent):
+    # sum of min(reports, max(1, c / rank ** exponent)) over the ranks, taken as an integral
+    capped = min(terms, (c / reports) ** (1 / exponent))
+    floor = min(terms, max(capped, c ** (1 / exponent)))
+    if exponent == 1:
+        middle = c * math.log(floor / capped) if capped > 0 else c * math.log(floor + 1)
+    else:
+        middle = c / (1 - exponent) * (floor ** (1 - exponent) - capped ** (1 - exponent))
+    return reports * capped + middle + (terms - floor)
+
+
+def zipf_lengths(terms, reports, per_report, exponent):
+    """Postings lengths by rank, `min(reports, C / rank ** exponent)` with C set (by
+    bisection) so they add up to about `reports * per_report`.
+    """
+    target = reports * per_report
+    low, high = 0.0, float(target)
+    for _ in range(60):
+        middle = (low + high) / 2
+        if _total(middle, terms, reports, exponent) < target:
+            low = middle
+        else:
+            high = middle
+    return [max(1, min(reports, int(high / rank ** exponent))) for rank in range(1, terms + 1)]
+
+
+def _words(count, rng):
+    found = set()
+    while len(found) < count:
+        found.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 12))))
+    return sorted(found)
+
+
+def iter_terms(shape=v02, seed=1):
+    """`(term, sorted report PIDs)` for every term of a synthetic Index, words first
+    (most common first), then n-grams.
+    """
+    rng = random.Random(seed)
+    reports = shape['reports']
+    pids = ['CR%06d' % i for i in range(reports)]
+    words = _words(shape['words'], rng)
+    rng.shuffle(words)
+
+    def postings(length):
+        return [pids[i] for i in sorted(rng.sample(range(reports), length))]
+
+    for word, length in zip(words, zipf_lengths(len(words), reports, shape['words_per_report'], shape['exponent'])):
+        yield word, postings(length)
+    # n-grams of the more common words
+    common = words[:max(10, len(words) // 10)]
+    ngrams = set()
+    while len(ngrams) < shape['ngrams']:
+        ngrams.add(' '.join(rng.choice(common) for _ in range(rng.randint(2, 3))))
+    ngrams = sorted(ngrams)
+    rng.shuffle(ngrams)
+    for ngram, length in zip(ngrams, zipf_lengths(len(ngrams), reports, shape['ngrams_per_report'], shape['exponent'])):
+        yield ngram, postings(length)
+
+
+def write_index(f, terms):
+    """Write `(term, pids)` entries to the text file `f` as the Index is published: a
+    JSON string holding the JSON object. Returns the number of terms.
+    """
+    count = 0
+    f.write('"{')
+    for term, pids in terms:
+        entry = '%s%s: %s' % (', ' if count else '', json.dumps(term), json.dumps(pids))
+        # escaped for the outer JSON string
+        f.write(json.dumps(entry)[1:-1])
+        count += 1
+    f.write('}"')
+    return count
+
+
+def write_snapshot(cache_dir, url, shape=v02, seed=1):
+    """Write a synthetic Index into the snapshot cache at `cache_dir` as the cached
+    copy of `url`, so the app's loaders read it (with GSQ_INDEX_OFFLINE=1).
+    """
+    cache = IndexCache(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    with gzip.open(cache.snapshot_path(url), 'wt', encoding='utf-8', compresslevel=1) as f:
+        terms = write_index(f, iter_terms(shape, seed))
+    with open(cache.meta_path(url), 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'etag': '"synthetic-%d"' % seed, 'last_modified': None}, f)
+    return terms
+
+
+def _fit_exponent(lengths):
+    # slope of log(postings length) against log(rank), over the ranks below the cap
+    points = [(math.log(rank), math.log(length)) for rank, length in enumerate(lengths, 1)
+              if length < lengths[0] or rank == 1]
+    n = len(points)
+    mean_x = sum(x for x, y in points) / n
+    mean_y = sum(y for x, y in points) / n
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    variance = sum((x - mean_x) ** 2 for x, y in points)
+    return -covariance / variance if variance else 1.0
+
+
+def describe(index):
+    """The shape of an Index (as used by `iter_terms`)."""
+    words, ngrams = [], []
+    for term in index.terms:
+        (ngrams if ' ' in term else words).append(index.df(term))
+    words.sort(reverse=True)
+    ngrams.sort(reverse=True)
+    reports = index.doc_count
+    return {
+        'reports': reports,
+        'words': len(words),
+        'ngrams': len(ngrams),
+        'words_per_report': round(sum(words) / reports),
+        'ngrams_per_report': round(sum(ngrams) / reports),
+        'exponent': round(_fit_exponent(words), 2),
+    }
+
+
+def load_shape(path=None, scale=1.0):
+    shape = v02
+    if path:
+        with open(path, encoding='utf-8') as f:
+            shape = dict(v02, **json.load(f))
+    return scaled(shape, scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output', nargs='?', help='Index file to write (.gz to compress it)')
+    parser.add_argument('--scale', type=float, default=1.0, help='times the v02 reports and terms')
+    parser.add_argument('--shape', help='JSON file of the shape to match (see --describe)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--describe', action='store_true',
+                        help='print the shape of the real Index (loaded as the app loads it) instead')
+    args = parser.parse_args()
+
+    if args.describe:
+        from gsq_search.index import shared_index
+        print(json.dumps(describe(shared_index.get()), indent=2))
+        return
+    if not args.output:
+        parser.error('give the Index file to write, or --describe')
+    shape = load_shape(args.shape, args.scale)
+    opener = gzip.open if args.output.endswith('.gz') else open
+    with opener(args.output, 'wt', encoding='utf-8') as f:
+        terms = write_index(f, iter_terms(shape, args.seed))
+    print('%d terms, %d reports written to %s' % (terms, shape['reports'], args.output))
+
+
+if __name__ == '__main__':
+    main()
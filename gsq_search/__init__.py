@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Search helpers for the GSQ OCR Report Index.
+
+These modules hold the index loading and query code used by 'ocr_streamlit_app.py',
+so the same logic can be shared between Streamlit sessions and re-used outside the app.
+
+"""
+
+from gsq_search.binary_index import MappedIndex
+from gsq_search.compact_index import CompactIndex
+from gsq_search.index import SharedIndex, index_url, load_index, shared_index
+from gsq_search.result_cache import ResultCache
+from gsq_search.searcher import Searcher
+from gsq_search.sharded_index import ShardedIndex
+
+__all__ = ['CompactIndex', 'MappedIndex', 'ShardedIndex', 'SharedIndex', 'index_url', 'load_index', 'shared_index',
+           'ResultCache', 'Searcher']
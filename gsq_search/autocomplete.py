@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Type-ahead completions of a search term from the Index's terms, the terms found in
+the most reports first.
+
+Every Index keeps its terms sorted, so the terms starting with a prefix are one
+contiguous range (as for wildcards, see term_dictionary.py), and the best of them
+are the ones with the highest report counts in that range. A short prefix matches
+too many terms to rank them on every keystroke, so `Completions` ranks them once:
+for every prefix matching more than `scan_limit` terms, the best
+`max_completions` terms are worked out from the best of each next letter and
+stored. Any other prefix matches few enough terms to rank them when asked. Either
+way a completion takes well under a millisecond.
+
+Single words, word pairs and triples are all completed ('drill h' gives
+'drill hole'). The completions are built once per Index (under a second for the
+full vocabulary) and kept with it, shared by every session.
+
+"""
+
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+
+from gsq_search.normalize import clean_term
+
+# most completions returned for a prefix
+max_completions = 20
+
+# prefixes matching more terms than this have their completions stored
+scan_limit = 1024
+
+# sorts after any character used in a term
+_last_char = '\U0010ffff'
+
+
+def _prefix(text):
+    # as the search terms are cleaned, keeping one space at the end ('drill ')
+    cleaned = ' '.join(clean_term(text).split())
+    if cleaned and text[-1:].isspace():
+        cleaned += ' '
+    return cleaned
+
+
+class Completions:
+    """The terms with the highest report counts for any prefix of sorted `terms`;
+    `dfs` are the report counts of the terms, in the same order.
+    """
+
+    def __init__(self, terms, dfs):
+        self.terms = terms
+        self.dfs = array('I', dfs)
+        # prefix -> ordinals of its best terms, best first
+        self._top = {}
+        if len(terms):
+            self._build('', 0, len(terms))
+
+    def _rank(self, ordinals):
+        return array('I', heapq.nlargest(max_completions, ordinals, key=self.dfs.__getitem__))
+
+    def _build(self, prefix, lo, hi):
+        # best ordinals of terms[lo:hi], which all start with `prefix`
+        if hi - lo <= scan_limit:
+            return self._rank(range(lo, hi))
+        terms = self.terms
+        candidates = []
+        i = lo
+        if terms[i] == prefix:
+            candidates.append(i)
+            i += 1
+        while i < hi:
+            child = terms[i][:len(prefix) + 1]
+            j = bisect_left(terms, child + _last_char, i, hi)
+            candidates.extend(self._build(child, i, j))
+            i = j
+        # ties go to the first term alphabetically, as in _rank
+        candidates.sort()
+        top = self._top[prefix] = self._rank(candidates)
+        return top
+
+    def __len__(self):
+        return len(self._top)
+
+    def complete(self, prefix, limit=10):
+        """`[(term, reports), ...]` for up to `limit` terms starting with `prefix`, the
+        terms found in the most reports first. `prefix` is cleaned like a search term.
+        """
+        prefix = _prefix(prefix)
+        if not prefix:
+            return []
+        top = self._top.get(prefix)
+        if top is None:
+            lo = bisect_left(self.terms, prefix)
+            hi = bisect_left(self.terms, prefix + _last_char, lo)
+            top = self._rank(range(lo, hi))
+        return [(self.terms[i], self.dfs[i]) for i in top[:min(limit, max_completions)]]
+
+
+def _term_table(index):
+    # a sharded Index loads a term's shard to look it up, so it lists its terms instead
+    term_table = getattr(index, 'term_table', None)
+    if term_table is not None:
+        return term_table()
+    term_dfs = getattr(index, 'term_dfs', None)
+    return index.terms, term_dfs() if term_dfs is not None else map(index.df, index.terms)
+
+
+_lock = threading.Lock()
+
+
+def completions(index):
+    """The Completions of an Index, built the first time they are asked for and kept
+    with the Index.
+    """
+    found = getattr(index, '_completions', None)
+    if found is None:
+        with _lock:
+            found = getattr(index, '_completions', None)
+            if found is None:
+                found = index._completions = Completions(*_term_table(index))
+    return found
+
+
+def warm(index):
+    """Build the Completions of an Index in a background thread, so they are ready
+    for the first keystroke.
+    """
+    if getattr(index, '_completions', None) is None:
+        threading.Thread(target=completions, args=(index,), name='gsq-completions', daemon=True).start()
+
+
+def complete(index, prefix, limit=10):
+    """Up to `limit` `(term, reports)` completions of `prefix` from the Index."""
+    return completions(index).complete(prefix, limit)
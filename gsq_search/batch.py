@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Run a file of searches in parallel and write all their results to one CSV.
+
+    python -m gsq_search.batch queries.txt results.csv --workers 8
+
+Each line of the queries file is a search expression as typed in the app ('gold',
+'"coal seam gas" AND bowen', '(gold OR silver) NOT alluvial'); blank lines and
+lines starting with # are skipped. The searches are shared out between worker
+processes, each running its own Searcher against the Index. With the default
+'mapped' GSQ_INDEX_LAYOUT the Index is loaded (and converted, if needed) once
+before the workers start, and every worker maps the same file, so they share one
+copy of it and throughput grows with the number of cores.
+
+The results file has a row per report found, in query order:
+
+    query_number, query, report_pid, match, count, seconds, error
+
+`match` is 'candidate' for phrases matched from their word pairs and triples (see
+planner.py), `count` the number of reports the query found and `seconds` the time
+it took in its worker. A query that finds nothing (or fails, with `error` saying
+why) still gets one row, with no report_pid.
+
+"""
+
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+from gsq_search.index import index_url, shared_index
+from gsq_search.query import QuerySyntaxError
+from gsq_search.searcher import Searcher
+
+columns = ['query_number', 'query', 'report_pid', 'match', 'count', 'seconds', 'error']
+
+# queries handed to a worker at a time
+chunk_size = 16
+
+# the Searcher and (fuzzy, variants) of a worker process
+_searcher = None
+_options = (False, False)
+
+
+def read_queries(f):
+    """`(line number, search expression)` for each search in a queries file."""
+    for number, line in enumerate(f, 1):
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield number, line
+
+
+def _init_worker(url, fuzzy, variants):
+    global _searcher, _options
+    _searcher = Searcher(url=url)
+    _options = (fuzzy, variants)
+    # load (or, after a fork, reuse) the Index before the first query is timed
+    _searcher.index
+
+
+def run_one(searcher, query, fuzzy=False, variants=False):
+    """`(pids, candidate, seconds, error)` for one search expression."""
+    start = time.perf_counter()
+    try:
+        result = searcher.lookup(query, fuzzy, variants)
+        pids, candidate, error = result.pids, result.candidate, ''
+    except QuerySyntaxError as e:
+        pids, candidate, error = [], False, 'could not read the query: %s' % e
+    except KeyError as e:
+        pids, candidate, error = [], False, 'not in the Index: %s' % (e.args[0] if e.args else '')
+    return pids, candidate, time.perf_counter() - start, error
+
+
+def _run(item):
+    number, query = item
+    return (number, query) + run_one(_searcher, query, *_options)
+
+
+def format_rows(number, query, pids, candidate, seconds, error):
+    """The results file rows of one query, as CSV text."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    common = [len(pids), '%.6f' % seconds, error]
+    if not pids:
+        writer.writerow([number, query, '', ''] + common)
+    match = 'candidate' if candidate else ''
+    writer.writerows([number, query, pid, match] + common for pid in pids)
+    return buffer.getvalue()
+
+
+def _run_rows(item):
+    # the rows are made in the worker, so the main process only writes them out
+    result = _run(item)
+    return result[4], format_rows(*result)
+
+
+def run_batch(queries, url=index_url, workers=None, fuzzy=False, variants=False, rows=False):
+    """`(query number, query, pids, candidate, seconds, error)` for each of
+    `queries` (`(number, search expression)` pairs), in order, from `workers`
+    processes (default: one per core; 1 runs them in this process).
+
+    With `rows`, `(seconds, CSV text)` of each query's results file rows instead.
+    """
+    run = _run_rows if rows else _run
+    # the Index is loaded (or converted) once here; forked workers inherit it, and
+    # with the mapped layout others open the file it was saved to
+    shared_index.get(url)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(url, fuzzy, variants)
+        yield from map(run, queries)
+        return
+    with multiprocessing.Pool(workers, _init_worker, (url, fuzzy, variants)) as pool:
+        yield from pool.imap(run, queries, chunk_size)
+
+
+def write_results(rows, f):
+    """Write the `run_batch(..., rows=True)` rows to the open text file `f`; returns
+    the per-query seconds.
+    """
+    f.write(','.join(columns) + '\n')
+    times = []
+    for seconds, text in rows:
+        times.append(seconds)
+        f.write(text)
+    return times
+
+
+def percentile(times, share):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * share))] if times else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a file of searches of the GSQ OCR Report Index in parallel.')
+    parser.add_argument('queries', help='file of search expressions, one per line')
+    parser.add_argument('output', help='CSV file to write the results of every query to')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--url', default=index_url, help='Index URL (default: the v02 Index)')
+    parser.add_argument('--fuzzy', action='store_true', help='include close spellings of each word')
+    parser.add_argument('--variants', action='store_true', help='include other forms of each word')
+    args = parser.parse_args(argv)
+
+    with open(args.queries, encoding='utf-8') as f:
+        queries = list(read_queries(f))
+    start = time.perf_counter()
+    shared_index.get(args.url)
+    print('Index loaded in %.1f s' % (time.perf_counter() - start), file=sys.stderr)
+    start = time.perf_counter()
+    rows = run_batch(queries, args.url, args.workers, args.fuzzy, args.variants, rows=True)
+    with open(args.output, 'w', encoding='utf-8', newline='') as f:
+        times = write_results(rows, f)
+    elapsed = time.perf_counter() - start
+    print('%d queries in %.1f s (%.1f queries/s), per query p50 %.1f ms, p99 %.1f ms' % (
+        len(times), elapsed, len(times) / elapsed if elapsed else 0.0,
+        percentile(times, 0.5) * 1000, percentile(times, 0.99) * 1000), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped binary form of the GSQ OCR Report Index.
+
+The binary file is written once from the JSON Index and is never changed afterwards,
+so every Streamlit server process can map the same file: the operating system keeps
+one copy of it in the page cache, and a lookup only reads the pages it touches.
+Opening the file takes milliseconds, as nothing is parsed up front.
+
+File layout (all numbers little-endian):
+
+    header            magic, format version, counts and the offset of each region
+    meta              JSON (Index version, source URL)
+    PID table         (reports + 1) uint32 offsets, then the UTF-8 report PIDs
+    term dictionary   one fixed-size record per term, sorted by term, then the
+                      UTF-8 terms
+    postings          uint32 report IDs; each term's sorted postings are a slice
+    bitmaps           serialised Bitmap containers for the dense terms
+
+Convert a JSON Index (local file, .gz snapshot or URL) with:
+    python -m gsq_search.binary_index v02_GSQ_OCR_index_single_plus_ngrams.json v02.gsqidx
+
+"""
+
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from gsq_search import bitmap
+from gsq_search.bitmap import Bitmap
+from gsq_search.compact_index import CompactIndexBuilder
+from gsq_search.index_cache import IndexCache
+from gsq_search.index_stream import iter_file, stream_index
+from gsq_search.postings import id_type
+
+
+magic = b'GSQIDX01'
+format_version = 1
+
+# magic, format version, reports, terms, then the offset of each region:
+# meta, meta length, PID offsets, PID data, term records, term data, postings, bitmaps
+_header = struct.Struct('<8sIII4xQQQQQQQQ')
+# term offset, term length, report count (df), kind, postings offset, postings length
+_record = struct.Struct('<QIIIxxxxQQ')
+# container: high 16 bits, kind, number of IDs (array containers)
+_container = struct.Struct('<III')
+
+kind_array = 0
+kind_bitmap = 1
+_container_array = 0
+_container_bits = 1
+
+_native_little = sys.byteorder == 'little'
+
+
+class BinaryIndexError(ValueError):
+    """Raised when a file isn't a binary Index this code can read."""
+
+
+def _align(f, size=8):
+    pad = -f.tell() % size
+    if pad:
+        f.write(b'\0' * pad)
+
+
+def _write_bitmap(f, bits):
+    containers = bits.containers
+    f.write(struct.pack('<I', len(containers)))
+    for high in sorted(containers):
+        container = containers[high]
+        if isinstance(container, int):
+            f.write(_container.pack(high, _container_bits, 0))
+            f.write(container.to_bytes(8192, 'little'))
+        else:
+            lows = array('H', container)
+            if not _native_little:
+                lows.byteswap()
+            f.write(_container.pack(high, _container_array, len(lows)))
+            f.write(lows.tobytes())
+            _align(f, 4)
+
+
+def _read_bitmap(buf, pos):
+    (count,) = struct.unpack_from('<I', buf, pos)
+    pos += 4
+    containers = {}
+    for _ in range(count):
+        high, kind, length = _container.unpack_from(buf, pos)
+        pos += _container.size
+        if kind == _container_bits:
+            containers[high] = int.from_bytes(buf[pos:pos + 8192], 'little')
+            pos += 8192
+        else:
+            lows = array('H')
+            lows.frombytes(buf[pos:pos + 2 * length])
+            if not _native_little:
+                lows.byteswap()
+            containers[high] = lows
+            pos += 2 * length + (-2 * length % 4)
+    return Bitmap(containers)
+
+
+def write_binary_index(index, path, meta=None):
+    """Write a CompactIndex to `path` in the binary format.
+
+    The file is written to a temporary name and moved into place, so processes
+    that already have the old file open keep a consistent view of it.
+    """
+    meta = dict(meta or {})
+    meta.setdefault('version', index.version)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * _header.size)
+
+            meta_offset = f.tell()
+            meta_bytes = json.dumps(meta).encode('utf-8')
+            f.write(meta_bytes)
+            _align(f)
+
+            # PID table
+            pid_bytes = [pid.encode('utf-8') for pid in index.pids]
+            offsets = array('I', [0])
+            for data in pid_bytes:
+                offsets.append(offsets[-1] + len(data))
+            if not _native_little:
+                offsets.byteswap()
+            pid_offsets = f.tell()
+            f.write(offsets.tobytes())
+            pid_data = f.tell()
+            for data in pid_bytes:
+                f.write(data)
+            del pid_bytes
+            _align(f)
+
+            # postings and bitmaps go after the term dictionary, so work out their
+            # offsets first and fill the records in as they're written
+            term_bytes = [term.encode('utf-8') for term in index.terms]
+            term_records = f.tell()
+            f.write(b'\0' * (_record.size * len(term_bytes)))
+            term_data = f.tell()
+            term_offsets = []
+            for data in term_bytes:
+                term_offsets.append(f.tell() - term_data)
+                f.write(data)
+            _align(f)
+
+            records = []
+            postings_offset = f.tell()
+            for i, term in enumerate(index.terms):
+                ids = index.postings(term)
+                if isinstance(ids, Bitmap):
+                    records.append([kind_bitmap, len(ids), None, None])
+                    continue
+                start = f.tell() - postings_offset
+                if _native_little:
+                    f.write(ids)
+                else:
+                    ids = array(id_type, ids)
+                    ids.byteswap()
+                    f.write(ids.tobytes())
+                records.append([kind_array, len(ids), start, len(ids)])
+            _align(f)
+
+            bitmaps_offset = f.tell()
+            for i, term in enumerate(index.terms):
+                if records[i][0] == kind_bitmap:
+                    start = f.tell() - bitmaps_offset
+                    _write_bitmap(f, index.postings(term))
+                    records[i][2] = start
+                    records[i][3] = f.tell() - bitmaps_offset - start
+
+            f.seek(term_records)
+            for i, data in enumerate(term_bytes):
+                kind, df, start, length = records[i]
+                f.write(_record.pack(term_offsets[i], len(data), df, kind, start, length))
+
+            f.seek(0)
+            f.write(_header.pack(
+                magic, format_version, len(index.pids), len(term_bytes),
+                meta_offset, len(meta_bytes), pid_offsets, pid_data,
+                term_records, term_data, postings_offset, bitmaps_offset))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class _TermList:
+    """Sorted terms of a MappedIndex, decoded from the file one at a time."""
+
+    def __init__(self, mapped):
+        self._mapped = mapped
+
+    def __len__(self):
+        return self._mapped._term_count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._mapped._term(i)
+
+    def __iter__(self):
+        return map(self._mapped._term, range(len(self)))
+
+
+class MappedIndex:
+    """Read-only Index backed by a memory-mapped binary file.
+
+    Offers the same lookups as CompactIndex; postings are zero-copy views of the
+    mapped file, and report PIDs and terms are decoded only when asked for.
+    """
+
+    def __init__(self, path, data=None):
+        # `data` (the file's bytes, already read) is used instead of mapping `path`
+        self.path = path
+        self._file = self._map = None
+        if data is None:
+            self._file = open(path, 'rb')
+            try:
+                data = self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._file.close()
+                raise BinaryIndexError('%s is empty' % path)
+        buf = self._buf = memoryview(data)
+        if len(buf) < _header.size:
+            self.close()
+            raise BinaryIndexError('%s is too short to be a binary Index' % path)
+        (file_magic, version, self._pid_count, self._term_count,
+         meta_offset, meta_length, self._pid_offsets, self._pid_data,
+         self._term_records, self._term_data, self._postings_offset,
+         self._bitmaps_offset) = _header.unpack_from(buf, 0)
+        if file_magic != magic or version != format_version:
+            self.close()
+            raise BinaryIndexError('%s is not a version %d binary Index' % (path, format_version))
+        self.meta = json.loads(bytes(buf[meta_offset:meta_offset + meta_length]).decode('utf-8'))
+        self.version = self.meta.get('version')
+        self._offsets = self._uint32s(self._pid_offsets, self._pid_count + 1)
+        self.terms = _TermList(self)
+
+    def close(self):
+        # views of the map must be released before it can be closed
+        for name in ('_offsets', '_buf'):
+            view = getattr(self, name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+
+    def _uint32s(self, offset, count):
+        data = self._buf[offset:offset + 4 * count]
+        if _native_little:
+            return data.cast(id_type)
+        ids = array(id_type, data.tobytes())
+        ids.byteswap()
+        return ids
+
+    def _record(self, i):
+        return _record.unpack_from(self._buf, self._term_records + i * _record.size)
+
+    def _term(self, i):
+        offset, length = _record.unpack_from(self._buf, self._term_records + i * _record.size)[:2]
+        start = self._term_data + offset
+        return bytes(self._buf[start:start + length]).decode('utf-8')
+
+    @property
+    def doc_count(self):
+        return self._pid_count
+
+    def __len__(self):
+        return self._term_count
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return self.terms
+
+    def _ordinal(self, term):
+        i = bisect_left(self.terms, term)
+        if i < self._term_count and self._term(i) == term:
+            return i
+        return -1
+
+    def __contains__(self, term):
+        return self._ordinal(term) >= 0
+
+    def postings(self, term):
+        """Sorted report IDs for `term` (a view of the file, or a Bitmap). Raises KeyError."""
+        i = self._ordinal(term)
+        if i < 0:
+            raise KeyError(term)
+        _, _, df, kind, start, length = self._record(i)
+        if kind == kind_bitmap:
+            return _read_bitmap(self._buf, self._bitmaps_offset + start)
+        return self._uint32s(self._postings_offset + start, length)
+
+    def get_postings(self, term, default=None):
+        try:
+            return self.postings(term)
+        except KeyError:
+            return default
+
+    def df(self, term):
+        i = self._ordinal(term)
+        return self._record(i)[2] if i >= 0 else 0
+
+    def term_dfs(self):
+        """Number of reports containing each term, in term order."""
+        records = self._buf[self._term_records:self._term_records + self._term_count * _record.size]
+        return [record[2] for record in _record.iter_unpack(records)]
+
+    def pid(self, report_id):
+        start = self._pid_data + self._offsets[report_id]
+        end = self._pid_data + self._offsets[report_id + 1]
+        return bytes(self._buf[start:end]).decode('utf-8')
+
+    def pids_for(self, report_ids):
+        return list(map(self.pid, report_ids))
+
+    @property
+    def pids(self):
+        return [self.pid(i) for i in range(self._pid_count)]
+
+    def __getitem__(self, term):
+        return self.pids_for(self.postings(term))
+
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def memory_usage(self):
+        """Size of the mapped file; it is shared by every process that maps it."""
+        size = len(self._buf)
+        return {'mapped_file': size, 'total': size}
+
+
+def convert(source, path, dense_fraction=None):
+    """Convert a JSON Index (file path, .gz snapshot or URL) into a binary Index file."""
+    if dense_fraction is None:
+        dense_fraction = bitmap.dense_fraction
+    builder = CompactIndexBuilder(dense_fraction)
+    version = source
+    if source.startswith(('http://', 'https://')):
+        cache = IndexCache()
+        with cache.open(source) as f:
+            _, stats = stream_index(iter_file(f), add=builder.add)
+        meta = cache.read_meta(source) or {}
+        version = meta.get('etag') or meta.get('last_modified') or source
+    else:
+        opener = gzip.open if source.endswith('.gz') else open
+        with opener(source, 'rb') as f:
+            _, stats = stream_index(iter_file(f), add=builder.add)
+    index = builder.finish(version=version)
+    write_binary_index(index, path, meta={'version': version, 'source': source})
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert the JSON GSQ OCR Report Index into the binary format.')
+    parser.add_argument('source', help='JSON Index file, .gz snapshot or URL')
+    parser.add_argument('output', help='binary Index file to write')
+    parser.add_argument('--dense-fraction', type=float, default=None,
+                        help='store terms found in at least this share of reports as bitmaps')
+    args = parser.parse_args(argv)
+    stats = convert(args.source, args.output, args.dense_fraction)
+    print('Converted %d terms (%.1f MB at %.1f MB/s) to %s' % (
+        stats.terms, stats.bytes_read / 1e6, stats.mb_per_s, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed bitmap postings for terms found in a large share of the reports.
+
+A Bitmap splits report IDs into containers of 65,536 by their top 16 bits (the same
+layout as Roaring bitmaps). A container with only a few IDs is kept as a sorted
+`array('H')` of the low 16 bits; once it holds more than 4,096 IDs it is kept as a
+65,536-bit Python int instead, so AND/OR/NOT between two dense containers run as
+single big-int operations.
+
+The Index keeps rare terms as sorted ID arrays and switches common terms to
+Bitmaps (see `dense_fraction`); gsq_search/postings.py combines the two.
+
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import compress, repeat
+from operator import not_, sub
+
+
+# a container switches from an array to a bitset above this many IDs
+array_limit = 4096
+
+# terms found in at least this share of all reports are stored as bitmaps.
+# A bitmap costs 1 bit per report, a sorted array 32 bits per posting, so 1/32
+# is where a bitmap becomes the smaller of the two.
+dense_fraction = 1 / 32
+
+_container_bits = 65536
+_container_bytes = _container_bits // 8
+
+# a bitset container is turned into 65,536 one-byte flags (0 or 1, lowest bit first)
+# to find or test its bits with C-level iteration instead of a Python loop per bit
+_digit_to_flag = bytes.maketrans(b'01', b'\x00\x01')
+_flag_to_digit = bytes.maketrans(b'\x00\x01', b'01')
+_invert_flags = bytes.maketrans(b'\x00\x01', b'\x01\x00')
+
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:
+    # Python before 3.10
+    def _popcount(value):
+        return bin(value).count('1')
+
+
+def _flags(value, keep=True):
+    """One byte per bit of a bitset container: 1 where set (or clear, with keep=False)."""
+    flags = format(value, '065536b')[::-1].encode('ascii').translate(_digit_to_flag)
+    return flags if keep else flags.translate(_invert_flags)
+
+
+def _from_flags(flags):
+    return int(flags.translate(_flag_to_digit)[::-1], 2)
+
+
+def _bits_to_ids(value, base=0, typecode='H'):
+    """Sorted positions (plus `base`) of the set bits of a bitset container."""
+    return array(typecode, compress(range(base, base + _container_bits), _flags(value)))
+
+
+def _lows_to_bits(lows, value=0):
+    """Set the bits of `lows` in a bitset container."""
+    flags = bytearray(_flags(value)) if value else bytearray(_container_bits)
+    deque(map(flags.__setitem__, lows, repeat(1)), maxlen=0)
+    return _from_flags(flags)
+
+
+def _select(lows, container, keep=True):
+    """Selectors for the `lows` that are (or with keep=False, are not) in a container."""
+    if isinstance(container, int):
+        return map(_flags(container, keep).__getitem__, lows)
+    found = map(set(container).__contains__, lows)
+    return found if keep else map(not_, found)
+
+
+def _tidy(container):
+    """Store a container the cheaper way, or return None if it is empty."""
+    if isinstance(container, int):
+        count = _popcount(container)
+        if count == 0:
+            return None
+        if count <= array_limit:
+            return _bits_to_ids(container)
+        return container
+    if not container:
+        return None
+    if len(container) > array_limit:
+        return _lows_to_bits(container)
+    return container
+
+
+class Bitmap:
+    """Sorted set of report IDs stored in 65,536-ID containers."""
+
+    __slots__ = ('containers',)
+
+    def __init__(self, containers=None):
+        # high 16 bits -> array('H') of low bits, or an int bitset
+        self.containers = containers or {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Bitmap of a sorted sequence of report IDs."""
+        containers = {}
+        n = len(ids)
+        start = 0
+        while start < n:
+            high = ids[start] >> 16
+            end = bisect_left(ids, (high + 1) << 16, start)
+            lows = array('H', map(sub, ids[start:end], repeat(high << 16)))
+            containers[high] = _tidy(lows)
+            start = end
+        return cls(containers)
+
+    def __len__(self):
+        return sum(_popcount(c) if isinstance(c, int) else len(c) for c in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __iter__(self):
+        return iter(self.to_array())
+
+    def __contains__(self, report_id):
+        container = self.containers.get(report_id >> 16)
+        if container is None:
+            return False
+        low = report_id & 0xFFFF
+        if isinstance(container, int):
+            return bool(container >> low & 1)
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def to_array(self, typecode='I'):
+        """The report IDs as a sorted array."""
+        out = array(typecode)
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            base = high << 16
+            if isinstance(container, int):
+                out.extend(_bits_to_ids(container, base, typecode))
+            else:
+                out.extend(map(base.__add__, container))
+        return out
+
+    def rank(self, report_id):
+        """Number of IDs in the bitmap below `report_id`."""
+        high, low = report_id >> 16, report_id & 0xFFFF
+        count = 0
+        for key, container in self.containers.items():
+            if key < high:
+                count += _popcount(container) if isinstance(container, int) else len(container)
+            elif key == high:
+                count += _popcount(container & ((1 << low) - 1)) if isinstance(container, int) else bisect_left(container, low)
+        return count
+
+    def slice(self, start, stop, typecode='I'):
+        """The report IDs at positions `start` to `stop` of `to_array()`, without
+        making the whole array.
+        """
+        out = array(typecode)
+        seen = 0
+        for high in sorted(self.containers):
+            if seen >= stop:
+                break
+            container = self.containers[high]
+            size = _popcount(container) if isinstance(container, int) else len(container)
+            if seen + size > start:
+                lo, hi = max(start - seen, 0), min(stop - seen, size)
+                base = high << 16
+                if isinstance(container, int):
+                    out.extend(_bits_to_ids(container, base, typecode)[lo:hi])
+                else:
+                    out.extend(map(base.__add__, container[lo:hi]))
+            seen += size
+        return out
+
+    def nbytes(self):
+        """Approximate memory used by the containers."""
+        return sum(_container_bytes if isinstance(c, int) else 2 * len(c) for c in self.containers.values())
+
+    def filter(self, ids, keep=True, typecode='I'):
+        """IDs of a sorted sequence that are (or with keep=False, are not) in this bitmap."""
+        out = array(typecode)
+        n = len(ids)
+        start = 0
+        while start < n:
+            high = ids[start] >> 16
+            end = bisect_left(ids, (high + 1) << 16, start)
+            chunk = ids[start:end]
+            container = self.containers.get(high)
+            if container is None:
+                if not keep:
+                    out.extend(chunk)
+            else:
+                lows = map(sub, chunk, repeat(high << 16))
+                out.extend(compress(chunk, _select(lows, container, keep)))
+            start = end
+        return out
+
+    def __and__(self, other):
+        containers = {}
+        for high in self.containers.keys() & other.containers.keys():
+            a = self.containers[high]
+            b = other.containers[high]
+            if isinstance(a, int) and isinstance(b, int):
+                result = a & b
+            elif isinstance(a, int) or isinstance(b, int):
+                bits, lows = (a, b) if isinstance(a, int) else (b, a)
+                result = array('H', compress(lows, _select(lows, bits)))
+            else:
+                result = array('H', compress(a, _select(a, b)))
+            result = _tidy(result)
+            if result is not None:
+                containers[high] = result
+        return Bitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for high, b in other.containers.items():
+            a = containers.get(high)
+            if a is None:
+                result = b
+            elif isinstance(a, int) and isinstance(b, int):
+                result = a | b
+            elif isinstance(a, int) or isinstance(b, int):
+                bits, lows = (a, b) if isinstance(a, int) else (b, a)
+                result = _lows_to_bits(lows, bits)
+            else:
+                result = _tidy(array('H', sorted(set(a).union(b))))
+            containers[high] = result
+        return Bitmap(containers)
+
+    def __sub__(self, other):
+        containers = {}
+        for high, a in self.containers.items():
+            b = other.containers.get(high)
+            if b is None:
+                result = a
+            elif isinstance(a, int) and isinstance(b, int):
+                result = a & ~b
+            elif isinstance(a, int):
+                # clear b's bits
+                result = a & ~_lows_to_bits(b)
+            else:
+                result = array('H', compress(a, _select(a, b, keep=False)))
+            result = _tidy(result)
+            if result is not None:
+                containers[high] = result
+        return Bitmap(containers)
+
+    def __eq__(self, other):
+        if isinstance(other, Bitmap):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return '<Bitmap %d report IDs in %d containers>' % (len(self), len(self.containers))
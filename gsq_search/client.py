@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+A Searcher that sends its searches to the HTTP search service (service.py).
+
+The app uses it instead of loading the Index itself when GSQ_SEARCH_SERVICE_URL is
+set (e.g. http://127.0.0.1:8765), so the app and the service's other clients share
+one warm Index and results cache. `RemoteSearcher` has the methods of Searcher the
+app uses, raising KeyError and QuerySyntaxError in the same way, over one pooled
+keep-alive `requests.Session`.
+
+Download files are kept by the RemoteSearcher (the least recently used dropped once
+they hold more than `max_export_bytes`), keyed on the search, its options, the file
+format and the version of the service's Index, so a page rerun doesn't fetch the
+same file again.
+
+"""
+
+import threading
+from collections import OrderedDict
+
+import requests
+
+from gsq_search import export
+from gsq_search.download import make_session
+from gsq_search.query import Operation, QuerySyntaxError, Term
+
+# seconds to wait for the service to answer
+timeout = 60
+
+# download files kept by each RemoteSearcher, in bytes
+max_export_bytes = 64 * 1024 * 1024
+
+_searchers = {}
+_lock = threading.Lock()
+
+
+def _empty_term(query):
+    """Whether a query tree has a Term with no text (e.g. a search box of '123'),
+    which a search expression can't say.
+    """
+    if isinstance(query, Operation):
+        return _empty_term(query.left) or _empty_term(query.right)
+    return isinstance(query, Term) and not query.text
+
+
+class RemoteResult:
+    """What the service says about a search (like a CachedResult, without the IDs)."""
+
+    def __init__(self, query, flags, body):
+        self.query = query
+        self.flags = flags
+        self.key = (query,) + flags
+        # of the service's Index
+        self.version = body.get('version')
+        self.count = body['count']
+        self.candidate = body['candidate']
+        self.expansions = [(e['pattern'], e['terms'], e['total']) for e in body['expansions']]
+
+    def __len__(self):
+        return self.count
+
+
+class RemoteSearcher:
+    """Searches run by the search service at `url`."""
+
+    def __init__(self, url, session=None):
+        self.url = url.rstrip('/')
+        self.session = session or make_session()
+        # (Index version, query, fuzzy, variants, format) -> download file
+        self._exports = OrderedDict()
+        self._export_bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, path, **params):
+        response = self.session.get(self.url + path, params=params, timeout=timeout)
+        if response.status_code in (400, 404):
+            try:
+                body = response.json()
+            except ValueError:
+                body = {}
+            if 'term' in body:
+                raise KeyError(body['term'])
+            if response.status_code == 400 and 'error' in body:
+                raise QuerySyntaxError(body['error'])
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _params(query, fuzzy, variants):
+        if _empty_term(query):
+            # not found, as in a local search (the service would read '' as a
+            # missing term)
+            raise KeyError('')
+        return {'q': str(query), 'fuzzy': int(bool(fuzzy)), 'variants': int(bool(variants))}
+
+    def search(self, query, fuzzy=False, variants=False):
+        params = self._params(query, fuzzy, variants)
+        body = self._get('/search', size=0, **params).json()
+        return RemoteResult(str(query), (bool(fuzzy), bool(variants)), body)
+
+    def count(self, query, fuzzy=False, variants=False):
+        return self._get('/count', **self._params(query, fuzzy, variants)).json()['count']
+
+    def page(self, result, number, size=export.page_size):
+        params = self._params(result.query, *result.flags)
+        return self._get('/search', page=number, size=size, **params).json()['pids']
+
+    def export(self, result, fmt='csv'):
+        """A result from `search` as a file in one of `export.formats`, fetched the
+        first time it is asked for.
+        """
+        key = (result.version,) + result.key + (fmt,)
+        with self._lock:
+            data = self._exports.get(key)
+            if data is not None:
+                self._exports.move_to_end(key)
+                return data
+        data = self._get('/pids', format=fmt, **self._params(result.query, *result.flags)).content
+        with self._lock:
+            if key not in self._exports and len(data) <= max_export_bytes:
+                self._exports[key] = data
+                self._export_bytes += len(data)
+                while self._export_bytes > max_export_bytes:
+                    self._export_bytes -= len(self._exports.popitem(last=False)[1])
+        return data
+
+    def suggest(self, word):
+        try:
+            return self._get('/suggest', word=word).json()['suggestions']
+        except requests.RequestException:
+            return []
+
+    def complete(self, prefix, limit=10):
+        try:
+            body = self._get('/complete', prefix=prefix, limit=limit).json()
+        except requests.RequestException:
+            return []
+        return [(found['term'], found['reports']) for found in body['completions']]
+
+
+def remote_searcher(url):
+    """The process-wide RemoteSearcher for the service at `url`, so every session
+    shares its connections.
+    """
+    with _lock:
+        searcher = _searchers.get(url)
+        if searcher is None:
+            searcher = _searchers[url] = RemoteSearcher(url)
+        return searcher
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Compact integer-ID form of the GSQ OCR Report Index.
+
+The JSON Index maps each term to a list of report PID strings, so the same PID is
+repeated across a great many postings lists. The compact form has three parts:
+
+    PID table          each report PID stored once, sorted; a report's ID is its
+                       position in the table
+    term dictionary    the sorted list of terms
+    postings           one `array('I')` of uint32 report IDs, with each term's
+                       sorted postings stored as a slice of it
+
+Because the PID table is sorted, sorted report IDs map straight back to sorted PIDs,
+so lookups return the same (sorted) PID lists the app has always shown.
+
+Terms found in a large share of the reports are kept as compressed Bitmaps rather
+than postings slices (see gsq_search/bitmap.py and `dense_fraction`).
+
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+
+from gsq_search import bitmap
+from gsq_search.bitmap import Bitmap
+from gsq_search.postings import id_type
+
+
+class CompactIndex:
+    """Read-only term -> report ID postings over a shared PID table."""
+
+    def __init__(self, pids, terms, starts, lengths, postings, bitmaps=None, version=None):
+        self.pids = pids
+        self.terms = terms
+        self._starts = starts
+        self._lengths = lengths
+        self._postings = postings
+        self._view = memoryview(postings)
+        # term ordinal -> Bitmap, for the dense terms
+        self._bitmaps = bitmaps or {}
+        self.version = version
+
+    @property
+    def doc_count(self):
+        """Number of reports in the PID table."""
+        return len(self.pids)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return self.terms
+
+    def _ordinal(self, term):
+        i = bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return i
+        return -1
+
+    def __contains__(self, term):
+        return self._ordinal(term) >= 0
+
+    def postings(self, term):
+        """Sorted report IDs for `term`, as a zero-copy view or a Bitmap. Raises KeyError."""
+        i = self._ordinal(term)
+        if i < 0:
+            raise KeyError(term)
+        if i in self._bitmaps:
+            return self._bitmaps[i]
+        start = self._starts[i]
+        return self._view[start:start + self._lengths[i]]
+
+    def get_postings(self, term, default=None):
+        try:
+            return self.postings(term)
+        except KeyError:
+            return default
+
+    def df(self, term):
+        """Number of reports containing `term` (0 if it isn't in the Index)."""
+        i = self._ordinal(term)
+        return self._lengths[i] if i >= 0 else 0
+
+    def term_dfs(self):
+        """Number of reports containing each term, in term order."""
+        return self._lengths
+
+    def pid(self, report_id):
+        return self.pids[report_id]
+
+    def pids_for(self, report_ids):
+        """Report PIDs for a sequence of report IDs (sorted IDs give sorted PIDs)."""
+        return list(map(self.pids.__getitem__, report_ids))
+
+    def __getitem__(self, term):
+        """Sorted report PIDs containing `term`, like the JSON Index. Raises KeyError."""
+        return self.pids_for(self.postings(term))
+
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def memory_usage(self):
+        """Approximate size in bytes of each part of the index."""
+        pid_table = sys.getsizeof(self.pids) + sum(map(sys.getsizeof, self.pids))
+        term_dictionary = (sys.getsizeof(self.terms) + sum(map(sys.getsizeof, self.terms))
+                           + sys.getsizeof(self._starts) + sys.getsizeof(self._lengths))
+        postings = sys.getsizeof(self._postings)
+        bitmaps = sys.getsizeof(self._bitmaps) + sum(b.nbytes() for b in self._bitmaps.values())
+        return {
+            'pid_table': pid_table,
+            'term_dictionary': term_dictionary,
+            'postings': postings,
+            'bitmaps': bitmaps,
+            'dense_terms': len(self._bitmaps),
+            'total': pid_table + term_dictionary + postings + bitmaps,
+        }
+
+
+class CompactIndexBuilder:
+    """Builds a CompactIndex one `(term, pids)` entry at a time.
+
+    `add` fits the callback of `index_stream.stream_index`, so the index is built
+    straight from the file without a dict-of-lists in between.
+
+    Terms found in at least `dense_fraction` of the reports are stored as Bitmaps;
+    pass `dense_fraction=None` to keep every term as a sorted array.
+    """
+
+    def __init__(self, dense_fraction=bitmap.dense_fraction):
+        self.dense_fraction = dense_fraction
+        self._reset()
+
+    def _reset(self):
+        self._pid_ids = {}
+        self._pids = []
+        self._terms = []
+        self._starts = array('Q')
+        self._lengths = array(id_type)
+        self._postings = array(id_type)
+
+    def add(self, term, pids):
+        pid_ids = self._pid_ids
+        # report IDs in first-seen order for now; renumbered by finish()
+        for pid in set(pids).difference(pid_ids):
+            pid_ids[pid] = len(self._pids)
+            self._pids.append(pid)
+        self._terms.append(term)
+        self._starts.append(len(self._postings))
+        self._lengths.append(len(pids))
+        self._postings.extend(map(pid_ids.__getitem__, pids))
+
+    def finish(self, version=None):
+        """Renumber reports in sorted PID order, sort every postings list and the terms."""
+        pids = self._pids
+        order = sorted(range(len(pids)), key=pids.__getitem__)
+        renumber = array(id_type, bytes(4 * len(pids)))
+        for new_id, old_id in enumerate(order):
+            renumber[old_id] = new_id
+        sorted_pids = [pids[i] for i in order]
+
+        # postings are rewritten in place (dense terms move out to bitmaps and the
+        # rest close up), so no second copy is made
+        dense_df = len(pids) * self.dense_fraction if self.dense_fraction else None
+        postings = self._postings
+        starts = self._starts
+        lengths = self._lengths
+        dense = {}
+        write = 0
+        for i, start in enumerate(starts):
+            end = start + lengths[i]
+            ids = sorted(set(map(renumber.__getitem__, postings[start:end])))
+            # a PID listed twice for a term is only kept once
+            lengths[i] = len(ids)
+            if dense_df is not None and len(ids) >= dense_df:
+                dense[i] = Bitmap.from_ids(ids)
+                starts[i] = write
+                continue
+            postings[write:write + len(ids)] = array(id_type, ids)
+            starts[i] = write
+            write += len(ids)
+        del postings[write:]
+
+        term_order = sorted(range(len(self._terms)), key=self._terms.__getitem__)
+        index = CompactIndex(
+            pids=sorted_pids,
+            terms=[self._terms[i] for i in term_order],
+            starts=array('Q', (starts[i] for i in term_order)),
+            lengths=array(id_type, (lengths[i] for i in term_order)),
+            postings=postings,
+            bitmaps={new: dense[old] for new, old in enumerate(term_order) if old in dense},
+            version=version,
+        )
+        # the index now owns the postings array
+        self._reset()
+        return index
+
+
+def from_dict(index, version=None, dense_fraction=bitmap.dense_fraction):
+    """Build a CompactIndex from a term -> report PID list dict."""
+    builder = CompactIndexBuilder(dense_fraction)
+    for term, pids in index.items():
+        builder.add(term, pids)
+    return builder.finish(version)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel, resumable download of a large S3 object in byte ranges.
+
+The object is split into `range_size` pieces that a pool of threads downloads at the
+same time over one pooled `requests.Session`, each writing straight into its place in
+a `.part` file. A small `.part.json` state file next to it records which pieces are
+complete, so a download that fails or is interrupted carries on from where it
+stopped the next time, as long as the object (its ETag and size) hasn't changed.
+Range requests are sent with If-Match, so a new version published part way through
+is noticed instead of being mixed with the old one.
+
+Progress is reported as `progress(stage, done, total)`, always from the calling
+thread (Streamlit elements can't be updated from the worker threads).
+
+"""
+
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+# download the object in pieces of this size
+range_size = 8 * 1024 * 1024
+
+# pieces downloaded at the same time
+workers = 8
+
+# attempts per piece before the download is given up (and left to resume later)
+retries = 3
+
+_md5_etag = re.compile(r'^(?:W/)?"?([0-9a-fA-F]{32})"?$')
+
+
+class DownloadError(RuntimeError):
+    """Raised when a ranged download can't be completed or fails its checksum."""
+
+
+class ObjectChanged(DownloadError):
+    """Raised when the object was replaced on S3 part way through a download."""
+
+
+def make_session(pool_size=workers):
+    """A requests Session that keeps up to `pool_size` connections open per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def etag_md5(etag):
+    """The MD5 hex digest an S3 ETag stands for, or None.
+
+    The ETag of an object uploaded in one piece is the MD5 of its contents;
+    multipart uploads ('<hash>-<parts>') don't have a usable checksum.
+    """
+    match = _md5_etag.match(etag or '')
+    return match.group(1).lower() if match else None
+
+
+class RangedDownload:
+    """Download `url` (of `size` bytes, with `etag`) into `part_path` in parallel ranges."""
+
+    def __init__(self, url, part_path, size, etag=None, session=None,
+                 workers=workers, range_size=range_size, timeout=60):
+        self.url = url
+        self.part_path = part_path
+        self.state_path = part_path + '.json'
+        self.size = size
+        self.etag = etag
+        self.session = session or make_session(workers)
+        self.workers = workers
+        self.range_size = range_size
+        self.timeout = timeout
+
+    @property
+    def pieces(self):
+        return (self.size + self.range_size - 1) // self.range_size
+
+    def _piece_bytes(self, i):
+        return min(self.size, (i + 1) * self.range_size) - i * self.range_size
+
+    def _load_state(self):
+        """Pieces already downloaded by an earlier attempt at the same object."""
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return set()
+        if (state.get('etag') != self.etag or state.get('size') != self.size
+                or state.get('range_size') != self.range_size
+                or not os.path.exists(self.part_path)
+                or os.path.getsize(self.part_path) != self.size):
+            return set()
+        return set(state.get('done', []))
+
+    def _save_state(self, done):
+        state = {'url': self.url, 'etag': self.etag, 'size': self.size,
+                 'range_size': self.range_size, 'done': sorted(done)}
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _fetch(self, i):
+        start = i * self.range_size
+        end = start + self._piece_bytes(i) - 1
+        headers = {'Range': 'bytes=%d-%d' % (start, end)}
+        if self.etag:
+            headers['If-Match'] = self.etag
+        for attempt in range(1, retries + 1):
+            try:
+                with self.session.get(self.url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 412:
+                        raise ObjectChanged('The Index changed during the download')
+                    if response.status_code >= 500:
+                        # S3 asking to slow down, or a passing error: try the range again
+                        raise requests.HTTPError('Range request returned %s' % response.status_code)
+                    if response.status_code != 206:
+                        raise DownloadError('Range request returned %s' % response.status_code)
+                    written = 0
+                    with open(self.part_path, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in response.iter_content(1024 * 1024):
+                            f.write(chunk)
+                            written += len(chunk)
+                if written != end - start + 1:
+                    raise requests.ConnectionError('Range %d-%d ended after %d bytes' % (start, end, written))
+                return i
+            except requests.RequestException as error:
+                if attempt == retries:
+                    raise
+                logger.info('Retrying bytes %d-%d of the Index (%s)', start, end, error)
+
+    def run(self, progress=None):
+        """Download the missing pieces and return the path of the complete `.part` file.
+
+        Raises DownloadError (or a requests exception) if any piece can't be downloaded;
+        the pieces that did complete are kept for the next attempt.
+        """
+        done = self._load_state()
+        if not done:
+            with open(self.part_path, 'wb') as f:
+                f.truncate(self.size)
+        else:
+            logger.info('Resuming the Index download, %d of %d pieces already done', len(done), self.pieces)
+        received = sum(map(self._piece_bytes, done))
+        if progress:
+            progress('download', received, self.size)
+
+        error = None
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = [pool.submit(self._fetch, i) for i in range(self.pieces) if i not in done]
+            for future in as_completed(futures):
+                try:
+                    i = future.result()
+                except Exception as e:
+                    # let the other pieces finish so they are kept for resuming
+                    error = error or e
+                    continue
+                done.add(i)
+                self._save_state(done)
+                received += self._piece_bytes(i)
+                if progress:
+                    progress('download', received, self.size)
+        if error is not None:
+            if isinstance(error, ObjectChanged):
+                # the pieces already downloaded belong to the old version
+                self.discard()
+            if isinstance(error, DownloadError):
+                raise error
+            raise DownloadError('Could not download the Index: %s' % error) from error
+        return self.part_path
+
+    def discard(self):
+        """Remove the `.part` file and its state."""
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.unlink(path)
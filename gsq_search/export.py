@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Pages and downloads of search results, made from the report IDs a piece at a time.
+
+A search result is kept as sorted report IDs (an array, or a Bitmap for very common
+terms; see result_cache.py). Sorted IDs give sorted PIDs, so the PIDs of one page
+of results are those of one slice of the IDs: `page` turns only that slice into
+PIDs, however many reports matched. (An Index made of segments merges the PIDs of
+its segments instead; see segments.py.)
+
+`iter_csv` yields a result's CSV (the same as the app's pandas CSV always was) in
+chunks of `chunk_size` reports, and `iter_batches` yields it as Arrow record
+batches for Parquet and Arrow IPC files, so a result is never held as a list of
+every PID, a DataFrame and a CSV string at once. Parquet and Arrow need the
+optional pyarrow package (installed with Streamlit).
+
+"""
+
+import csv
+import io
+from itertools import islice
+
+from gsq_search.bitmap import Bitmap
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # only needed for the Parquet and Arrow downloads
+    pyarrow = None
+
+
+# reports per page of results shown in the app
+page_size = 200
+
+# reports turned into PIDs (and CSV rows or an Arrow batch) at a time
+chunk_size = 10000
+
+# download formats: (file extension, MIME type)
+formats = {
+    'csv': ('csv', 'text/csv'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.stream'),
+}
+
+
+def available_formats():
+    """Download formats that can be made here (Parquet and Arrow need pyarrow)."""
+    return [name for name in formats if name == 'csv' or pyarrow is not None]
+
+
+def ids_slice(ids, start, stop):
+    """The report IDs at positions `start` to `stop` of a result."""
+    if isinstance(ids, Bitmap):
+        return ids.slice(start, stop)
+    return ids[start:stop]
+
+
+def page_count(count, size=page_size):
+    return max(1, (count + size - 1) // size)
+
+
+def page(index, ids, number, size=page_size):
+    """Sorted report PIDs on page `number` (from 1) of a result."""
+    start = (number - 1) * size
+    if hasattr(index, 'page_pids'):
+        return index.page_pids(ids, start, start + size)
+    return index.pids_for(ids_slice(ids, start, start + size))
+
+
+def iter_pids(index, ids, chunk=chunk_size):
+    """Lists of at most `chunk` sorted report PIDs, covering a whole result."""
+    if hasattr(index, 'iter_pids'):
+        pids = index.iter_pids(ids, chunk)
+        part = list(islice(pids, chunk))
+        while part:
+            yield part
+            part = list(islice(pids, chunk))
+        return
+    for start in range(0, len(ids), chunk):
+        yield index.pids_for(ids_slice(ids, start, start + chunk))
+
+
+def _columns(candidate):
+    return ['report_pid', 'match'] if candidate else ['report_pid']
+
+
+def iter_csv(index, ids, candidate=False, chunk=chunk_size):
+    """The CSV of a result as UTF-8 byte strings, `chunk` reports at a time.
+
+    Has a 'report_pid' column, and a 'match' column of 'candidate' for results of
+    phrases matched from their word pairs and triples.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(_columns(candidate))
+    for pids in iter_pids(index, ids, chunk):
+        if candidate:
+            writer.writerows((pid, 'candidate') for pid in pids)
+        else:
+            writer.writerows([pid] for pid in pids)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _schema(candidate):
+    return pyarrow.schema([(name, pyarrow.string()) for name in _columns(candidate)])
+
+
+def iter_batches(index, ids, candidate=False, chunk=chunk_size):
+    """Arrow record batches of a result, `chunk` reports at a time (needs pyarrow)."""
+    schema = _schema(candidate)
+    for pids in iter_pids(index, ids, chunk):
+        columns = [pyarrow.array(pids, pyarrow.string())]
+        if candidate:
+            columns.append(pyarrow.array(['candidate'] * len(pids), pyarrow.string()))
+        yield pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ImportError('Parquet and Arrow downloads need the pyarrow package')
+
+
+def write_parquet(index, ids, sink, candidate=False, chunk=chunk_size):
+    """Write a result to a Parquet file (a path or a binary file object), one row
+    group per `chunk` reports.
+    """
+    _require_pyarrow()
+    with pyarrow.parquet.ParquetWriter(sink, _schema(candidate)) as writer:
+        for batch in iter_batches(index, ids, candidate, chunk):
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+
+
+def write_arrow(index, ids, sink, candidate=False, chunk=chunk_size):
+    """Write a result as an Arrow IPC stream (a path or a binary file object)."""
+    _require_pyarrow()
+    with pyarrow.ipc.new_stream(sink, _schema(candidate)) as writer:
+        for batch in iter_batches(index, ids, candidate, chunk):
+            writer.write_batch(batch)
+
+
+def export_bytes(index, ids, fmt='csv', candidate=False):
+    """A whole result as a file in one of `formats`, for a download button.
+
+    The file is held in memory; `iter_csv` gives the CSV a chunk at a time instead.
+    """
+    if fmt == 'csv':
+        return b''.join(iter_csv(index, ids, candidate))
+    sink = io.BytesIO()
+    if fmt == 'parquet':
+        write_parquet(index, ids, sink, candidate)
+    elif fmt == 'arrow':
+        write_arrow(index, ids, sink, candidate)
+    else:
+        raise ValueError('Unknown download format %r' % fmt)
+    return sink.getvalue()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Close spellings of a word from the Index's vocabulary, for OCR and typing errors.
+
+The reports were OCR'd from type-written, hand-annotated and stained pages, so a
+word is often misread by a letter or two, in the Index and in what is typed in
+the search box. `FuzzyIndex` finds the Index words within an edit distance of one
+or two (a letter inserted, removed, changed, or two neighbouring letters swapped)
+of a search word in a few milliseconds, with a symmetric-delete index (as in
+SymSpell): every word is stored under each string made by deleting up to
+`max_distance` of its letters, and a search word's own deletions are looked up in
+it. Only the first `prefix_length` letters of a word are used for its deletions,
+which keeps the index small without losing any match; each candidate is then
+checked against the whole word.
+
+The deletions are stored as one sorted array of 64-bit numbers, a hash of the
+deletion in the high half and the position of the word in the Index's sorted
+terms in the low half, instead of a dict of strings, which would take several
+times the memory. A hash collision only adds a candidate that fails the check.
+
+Only single words are indexed (not the word pairs and triples).
+
+"""
+
+import threading
+from array import array
+from bisect import bisect_left
+
+from gsq_search.term_dictionary import sorted_terms
+
+# the largest edit distance searched for
+max_distance = 2
+
+# letters of a word the deletions are made from
+prefix_length = 7
+
+# words shorter than this are matched within an edit distance of 1 only, as
+# nearly every short word is within 2 edits of many others
+long_word = 6
+
+# words shorter than this are only matched exactly
+short_word = 3
+
+# close spellings returned for a word
+max_matches = 20
+
+_lock = threading.Lock()
+
+
+def word_distance(word):
+    """Edit distance searched within for `word`, going by its length."""
+    if len(word) < short_word:
+        return 0
+    return 1 if len(word) < long_word else max_distance
+
+
+def _deletes(word, distance):
+    """`word` and every string made by deleting up to `distance` of its letters."""
+    found = {word}
+    edge = found
+    for _ in range(distance):
+        edge = {w[:i] + w[i + 1:] for w in edge for i in range(len(w))}
+        found |= edge
+    return found
+
+
+def _key(text):
+    return (hash(text) & 0xFFFFFFFF) << 32
+
+
+def edit_distance(a, b, limit):
+    """Edit distance between `a` and `b` counting a swap of neighbouring letters as
+    one edit (optimal string alignment), or `limit + 1` if it is more than `limit`.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    previous = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, row = previous, row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            best = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]
+                    and before[j - 2] + 1 < best):
+                best = before[j - 2] + 1
+            row[j] = best
+        if min(row) > limit:
+            return limit + 1
+    return row[-1] if row[-1] <= limit else limit + 1
+
+
+class FuzzyIndex:
+    """Symmetric-delete index of the single words among a sorted sequence of terms."""
+
+    def __init__(self, terms, max_distance=max_distance, prefix_length=prefix_length):
+        self.terms = terms
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        keys = []
+        words = 0
+        for i, term in enumerate(terms):
+            if ' ' in term:
+                continue
+            words += 1
+            keys.extend(_key(d) | i for d in _deletes(term[:prefix_length], max_distance))
+        keys.sort()
+        self.keys = array('Q', keys)
+        self.words = words
+
+    def memory_usage(self):
+        return self.keys.buffer_info()[1] * self.keys.itemsize
+
+    def _positions(self, text):
+        key = _key(text)
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + 0x100000000, lo)
+        return (k & 0xFFFFFFFF for k in self.keys[lo:hi])
+
+    def lookup(self, word, distance=None):
+        """`[(term, distance), ...]` of the Index words within `distance` edits of
+        `word` (by default `word_distance(word)`), closest first, with `word`
+        itself at distance 0 if it is an Index word.
+        """
+        if distance is None:
+            distance = word_distance(word)
+        distance = min(distance, self.max_distance)
+        positions = set()
+        for d in _deletes(word[:self.prefix_length], distance):
+            positions.update(self._positions(d))
+        matches = []
+        for i in positions:
+            term = self.terms[i]
+            found = edit_distance(word, term, distance)
+            if found <= distance:
+                matches.append((found, term))
+        matches.sort()
+        return [(term, found) for found, term in matches]
+
+
+def warm(index):
+    """Build the FuzzyIndex of an Index in a background thread (it takes a few seconds
+    for the full vocabulary), so it is ready by the time a search word isn't found.
+    """
+    if getattr(index, '_fuzzy_index', None) is None:
+        threading.Thread(target=fuzzy_index, args=(index,), name='gsq-fuzzy-index', daemon=True).start()
+
+
+def fuzzy_index(index):
+    """The FuzzyIndex of an Index, built the first time it is asked for and kept
+    with the Index.
+    """
+    fuzzy = getattr(index, '_fuzzy_index', None)
+    if fuzzy is None:
+        with _lock:
+            fuzzy = getattr(index, '_fuzzy_index', None)
+            if fuzzy is None:
+                fuzzy = index._fuzzy_index = FuzzyIndex(sorted_terms(index))
+    return fuzzy
+
+
+def close_matches(index, word, distance=None):
+    """Index words within `distance` edits of `word` (see `word_distance`), closest
+    and then most common first, including `word` itself if it is an Index word.
+    """
+    matches = fuzzy_index(index).lookup(word, distance)
+    df = index.df
+    matches.sort(key=lambda match: (match[1], -df(match[0])))
+    return [term for term, found in matches]
+
+
+def suggest(index, word, limit=max_matches):
+    """Close spellings of a search word that isn't in the Index ('did you mean')."""
+    word = ' '.join(word.split())
+    if not word or ' ' in word or '*' in word:
+        return []
+    return [term for term in close_matches(index, word) if term != word][:limit]
@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+"""
+Loading and sharing the GSQ OCR Report Index.
+
+The v02 Index covers over 83,000 reports plus frequent word pairs and triples, so it
+is loaded once per server process and handed to every Streamlit session and rerun
+by reference. Sessions treat it as read-only; a new index version is picked up by
+reloading the shared holder, which swaps in the new object without touching the
+one that running sessions may still be reading.
+
+"""
+
+import glob
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+from gsq_search import bitmap, metrics, segments, sharded_index
+from gsq_search.binary_index import BinaryIndexError, MappedIndex, write_binary_index
+from gsq_search.compact_index import CompactIndexBuilder, from_dict
+from gsq_search.index_cache import IndexCache
+from gsq_search.index_stream import iter_file, stream_index
+from gsq_search.sharded_index import ShardedIndex, write_sharded_index
+
+try:
+    import psutil
+except ImportError:  # only used to add the process RSS to the memory report
+    psutil = None
+
+
+logger = logging.getLogger(__name__)
+
+# the S3 OCR Index JSON file (stored as a JSON string)
+index_url = 'https://gsq-horizon.s3.ap-southeast-2.amazonaws.com/DATASETS/ds000079/v02_GSQ_OCR_index_single_plus_ngrams.json'
+
+# seconds a replaced index stays open for the searches still running on it
+retire_seconds = 60
+
+
+def _index_version(cache, url):
+    meta = cache.read_meta(url) or {}
+    return meta.get('etag') or meta.get('last_modified') or url
+
+
+def _reporting(chunks, raw, total, progress):
+    # report how far through the compressed snapshot the parse has got
+    for chunk in chunks:
+        yield chunk
+        progress('parse', raw.tell(), total)
+
+
+def _build_compact(snapshot, version, dense_fraction, progress=None):
+    builder = CompactIndexBuilder(dense_fraction)
+    with metrics.phase('index_decode'), open(snapshot, 'rb') as raw, gzip.GzipFile(fileobj=raw, mode='rb') as f:
+        chunks = iter_file(f)
+        if progress:
+            chunks = _reporting(chunks, raw, os.path.getsize(snapshot), progress)
+        _, stats = stream_index(chunks, add=builder.add)
+        compact = builder.finish(version=version)
+    logger.info('Loaded the Index: %r', stats)
+    metrics.observe_terms(len(compact))
+    return compact, stats
+
+
+def load_index_with_stats(url=index_url, cache=None, dense_fraction=bitmap.dense_fraction, progress=None):
+    """Return `(index, stats)`, where the index is an in-memory CompactIndex.
+
+    The file is read from the local snapshot cache, which only downloads it again
+    from S3 when the object has changed (see gsq_search/index_cache.py), and is
+    parsed in a single streaming pass (see gsq_search/index_stream.py) straight
+    into the compact form (see gsq_search/compact_index.py). Terms found in at least
+    `dense_fraction` of the reports are stored as Bitmaps (None turns this off).
+    """
+    cache = cache or IndexCache()
+    snapshot = cache.fetch(url, progress=progress)
+    return _build_compact(snapshot, _index_version(cache, url), dense_fraction, progress)
+
+
+def binary_index_path(cache, url, version, suffix='.gsqidx'):
+    """Where the binary form of one version of the cached snapshot of `url` is kept.
+
+    Each version gets its own file, so a new one can be written while running
+    processes still have the old one mapped (Windows won't replace a mapped file).
+    """
+    digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:8]
+    return '%s.%s%s' % (cache.snapshot_path(url)[:-len('.gz')], digest, suffix)
+
+
+def _remove_old_binaries(cache, url, keep, suffix='.gsqidx'):
+    for path in glob.glob(glob.escape(cache.snapshot_path(url)[:-len('.gz')]) + '.*' + suffix):
+        if path == keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            # still mapped by another process
+            pass
+
+
+def load_mapped_index_with_stats(url=index_url, cache=None, dense_fraction=bitmap.dense_fraction,
+                                 progress=None):
+    """Return `(index, stats)`, where the index is a memory-mapped MappedIndex.
+
+    The binary file next to the cached snapshot is opened directly when it was built
+    from the current Index version; otherwise it is rebuilt first (and `stats`
+    describes that parse, or is None). Every server process mapping the same file
+    shares one copy of it in the page cache (see gsq_search/binary_index.py).
+    """
+    cache = cache or IndexCache()
+    snapshot = cache.fetch(url, progress=progress)
+    version = _index_version(cache, url)
+    path = binary_index_path(cache, url, version)
+    try:
+        with metrics.phase('index_open'):
+            index = MappedIndex(path)
+        if index.version == version:
+            return index, None
+        index.close()
+    except (OSError, BinaryIndexError):
+        pass
+    compact, stats = _build_compact(snapshot, version, dense_fraction, progress)
+    with metrics.phase('index_write'):
+        write_binary_index(compact, path, meta={'version': version, 'source': url})
+    del compact
+    _remove_old_binaries(cache, url, keep=path)
+    with metrics.phase('index_open'):
+        return MappedIndex(path), stats
+
+
+def load_sharded_index_with_stats(url=index_url, cache=None, dense_fraction=bitmap.dense_fraction,
+                                  max_resident=sharded_index.max_resident_shards, progress=None):
+    """Return `(index, stats)`, where the index is a lazily loaded ShardedIndex.
+
+    Like `load_mapped_index_with_stats`, but the Index is written as term-range shards
+    next to the cached snapshot, and only the shard manifest is read here
+    (see gsq_search/sharded_index.py).
+    """
+    cache = cache or IndexCache()
+    snapshot = cache.fetch(url, progress=progress)
+    version = _index_version(cache, url)
+    directory = binary_index_path(cache, url, version, suffix='.shards')
+    try:
+        with metrics.phase('index_open'):
+            index = ShardedIndex(directory, max_resident)
+        if index.version == version:
+            return index, None
+    except (OSError, ValueError):
+        pass
+    compact, stats = _build_compact(snapshot, version, dense_fraction, progress)
+    try:
+        with metrics.phase('index_write'):
+            write_sharded_index(compact, directory, meta={'version': version, 'source': url})
+    except OSError:
+        # another server process finished writing this version first
+        if not os.path.isdir(directory):
+            raise
+    del compact
+    _remove_old_binaries(cache, url, keep=directory, suffix='.shards')
+    with metrics.phase('index_open'):
+        return ShardedIndex(directory, max_resident), stats
+
+
+# GSQ_INDEX_LAYOUT -> loader
+layouts = {
+    'mapped': load_mapped_index_with_stats,
+    'sharded': load_sharded_index_with_stats,
+    'memory': load_index_with_stats,
+}
+
+
+def _open_compacted(layout, path, version):
+    try:
+        if layout == 'mapped':
+            index = MappedIndex(path)
+        elif layout == 'sharded':
+            index = ShardedIndex(path)
+        else:
+            return None
+    except (OSError, ValueError, BinaryIndexError):
+        return None
+    if index.version == version:
+        return index
+    if layout == 'mapped':
+        index.close()
+    return None
+
+
+def _compactor(cache, segments_url, layout, version, dense_fraction):
+    """`compactor` for a SegmentedIndex: folds its segments into one index of the
+    GSQ_INDEX_LAYOUT, saved next to the cached segments list for the next process.
+    """
+    suffix = '.shards' if layout == 'sharded' else '.gsqidx'
+    path = binary_index_path(cache, segments_url, version, suffix)
+
+    def compactor(index):
+        compact = segments.compact(index, dense_fraction, version)
+        if layout == 'memory':
+            return compact
+        meta = {'version': version, 'source': segments_url}
+        if layout == 'mapped':
+            write_binary_index(compact, path, meta=meta)
+        else:
+            try:
+                write_sharded_index(compact, path, meta=meta)
+            except OSError:
+                # another server process finished writing this version first
+                if not os.path.isdir(path):
+                    raise
+        del compact
+        _remove_old_binaries(cache, segments_url, keep=path, suffix=suffix)
+        logger.info('Compacted %d Index segments into %s', len(index.segments), path)
+        return MappedIndex(path) if layout == 'mapped' else ShardedIndex(path)
+
+    return compactor
+
+
+def load_segmented_index_with_stats(segments_url, layout='mapped', cache=None,
+                                    dense_fraction=bitmap.dense_fraction, progress=None):
+    """Return `(index, stats)` for an Index published as a base and delta segments.
+
+    `segments_url` is a segments list (see gsq_search/segments.py). The base is loaded
+    with the `layout` loader, so it is only parsed again when it changes, and each
+    delta is parsed into memory; together they make a SegmentedIndex (`stats`
+    describes the base). Once its segments have been compacted (see SharedIndex),
+    later processes open the compacted index instead.
+    """
+    cache = cache or IndexCache()
+    with cache.open(segments_url) as f:
+        base_url, delta_urls = segments.read_segments_list(f)
+    if not delta_urls:
+        return layouts[layout](base_url, cache=cache, dense_fraction=dense_fraction, progress=progress)
+    cache.fetch(base_url, progress=progress)
+    snapshots = [cache.fetch(url) for url in delta_urls]
+    version = '+'.join(_index_version(cache, url) for url in [base_url] + delta_urls)
+    compactor = _compactor(cache, segments_url, layout, version, dense_fraction)
+    if layout != 'memory':
+        suffix = '.shards' if layout == 'sharded' else '.gsqidx'
+        index = _open_compacted(layout, binary_index_path(cache, segments_url, version, suffix), version)
+        if index is not None:
+            return index, None
+
+    base, stats = layouts[layout](base_url, cache=cache, dense_fraction=dense_fraction, progress=progress)
+    seen = set(base.pids)
+    deltas = []
+    for url, snapshot in zip(delta_urls, snapshots):
+        delta, _ = _build_compact(snapshot, _index_version(cache, url), dense_fraction)
+        delta = segments.without_reports(delta, seen, dense_fraction)
+        seen.update(delta.pids)
+        deltas.append(delta)
+    # not the compacted version: report IDs are numbered differently once compacted
+    index = segments.SegmentedIndex([base] + deltas, version='%s (%d segments)' % (version, len(delta_urls) + 1),
+                                    compactor=compactor)
+    return index, stats
+
+
+def load_shared_index_with_stats(url=index_url, progress=None):
+    """The loader used by `shared_index`, picked with GSQ_INDEX_LAYOUT (default 'mapped').
+
+    `progress(stage, done, total)` is called while the Index is downloaded ('download'
+    and 'store' stages, in bytes) and parsed ('parse', in compressed bytes).
+    """
+    layout = os.environ.get('GSQ_INDEX_LAYOUT', 'mapped')
+    if layout not in layouts:
+        raise ValueError('GSQ_INDEX_LAYOUT must be one of %s, not %r' % (', '.join(layouts), layout))
+    segments_url = os.environ.get('GSQ_INDEX_SEGMENTS_URL')
+    if segments_url:
+        return load_segmented_index_with_stats(segments_url, layout, progress=progress)
+    return layouts[layout](url, progress=progress)
+
+
+def load_index(url=index_url, cache=None):
+    """Return the Index as a term -> report PID list dict (the original JSON form)."""
+    cache = cache or IndexCache()
+    with cache.open(url) as f:
+        return stream_index(iter_file(f))[0]
+
+
+def memory_comparison(index):
+    """Compare the size of a term -> report PID list dict with its compact form."""
+    compact = from_dict(index)
+    dict_bytes = estimate_size(index)
+    compact_bytes = compact.memory_usage()['total']
+    return {
+        'dict_of_lists_bytes': dict_bytes,
+        'compact_bytes': compact_bytes,
+        'reduction': dict_bytes / compact_bytes if compact_bytes else None,
+    }
+
+
+def estimate_size(obj):
+    """Approximate deep size in bytes of a term -> postings mapping.
+
+    Shared objects (e.g. interned report PIDs) are only counted once.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        if isinstance(item, MappingProxyType):
+            item = dict(item)
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+def process_rss():
+    """Resident memory of this process in bytes, or None if it can't be measured."""
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def _close_later(index, delay=None, attempts=5):
+    """Close an index that has been replaced (releasing a mapped file and its file
+    descriptor), once the searches that picked it up before the swap have finished.
+    """
+    close = getattr(index, 'close', None)
+    if close is None:
+        return
+
+    def run():
+        for _ in range(attempts):
+            time.sleep(retire_seconds if delay is None else delay)
+            try:
+                close()
+                return
+            except BufferError:
+                # a search still holds postings from the mapped file
+                continue
+        logger.warning('Could not close the replaced Index; it is left to be garbage collected')
+
+    threading.Thread(target=run, name='gsq-close-index', daemon=True).start()
+
+
+class SharedIndex:
+    """Process-wide, read-only holder for the loaded Index.
+
+    The first caller loads the index; every later caller (any session, any rerun)
+    gets the same object back. `reload()` loads a fresh copy and swaps it in, and
+    `invalidate()` drops it so the next `get()` loads again. A replaced or dropped
+    index is closed `retire_seconds` later, when the searches using it are done.
+
+    `loader(url, progress)` returns `(index, stats)`, where `stats` is a LoadStats or
+    None; `progress` is the callback passed to `get()` or `reload()`, if any.
+
+    An index made of segments (see gsq_search/segments.py) is compacted in a
+    background thread, and the compacted index swapped in when it is ready, unless
+    GSQ_INDEX_COMPACT is 0.
+    """
+
+    def __init__(self, loader=load_shared_index_with_stats):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._index = None
+        self._url = None
+        self._loaded_at = None
+        self._load_seconds = None
+        self._load_stats = None
+
+    def is_loaded(self, url=index_url):
+        return self._index is not None and self._url == url
+
+    def get(self, url=index_url, progress=None):
+        """Return the shared index for `url`, loading it on first use.
+
+        `progress(stage, done, total)` is called as the index loads, if this caller
+        is the one loading it.
+        """
+        index = self._index
+        if index is not None and self._url == url:
+            metrics.cache_request('shared_index', 'hit')
+            return index
+        with self._lock:
+            # another session may have finished loading while we waited
+            if self._index is None or self._url != url:
+                metrics.cache_request('shared_index', 'load')
+                self._load(url, progress)
+            else:
+                metrics.cache_request('shared_index', 'hit')
+            return self._index
+
+    def reload(self, url=None, progress=None):
+        """Load the index again (e.g. after a new version is published) and swap it in."""
+        with self._lock:
+            self._load(url or self._url or index_url, progress)
+            return self._index
+
+    def invalidate(self):
+        """Drop the shared index so the next `get()` loads it again."""
+        with self._lock:
+            if self._index is not None:
+                _close_later(self._index)
+            self._index = None
+            self._url = None
+            self._loaded_at = None
+            self._load_seconds = None
+            self._load_stats = None
+
+    def _load(self, url, progress=None):
+        start = time.perf_counter()
+        with metrics.trace('index_load', url=url):
+            index, stats = self._loader(url, progress)
+        if isinstance(index, dict):
+            index = MappingProxyType(index)
+        if self._index is not None and self._index is not index:
+            _close_later(self._index)
+        self._index = index
+        self._url = url
+        self._loaded_at = time.time()
+        self._load_seconds = time.perf_counter() - start
+        self._load_stats = stats
+        if getattr(index, 'compactor', None) and os.environ.get('GSQ_INDEX_COMPACT', '1') != '0':
+            threading.Thread(target=self._compact, args=(index,), name='gsq-compact-index', daemon=True).start()
+
+    def _compact(self, index):
+        try:
+            compacted = index.compact()
+        except Exception:
+            logger.exception('Could not compact the Index segments')
+            return
+        with self._lock:
+            # unless the index was reloaded or dropped meanwhile
+            if self._index is index:
+                self._index = compacted
+                _close_later(index)
+
+    def memory_report(self, deep=False):
+        """Summary of the shared index and this process' memory use.
+
+        `deep=True` also walks the index to estimate its size, which takes a few
+        seconds on the full v02 Index.
+        """
+        index = self._index
+        report = {
+            'loaded': index is not None,
+            'url': self._url,
+            'loaded_at': self._loaded_at,
+            'load_seconds': self._load_seconds,
+            'parse_mb_per_s': self._load_stats.mb_per_s if self._load_stats else None,
+            'terms': len(index) if index is not None else 0,
+            'process_rss_bytes': process_rss(),
+            'resident_shards': len(index.resident_shards) if hasattr(index, 'resident_shards') else None,
+            'segments': len(index.segments) if hasattr(index, 'segments') else None,
+        }
+        if deep and index is not None:
+            if hasattr(index, 'memory_usage'):
+                report['index_bytes'] = index.memory_usage()['total']
+            else:
+                report['index_bytes'] = estimate_size(index)
+        return report
+
+
+# one holder per server process, shared by every session
+shared_index = SharedIndex()
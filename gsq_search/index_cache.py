@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Local on-disk cache of the GSQ OCR Report Index.
+
+A gzip-compressed snapshot of the S3 Index file is kept in a cache directory along
+with the ETag and Last-Modified headers it was downloaded with. On startup the
+snapshot is revalidated against S3 with a conditional request, and the file is only
+downloaded again when the object has changed. Large files are downloaded in parallel
+byte ranges that resume after an interruption, and checked against the MD5 in the
+S3 ETag before they replace the snapshot (see gsq_search/download.py).
+
+Settings (environment variables):
+    GSQ_INDEX_CACHE_DIR   cache directory (default ~/.cache/gsq_ocr_index)
+    GSQ_INDEX_OFFLINE=1   never contact S3; load the cached snapshot only
+
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import requests
+
+from gsq_search import download, metrics
+from gsq_search.download import DownloadError, RangedDownload, etag_md5, make_session
+
+
+logger = logging.getLogger(__name__)
+
+# read the response in 1 MB pieces so the download is never held in memory whole
+chunk_size = 1024 * 1024
+
+
+class IndexUnavailable(RuntimeError):
+    """Raised when the Index can't be downloaded and there is no cached copy."""
+
+
+def default_cache_dir():
+    return os.environ.get('GSQ_INDEX_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'gsq_ocr_index')
+
+
+def offline_mode():
+    return os.environ.get('GSQ_INDEX_OFFLINE') == '1'
+
+
+class IndexCache:
+    """Compressed local snapshots of remote Index files, keyed by URL."""
+
+    def __init__(self, cache_dir=None, offline=None, timeout=60, workers=download.workers):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.offline = offline_mode() if offline is None else offline
+        self.timeout = timeout
+        self.workers = workers
+        self._session = None
+
+    @property
+    def session(self):
+        # one pooled session per cache, re-used by every download and revalidation
+        if self._session is None:
+            self._session = make_session(self.workers)
+        return self._session
+
+    def snapshot_path(self, url):
+        # keep the file name readable, but make it unique to the URL
+        name = os.path.basename(url.split('?')[0]) or 'index.json'
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, digest + '_' + name + '.gz')
+
+    def meta_path(self, url):
+        return self.snapshot_path(url) + '.meta.json'
+
+    def read_meta(self, url):
+        try:
+            with open(self.meta_path(url), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def has_snapshot(self, url):
+        return os.path.exists(self.snapshot_path(url)) and self.read_meta(url) is not None
+
+    def fetch(self, url, session=None, progress=None):
+        """Return the path of an up-to-date snapshot of `url`.
+
+        Downloads only when S3 reports the object changed since the cached copy.
+        Falls back to the cached copy if S3 can't be reached. `progress(stage, done,
+        total)` is called as the download goes.
+        """
+        with metrics.phase('index_fetch'):
+            return self._fetch(url, session, progress)
+
+    def _fetch(self, url, session=None, progress=None):
+        path = self.snapshot_path(url)
+        cached = self.has_snapshot(url)
+        if self.offline:
+            if not cached:
+                raise IndexUnavailable('Offline mode is on and there is no cached Index in ' + self.cache_dir)
+            metrics.cache_request('index', 'offline')
+            return path
+
+        meta = self.read_meta(url) if cached else None
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        http = session or self.session
+        try:
+            head = http.head(url, headers=headers, timeout=self.timeout, allow_redirects=True)
+            if head.status_code == 304 and cached:
+                logger.info('Cached Index is up to date')
+                metrics.cache_request('index', 'not_modified')
+                return path
+            size = int(head.headers.get('Content-Length') or 0)
+            if (head.status_code == 200 and head.headers.get('Accept-Ranges') == 'bytes'
+                    and size > download.range_size):
+                self._download_ranges(url, head, size, http, progress)
+                metrics.cache_request('index', 'downloaded')
+                return path
+
+            # small files and servers without range support: one conditional GET
+            response = http.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except (requests.RequestException, DownloadError) as error:
+            if cached:
+                logger.warning('Could not revalidate the Index (%s), using the cached copy', error)
+                metrics.cache_request('index', 'stale')
+                return path
+            raise IndexUnavailable('Could not download the Index: %s' % error) from error
+
+        with response:
+            if response.status_code == 304 and cached:
+                logger.info('Cached Index is up to date')
+                metrics.cache_request('index', 'not_modified')
+                return path
+            if response.status_code != 200:
+                if cached:
+                    logger.warning('S3 returned %s for the Index, using the cached copy', response.status_code)
+                    metrics.cache_request('index', 'stale')
+                    return path
+                raise IndexUnavailable('S3 returned %s for the Index' % response.status_code)
+            self._store(url, response, progress)
+        metrics.cache_request('index', 'downloaded')
+        return path
+
+    def _download_ranges(self, url, head, size, session, progress=None):
+        """Download `url` in parallel ranges, verify it and store it as the new snapshot."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        etag = head.headers.get('ETag')
+        ranged = RangedDownload(url, self.snapshot_path(url) + '.part', size, etag,
+                                session=session, workers=self.workers,
+                                range_size=download.range_size, timeout=self.timeout)
+        part_path = ranged.run(progress)
+
+        expected = etag_md5(etag)
+        checksum = hashlib.md5()
+
+        def chunks():
+            with open(part_path, 'rb') as part:
+                for chunk in iter(lambda: part.read(chunk_size), b''):
+                    checksum.update(chunk)
+                    yield chunk
+
+        def verify():
+            if expected and checksum.hexdigest() != expected:
+                ranged.discard()
+                raise DownloadError('The downloaded Index does not match its checksum')
+
+        self._write_snapshot(url, chunks(), progress, 'store', size, verify)
+        ranged.discard()
+        self._write_meta(url, head)
+
+    def _write_snapshot(self, url, chunks, progress=None, stage='download', total=None, verify=None):
+        """Compress `chunks` into a new snapshot, replacing the old one atomically.
+
+        `verify()` is called once everything is written, and can raise to keep the
+        old snapshot.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.snapshot_path(url)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        try:
+            done = 0
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as gz:
+                for chunk in chunks:
+                    gz.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(stage, done, total)
+            if verify:
+                verify()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _write_meta(self, url, response):
+        meta = {
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        with open(self.meta_path(url), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        logger.info('Downloaded a new copy of the Index to %s', self.snapshot_path(url))
+
+    def _store(self, url, response, progress=None):
+        """Write the response body to a new snapshot, replacing the old one atomically."""
+        total = int(response.headers.get('Content-Length') or 0) or None
+        self._write_snapshot(url, response.iter_content(chunk_size), progress, 'download', total)
+        self._write_meta(url, response)
+
+    def open(self, url, session=None):
+        """Revalidate and open the snapshot of `url` as an uncompressed binary file."""
+        return gzip.open(self.fetch(url, session=session), 'rb')
+
+    def clear(self, url=None):
+        """Remove the snapshot of `url`, or the whole cache directory."""
+        if url is None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            return
+        part_path = self.snapshot_path(url) + '.part'
+        for path in (self.snapshot_path(url), self.meta_path(url), part_path, part_path + '.json'):
+            if os.path.exists(path):
+                os.unlink(path)
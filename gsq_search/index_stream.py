@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming parser for the GSQ OCR Report Index file.
+
+The S3 Index file is a JSON string that holds the JSON index, so decoding it with
+`response.json()` followed by `json.loads()` keeps the raw bytes, the decoded string
+and the final dict in memory at the same time. This parser reads the file in chunks,
+un-escapes the outer JSON string as it goes and hands each complete
+`"term": [report PIDs]` entry to a callback, so only one chunk and one postings
+list are held on top of the index being built.
+
+Report PIDs are interned as they are read, so each PID string is stored once no
+matter how many postings lists it appears in.
+
+"""
+
+import codecs
+import json
+import re
+import time
+from json.decoder import JSONDecodeError
+
+
+# a high surrogate escape, which must be decoded together with its pair
+_high_surrogate = re.compile(r'\\u[dD][89abAB][0-9a-fA-F]{2}')
+_whitespace = re.compile(r'[ \t\n\r]*')
+# the '"term":' that starts an Index entry, with the ',' separator after the first
+_first_entry = re.compile(r'[ \t\n\r]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*')
+_next_entry = re.compile(r'[ \t\n\r]*,[ \t\n\r]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class LoadStats:
+    """Size and speed of one Index parse."""
+
+    def __init__(self):
+        self.bytes_read = 0
+        self.terms = 0
+        self.postings = 0
+        self.seconds = 0.0
+
+    @property
+    def mb_per_s(self):
+        return self.bytes_read / 1e6 / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'bytes_read': self.bytes_read,
+            'terms': self.terms,
+            'postings': self.postings,
+            'seconds': self.seconds,
+            'mb_per_s': self.mb_per_s,
+        }
+
+    def __repr__(self):
+        return '<LoadStats %d terms, %.1f MB in %.2fs (%.1f MB/s)>' % (
+            self.terms, self.bytes_read / 1e6, self.seconds, self.mb_per_s)
+
+
+def iter_file(f, chunk_size=1024 * 1024):
+    """Read a binary file object in chunks."""
+    return iter(lambda: f.read(chunk_size), b'')
+
+
+def _iter_text(chunks, stats):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        stats.bytes_read += len(chunk)
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def _unwrap_string(texts):
+    """Yield the decoded contents of a JSON string that spans many text chunks.
+
+    `texts` starts just after the opening quote. Each chunk is cut where it won't
+    split an escape sequence, and decoded with json.loads.
+    """
+    texts = iter(texts)
+    buf = ''
+    following = next(texts, None)
+    while following is not None:
+        text, following = following, next(texts, None)
+        buf += text
+        if following is None:
+            # the last chunk ends with the closing quote of the outer string
+            buf = buf.rstrip(' \t\n\r')
+            if not buf.endswith('"') or not _is_escape(buf, len(buf) - 1):
+                break
+            buf = buf[:-1]
+            if buf:
+                yield json.loads('"' + buf + '"')
+            return
+        cut = _safe_cut(buf)
+        if cut:
+            yield json.loads('"' + buf[:cut] + '"')
+            buf = buf[cut:]
+    raise JSONDecodeError('Unterminated string in the Index file', buf, len(buf))
+
+
+def _safe_cut(text):
+    """Position near the end of `text` that doesn't split an escape sequence."""
+    cut = len(text)
+    # an escape is at most 6 characters ('\\uXXXX'), or 12 for a surrogate pair,
+    # so only the tail needs checking
+    for pos in range(max(0, cut - 12), cut):
+        if text[pos] == '\\' and _is_escape(text, pos):
+            if pos + 1 == cut:
+                return pos
+            length = 6 if text[pos + 1] == 'u' else 2
+            if length == 6 and _high_surrogate.match(text, pos):
+                length = 12
+            if pos + length > cut:
+                return pos
+    return cut
+
+
+def _is_escape(text, pos):
+    # a backslash starts an escape when it is preceded by an even number of backslashes
+    count = 0
+    while pos - count - 1 >= 0 and text[pos - count - 1] == '\\':
+        count += 1
+    return count % 2 == 0
+
+
+def _inner_texts(texts):
+    """Yield the text of the JSON index, un-escaping it if it was stored as a string."""
+    texts = iter(texts)
+    for text in texts:
+        stripped = text.lstrip()
+        if not stripped:
+            continue
+        if stripped[0] == '"':
+            yield from _unwrap_string(_chain(stripped[1:], texts))
+        else:
+            yield from _chain(stripped, texts)
+        return
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def parse_entries(texts, add):
+    """Parse a `{"term": ["pid", ...], ...}` object from text chunks.
+
+    Calls `add(term, pids)` once per term, in file order.
+    """
+    texts = iter(texts)
+    buf = ''
+    pos = 0
+    more = True
+
+    def refill():
+        nonlocal buf, pos, more
+        try:
+            buf = buf[pos:] + next(texts)
+        except StopIteration:
+            more = False
+            buf = buf[pos:]
+        pos = 0
+        return more
+
+    # opening brace
+    while True:
+        pos = _whitespace.match(buf, pos).end()
+        if pos < len(buf):
+            break
+        if not refill():
+            raise JSONDecodeError('Empty Index file', buf, pos)
+    if buf[pos] != '{':
+        raise JSONDecodeError('Expected the Index to be a JSON object', buf, pos)
+    pos += 1
+
+    head = _first_entry
+    while True:
+        match = head.match(buf, pos)
+        if match is None:
+            # either the end of the index, or the next entry isn't all in the buffer yet
+            end = _whitespace.match(buf, pos).end()
+            if buf[end:end + 1] == '}':
+                return
+            if refill():
+                continue
+            raise JSONDecodeError('Unexpected end of the Index file', buf, end)
+
+        # the whole postings list must be in the buffer before it can be decoded
+        start = match.end()
+        if buf.find(']', start) < 0:
+            if refill():
+                continue
+            raise JSONDecodeError('Unterminated postings list', buf, start)
+        try:
+            pids, end = _decoder.raw_decode(buf, start)
+        except JSONDecodeError:
+            # the ']' found may have been inside a string; read on and try again
+            if refill():
+                continue
+            raise
+        if not isinstance(pids, list):
+            raise JSONDecodeError('Expected a list of report PIDs', buf, start)
+        term = match.group(1)
+        if '\\' in term:
+            term = json.loads('"' + term + '"')
+        add(term, pids)
+        pos = end
+        head = _next_entry
+
+
+def stream_index(chunks, add=None):
+    """Build the Index from an iterable of raw byte chunks.
+
+    Without `add`, returns a term -> report PID list dict with every PID interned.
+    Returns `(index, stats)`; `stats` reports the parse throughput in MB/s.
+    """
+    stats = LoadStats()
+    start = time.perf_counter()
+    index = None
+    if add is None:
+        index = {}
+        pids_seen = {}
+        intern = pids_seen.setdefault
+
+        def add(term, pids):
+            index[term] = list(map(intern, pids, pids))
+
+    def counted_add(term, pids):
+        stats.terms += 1
+        stats.postings += len(pids)
+        add(term, pids)
+
+    parse_entries(_inner_texts(_iter_text(chunks, stats)), counted_add)
+    stats.seconds = time.perf_counter() - start
+    return index, stats
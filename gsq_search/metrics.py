@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Per-phase timings of searches and Index loading, and cache hit/miss counts, in the
+Prometheus text format.
+
+Code marks its phases with `phase(name)`:
+
+    with metrics.trace('search'):
+        with metrics.phase('parse'):
+            ...
+        with metrics.phase('set_ops'):
+            with metrics.phase('lookup'):   # time here isn't counted in set_ops too
+                ...
+
+A trace collects the phases run on its thread until it ends; a phase's time
+excludes the phases nested in it, so the phases of a trace add up to (nearly) its
+total. When a trace ends, each of its phases is observed in the
+`gsq_phase_seconds{trace, phase}` histogram and its total in `gsq_trace_seconds`,
+and it is kept with the last few traces (`recent_traces`, for the app's debug
+panel) and logged as one line if GSQ_METRICS_LOG is 1. A phase outside any trace
+is observed on its own. Nested `trace` calls join the outer trace.
+
+The phases are:
+
+    index_fetch   revalidating (and downloading) the Index snapshot
+    index_decode  parsing the JSON Index into the compact form
+    index_write   writing the binary (mapped or sharded) files
+    index_open    opening the binary files
+    parse         reading a search expression (and normalising its terms)
+    plan          planning it, including wildcard, close-spelling and word-form expansion
+    lookup        reading a term's postings from the Index
+    set_ops       AND/OR/NOT of the postings
+    pids          turning report IDs into sorted report PIDs
+    export        making a download file
+    render        the app writing the results to the page
+
+`cache_request(cache, outcome)` counts `gsq_cache_requests_total{cache, outcome}`
+for the Index snapshot cache ('index'), the loaded shared Index ('shared_index')
+and the results cache ('results'). `observe_reports(n)` records result sizes in
+`gsq_result_reports`, and `observe_terms(n)` the terms of the last Index loaded in
+`gsq_index_terms`.
+
+`render()` gives the metrics in the Prometheus text format; the search service
+serves them at /metrics, and `serve(port)` (GSQ_METRICS_PORT in the app) starts a
+small HTTP server for them. A phase costs a couple of microseconds, so the metrics
+are always on (GSQ_METRICS=0 turns them off).
+
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+enabled = os.environ.get('GSQ_METRICS', '1') != '0'
+log_traces = os.environ.get('GSQ_METRICS_LOG') == '1'
+
+# histogram buckets, in seconds and in reports
+time_buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+report_buckets = (0, 1, 10, 100, 1000, 10000, 50000, 100000)
+
+# traces kept for recent_traces
+recent = 20
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in zip(names, values))
+
+
+class Counter:
+    """Prometheus counter with labels."""
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def items(self):
+        """`(label values, count)` pairs, sorted."""
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for values, count in sorted(self._values.items()):
+                lines.append('%s%s %s' % (self.name, _labels(self.labels, values), count))
+        return lines
+
+
+class Gauge:
+    """Prometheus gauge without labels."""
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s gauge' % self.name]
+        if self.value is not None:
+            lines.append('%s %r' % (self.name, self.value))
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram with labels."""
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # label values -> [count per bucket (not cumulative), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *values):
+        with self._lock:
+            entry = self._values.get(values)
+            if entry is None:
+                entry = self._values[values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        names = self.labels + ('le',)
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append('%s_bucket%s %d' % (self.name, _labels(names, values + (repr(float(bound)),)), cumulative))
+                lines.append('%s_bucket%s %d' % (self.name, _labels(names, values + ('+Inf',)), count))
+                lines.append('%s_sum%s %r' % (self.name, _labels(self.labels, values), total))
+                lines.append('%s_count%s %d' % (self.name, _labels(self.labels, values), count))
+        return lines
+
+
+phase_seconds = Histogram('gsq_phase_seconds', 'Time spent in each phase of searches and Index loading.',
+                          time_buckets, ('trace', 'phase'))
+trace_seconds = Histogram('gsq_trace_seconds', 'Total time of searches and Index loads.', time_buckets, ('trace',))
+result_reports = Histogram('gsq_result_reports', 'Reports found by each search run (not answered from the cache).',
+                           report_buckets)
+cache_requests = Counter('gsq_cache_requests_total', 'Index and results cache requests by outcome.',
+                         ('cache', 'outcome'))
+index_terms = Gauge('gsq_index_terms', 'Terms in the last Index loaded.')
+registry = [phase_seconds, trace_seconds, result_reports, cache_requests, index_terms]
+
+_local = threading.local()
+_recent = deque(maxlen=recent)
+_server = None
+_server_lock = threading.Lock()
+
+
+class Trace:
+    """The phases of one search or Index load (see `trace`)."""
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.info = info
+        self.started = time.time()
+        self.seconds = None
+        self.error = None
+        # phase -> seconds, in the order first run
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def as_dict(self):
+        """The trace as plain values, times in milliseconds."""
+        body = {'trace': self.name, 'total_ms': round((self.seconds or 0.0) * 1000, 3)}
+        body.update(('%s_ms' % phase, round(seconds * 1000, 3)) for phase, seconds in self.phases.items())
+        body.update(self.info)
+        if self.error:
+            body['error'] = self.error
+        return body
+
+
+class _NoTrace:
+    """Stands in for a Trace when the metrics are off."""
+
+    @property
+    def info(self):
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_no_trace = _NoTrace()
+
+
+class trace:
+    """Context manager collecting the phases run on this thread into a Trace named
+    `name`; `info` (and anything added to the trace's `info` dict) goes with it.
+    """
+
+    __slots__ = ('_trace', '_outer', '_start', '_stack')
+
+    def __init__(self, name, **info):
+        if not enabled:
+            self._outer = self._trace = _no_trace
+            return
+        self._outer = getattr(_local, 'trace', None)
+        if self._outer is None:
+            self._trace = Trace(name, **info)
+        else:
+            self._trace = self._outer
+            self._trace.info.update(info)
+
+    def __enter__(self):
+        if self._outer is None:
+            _local.trace = self._trace
+            # the phases open outside the trace, restored when it ends
+            self._stack = getattr(_local, 'stack', None)
+            _local.stack = []
+            self._start = time.perf_counter()
+        return self._trace
+
+    def __exit__(self, kind, error, tb):
+        if self._outer is not None:
+            return False
+        current = self._trace
+        current.seconds = time.perf_counter() - self._start
+        if kind is not None:
+            current.error = kind.__name__
+        _local.trace = None
+        _local.stack = self._stack
+        _finish(current)
+        return False
+
+
+def _finish(current):
+    for phase, seconds in current.phases.items():
+        phase_seconds.observe(seconds, current.name, phase)
+    trace_seconds.observe(current.seconds, current.name)
+    _recent.append(current)
+    if log_traces:
+        logger.info(' '.join('%s=%s' % item for item in current.as_dict().items()))
+
+
+class phase:
+    """Context manager timing one phase of the current trace (see module docstring)."""
+
+    __slots__ = ('name', '_start', '_nested')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if enabled:
+            stack = getattr(_local, 'stack', None)
+            if stack is None:
+                stack = _local.stack = []
+            # time spent in phases nested in this one
+            self._nested = 0.0
+            stack.append(self)
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not enabled:
+            return False
+        elapsed = time.perf_counter() - self._start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1]._nested += elapsed
+        current = getattr(_local, 'trace', None)
+        if current is not None:
+            current.add(self.name, elapsed - self._nested)
+        else:
+            phase_seconds.observe(elapsed - self._nested, '', self.name)
+        return False
+
+
+def cache_request(cache, outcome):
+    if enabled:
+        cache_requests.inc(cache, outcome)
+        current = getattr(_local, 'trace', None)
+        if current is not None:
+            current.info['%s_cache' % cache] = outcome
+
+
+def observe_reports(count):
+    if enabled:
+        result_reports.observe(count)
+        current = getattr(_local, 'trace', None)
+        if current is not None:
+            current.info['reports'] = count
+
+
+def observe_terms(count):
+    if enabled:
+        index_terms.set(count)
+        current = getattr(_local, 'trace', None)
+        if current is not None:
+            current.info['terms'] = count
+
+
+def recent_traces():
+    """The last `recent` traces, newest first."""
+    return list(reversed(_recent))
+
+
+def render():
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics on `port` from a background thread, once per process."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='gsq-metrics', daemon=True).start()
+            logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+    return _server
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Search term normalization, and the word forms that belong together in the Index.
+
+`clean_term` lowercases a search term and removes everything but letters and
+spaces, exactly as the app always has (`w if (w.isalpha() or w == " ")` for each
+character), but with one `str.translate` over a precomputed table for the usual
+plain-ASCII term instead of a Python-level loop. Both search forms and the
+expression parser use it.
+
+The Index isn't lemmatised, so 'sample', 'samples', 'sampled' and 'sampling' are
+separate terms. `LemmaGroups` groups the single words of an Index by their base
+form, using English inflection rules (plural -s/-es/-ies, -ed, -ing, with the
+dropped 'e' and doubled consonant) that only accept a base form that is itself an
+Index word. It is built once per Index, so a search word is expanded to all its
+forms with one dictionary lookup rather than a call to an NLP library.
+
+"""
+
+import threading
+
+
+# characters kept by clean_term besides letters
+_kept = ' '
+
+# ASCII characters that aren't letters or kept, mapped to None for str.translate
+_drop_tables = {}
+
+# a word is only reduced to a base form of at least this many letters
+min_base = 3
+
+_lock = threading.Lock()
+
+
+def _drop_table(keep):
+    table = _drop_tables.get(keep)
+    if table is None:
+        table = _drop_tables[keep] = {
+            c: None for c in range(128) if not (chr(c).isalpha() or chr(c) in keep)}
+    return table
+
+
+def clean_term(text, keep=''):
+    """Lowercase a search term and remove numbers, symbols and punctuation.
+
+    Characters in `keep` (e.g. '*' for wildcards) are kept as well as letters and
+    spaces.
+    """
+    text = text.lower()
+    keep = _kept + keep
+    if text.isascii():
+        return text.translate(_drop_table(keep))
+    return "".join([w if (w.isalpha() or w in keep) else "" for w in text])
+
+
+def _bases(word):
+    """Candidate base forms of an inflected word, most likely first."""
+    if word.endswith('ies') and len(word) > 4:
+        yield word[:-3] + 'y'
+    elif word.endswith('es'):
+        yield word[:-1]
+        yield word[:-2]
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        yield word[:-1]
+    elif len(word) < 5:
+        return
+    elif word.endswith('ied'):
+        yield word[:-3] + 'y'
+    elif word.endswith(('ed', 'ing')) and not word.endswith('eed'):
+        stem = word[:-2] if word.endswith('ed') else word[:-3]
+        # 'thing' isn't a form of 'the', nor 'being' of 'bee' ('mined' is of 'mine')
+        if len(stem) >= min_base:
+            yield stem + 'e'
+        # 'string' isn't a form of 'str'
+        if len(stem) > min_base:
+            yield stem
+        if stem[-1] == stem[-2] and stem[-1] not in 'aeiouy':
+            yield stem[:-1]
+
+
+def base_form(word, known):
+    """The base form of `word` for which `known(base)` is true, or `word` itself."""
+    for base in _bases(word):
+        if len(base) >= min_base and base != word and known(base):
+            return base
+    return word
+
+
+class LemmaGroups:
+    """The single words of an Index grouped by base form (see `base_form`).
+
+    A word that is the base form of some words and itself a form of another word
+    joins their groups into one, so the groups are the same whatever order the words
+    are gone through in (which changes with the string hash seed).
+    """
+
+    def __init__(self, terms):
+        words = {term for term in terms if ' ' not in term}
+        # union-find: word -> a word of its group, up to the group's root
+        parents = {}
+
+        def root(word):
+            while parents[word] != word:
+                parents[word] = word = parents[parents[word]]
+            return word
+
+        for word in words:
+            base = base_form(word, words.__contains__)
+            if base != word:
+                parents.setdefault(word, word)
+                parents.setdefault(base, base)
+                a, b = sorted((root(word), root(base)))
+                parents[b] = a
+        groups = {}
+        for word in parents:
+            groups.setdefault(root(word), []).append(word)
+        self._forms = {}
+        for group in groups.values():
+            group = tuple(sorted(group))
+            for word in group:
+                self._forms[word] = group
+
+    def __len__(self):
+        """Number of words with other forms in the Index."""
+        return len(self._forms)
+
+    def forms(self, word, known=None):
+        """Every form of `word` in the Index, including `word` itself if it is there.
+
+        A word that isn't in the Index is matched by its base form if `known` (e.g.
+        `lambda term: index.df(term) > 0`) says that one is.
+        """
+        group = self._forms.get(word)
+        if group is not None:
+            return list(group)
+        if known is not None:
+            base = base_form(word, known)
+            if base != word:
+                return list(self._forms.get(base, (base,)))
+            if known(word):
+                return [word]
+        return []
+
+
+def lemma_groups(index):
+    """The LemmaGroups of an Index, built the first time they are asked for and kept
+    with the Index.
+    """
+    groups = getattr(index, '_lemma_groups', None)
+    if groups is None:
+        with _lock:
+            groups = getattr(index, '_lemma_groups', None)
+            if groups is None:
+                groups = index._lemma_groups = LemmaGroups(index.terms)
+    return groups
+
+
+def word_forms(index, word):
+    """Every form of the search word `word` in the Index (see LemmaGroups.forms)."""
+    return lemma_groups(index).forms(word, lambda term: index.df(term) > 0)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Cost-based evaluation of parsed search expressions.
+
+Every search is run from a plan rather than in the order it was typed, which would
+read every term's postings first. The planner rewrites the expression using each term's document frequency (the number of reports containing it, stored
+with every term when the Index is built, so no postings are read to get it):
+
+- chains of AND are flattened and run from the rarest operand to the most common,
+  stopping as soon as the running result is empty, so later postings are never read
+- NOT is folded into the AND chain it belongs to, so `a NOT b` and `(a NOT b) AND c`
+  become 'the AND of the kept operands, minus the removed ones', and each removal is
+  a difference against that (smallest) set rather than against `a`
+- chains of OR are flattened and merged from the smallest operand up
+- a term missing from the Index raises KeyError before any postings are read
+
+The Index only holds single words and frequent word pairs and triples, so a longer
+phrase (or a pair or triple that isn't in the Index) is matched by the AND of the
+overlapping triples and pairs of the phrase that are in the Index, falling back to
+the single words where the phrase has neither. Without word positions this can't
+check the words are in that order, so these results are candidates (`is_candidate`).
+
+A wildcard (`granit*`, `*stone`) is expanded to at most `max_expansions` matching
+terms from the sorted term dictionary (see term_dictionary.py), and their postings
+are merged in one go.
+
+With `fuzzy=True` each single search word also matches the Index words within an
+edit distance of one or two of it (see fuzzy.py), for words misread by the OCR or
+mistyped, and a word that isn't in the Index at all is searched for by its close
+spellings instead of raising KeyError. With `variants=True` each single search word
+also matches its other forms in the Index ('samples', 'sampled', 'sampling' for
+'sample'; see normalize.py).
+
+`count_query` gives the exact number of matching reports without turning report IDs
+into a list of PIDs.
+
+"""
+
+from collections import OrderedDict, namedtuple
+from itertools import chain
+
+from gsq_search import postings as ops
+from gsq_search.fuzzy import close_matches
+from gsq_search.normalize import word_forms
+from gsq_search.query import Term, Wildcard, parse_query
+from gsq_search.term_dictionary import max_expansions, term_dictionary
+
+
+class Lookup(namedtuple('Lookup', 'term df')):
+    """Postings of one term; `df` is the number of reports containing it."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '%s[%d]' % (Term(self.term), self.df)
+
+
+class Intersect(namedtuple('Intersect', 'keep remove')):
+    """Reports in every plan in `keep`, minus those in any plan in `remove`."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        text = ' AND '.join(map(str, self.keep))
+        if self.remove:
+            text += ' NOT ' + ' NOT '.join(map(str, self.remove))
+        return '(%s)' % text
+
+
+class Phrase(namedtuple('Phrase', 'text keep')):
+    """Candidate reports for a phrase: those in every word pair, triple or word in `keep`."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '%s~(%s)' % (Term(self.text), ' AND '.join(map(str, self.keep)))
+
+
+class Expansion(namedtuple('Expansion', 'pattern parts total')):
+    """Reports containing any of the terms in `parts` matched by a wildcard `pattern`
+    (or by a word's close spellings, `word~`, or its other forms, `word+`).
+
+    `total` is the number of terms the pattern matched, which can be more than
+    were searched for (see `max_expansions` in term_dictionary.py).
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '%s{%d of %d terms}' % (self.pattern, len(self.parts), self.total)
+
+
+class Union(namedtuple('Union', 'parts')):
+    """Reports in any plan in `parts`."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '(%s)' % ' OR '.join(map(str, self.parts))
+
+
+def estimate(plan):
+    """Upper bound on the number of reports a plan can match."""
+    if isinstance(plan, Lookup):
+        return plan.df
+    if isinstance(plan, (Intersect, Phrase)):
+        return min(map(estimate, plan.keep))
+    return sum(map(estimate, plan.parts))
+
+
+def expansions(plan):
+    """Every wildcard, close-spelling or word-form Expansion in a plan, left to right."""
+    if isinstance(plan, Expansion):
+        return [plan]
+    if isinstance(plan, Intersect):
+        return sum(map(expansions, plan.keep + plan.remove), [])
+    if isinstance(plan, Union):
+        return sum(map(expansions, plan.parts), [])
+    return []
+
+
+def is_candidate(plan):
+    """True if any phrase in the plan was matched from its word pairs, triples or words."""
+    if isinstance(plan, Phrase):
+        return True
+    if isinstance(plan, Intersect):
+        return any(map(is_candidate, plan.keep)) or any(map(is_candidate, plan.remove))
+    if isinstance(plan, Union):
+        return any(map(is_candidate, plan.parts))
+    return False
+
+
+def _phrase(text, df):
+    """Plan a phrase that isn't in the Index from the n-grams and words it is made of."""
+    words = text.split()
+    if len(words) < 2:
+        raise KeyError(text)
+    grams = {}
+
+    def add(gram):
+        count = df(gram)
+        if count:
+            grams[gram] = count
+        return count
+
+    # word k and word k + 1 are covered by a triple or pair containing both
+    covered = [False] * (len(words) - 1)
+    for i in range(len(words) - 2):
+        if add(' '.join(words[i:i + 3])):
+            covered[i] = covered[i + 1] = True
+    for k in range(len(words) - 1):
+        if not covered[k]:
+            covered[k] = bool(add(' '.join(words[k:k + 2])))
+    for k in range(len(words) - 1):
+        if not covered[k]:
+            for word in words[k:k + 2]:
+                if not add(word):
+                    raise KeyError(word)
+    return Phrase(text, [Lookup(gram, count) for gram, count in grams.items()])
+
+
+def _split(plan):
+    if isinstance(plan, Intersect):
+        return list(plan.keep), list(plan.remove)
+    return [plan], []
+
+
+def _expand(pattern, index):
+    matched, total = term_dictionary(index).expand(pattern)
+    if not total:
+        raise KeyError(pattern)
+    return Expansion(pattern, [Lookup(term, index.df(term)) for term in matched], total)
+
+
+def _word(word, index, fuzzy, variants):
+    """Plan a single word searched for with its close spellings and/or other forms."""
+    matched = close_matches(index, word) if fuzzy else [word]
+    if variants:
+        matched = list(OrderedDict.fromkeys(chain.from_iterable(word_forms(index, term) for term in matched)))
+    if not matched:
+        raise KeyError(word)
+    if matched == [word] and not fuzzy:
+        return Lookup(word, index.df(word))
+    pattern = word + ('~' if fuzzy else '') + ('+' if variants else '')
+    return Expansion(pattern, [Lookup(term, index.df(term)) for term in matched[:max_expansions]],
+                     len(matched))
+
+
+def _build(node, index, fuzzy=False, variants=False):
+    df = index.df
+    if isinstance(node, Wildcard):
+        return _expand(node.pattern, index)
+    if isinstance(node, Term):
+        text = ' '.join(node.text.split())
+        if (fuzzy or variants) and text and ' ' not in text:
+            return _word(text, index, fuzzy, variants)
+        count = df(text)
+        if not count:
+            return _phrase(text, df)
+        return Lookup(text, count)
+    left = _build(node.left, index, fuzzy, variants)
+    right = _build(node.right, index, fuzzy, variants)
+    if node.op == 'OR':
+        parts = []
+        for plan in (left, right):
+            parts.extend(plan.parts if isinstance(plan, Union) else [plan])
+        return Union(parts)
+    keep, remove = _split(left)
+    if node.op == 'AND':
+        right_keep, right_remove = _split(right)
+        return Intersect(keep + right_keep, remove + right_remove)
+    return Intersect(keep, remove + [right])
+
+
+def _order(plan):
+    if isinstance(plan, (Lookup, Expansion)):
+        return plan
+    if isinstance(plan, Union):
+        return Union(sorted(map(_order, plan.parts), key=estimate))
+    if isinstance(plan, Phrase):
+        return Phrase(plan.text, sorted(plan.keep, key=estimate))
+    # rarest first; remove the largest sets first, as they shrink the result most
+    return Intersect(sorted(map(_order, plan.keep), key=estimate),
+                     sorted(map(_order, plan.remove), key=estimate, reverse=True))
+
+
+def plan_query(index, query, fuzzy=False, variants=False):
+    """Plan a search expression (a string or a parsed tree) against `index`.
+
+    Raises KeyError for a term that isn't in the Index (with `fuzzy`, a word with no
+    close spellings in it either).
+    """
+    if isinstance(query, str):
+        query = parse_query(query)
+    return _order(_build(query, index, fuzzy, variants))
+
+
+def execute(plan, postings):
+    """Sorted report IDs (or a Bitmap) matching a plan; `postings(term)` returns the
+    sorted report IDs (or a Bitmap) of a term.
+    """
+    if isinstance(plan, Lookup):
+        return postings(plan.term)
+    if isinstance(plan, Expansion):
+        return ops.union_all([postings(part.term) for part in plan.parts])
+    if isinstance(plan, Union):
+        result = execute(plan.parts[0], postings)
+        for part in plan.parts[1:]:
+            result = ops.union(result, execute(part, postings))
+        return result
+    result = execute(plan.keep[0], postings)
+    for part in plan.keep[1:]:
+        if not result:
+            return result
+        result = ops.intersect(result, execute(part, postings))
+    if isinstance(plan, Phrase):
+        return result
+    for part in plan.remove:
+        if not result:
+            return result
+        result = ops.difference(result, execute(part, postings))
+    return result
+
+
+def query_ids(index, query, fuzzy=False, variants=False):
+    """Sorted report IDs (or a Bitmap) matching a search expression."""
+    return execute(plan_query(index, query, fuzzy, variants), index.postings)
+
+
+def count_query(index, query, fuzzy=False, variants=False):
+    """Number of reports matching a search expression, without listing their PIDs."""
+    plan = plan_query(index, query, fuzzy, variants)
+    if isinstance(plan, Lookup):
+        return plan.df
+    return len(execute(plan, index.postings))
+
+
+def run_query(index, query, fuzzy=False, variants=False):
+    """Sorted report PIDs matching a search expression (a string or a parsed tree)."""
+    return index.pids_for(query_ids(index, query, fuzzy, variants))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Set operations over sorted postings lists.
+
+Postings are sorted sequences of uint32 report IDs (an `array('I')` or a memoryview
+slice of the index's postings array). Every operation walks its inputs once, and
+switches to galloping (binary search from the last match) when one list is much
+shorter than the other, so a rare term combined with a common one costs about
+len(rare) * log(len(common)).
+
+Common terms may be stored as compressed Bitmaps instead (see gsq_search/bitmap.py).
+When one side is a Bitmap, AND keeps the other list's IDs that are in the bitmap, OR
+and NOT work container by container, and the result may be a Bitmap too.
+
+Results are new `array('I')`s (or Bitmaps), still sorted and without duplicates.
+
+"""
+
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+from gsq_search.bitmap import Bitmap
+
+
+# unsigned 32-bit report IDs
+id_type = 'I' if array('I').itemsize == 4 else 'L'
+
+# gallop through the longer list once it is this many times longer than the shorter
+gallop_ratio = 8
+
+
+def empty():
+    return array(id_type)
+
+
+def _bitmap_op(op, a, b):
+    """Combine postings where at least one side is a Bitmap."""
+    a_bitmap = isinstance(a, Bitmap)
+    b_bitmap = isinstance(b, Bitmap)
+    if op == 'AND':
+        if a_bitmap and b_bitmap:
+            return a & b
+        # the array side is usually the shorter one, so just test its IDs
+        return a.filter(b, typecode=id_type) if a_bitmap else b.filter(a, typecode=id_type)
+    if op == 'OR':
+        return (a if a_bitmap else Bitmap.from_ids(a)) | (b if b_bitmap else Bitmap.from_ids(b))
+    if not a_bitmap:
+        return b.filter(a, keep=False, typecode=id_type)
+    return a - (b if b_bitmap else Bitmap.from_ids(b))
+
+
+def _extend(out, ids):
+    # copy a run of IDs; arrays and memoryviews are copied as raw bytes
+    try:
+        out.frombytes(ids)
+    except TypeError:
+        out.extend(ids)
+
+
+def intersect(a, b):
+    """Report IDs in both `a` and `b` (AND)."""
+    if isinstance(a, Bitmap) or isinstance(b, Bitmap):
+        return _bitmap_op('AND', a, b)
+    if len(a) > len(b):
+        a, b = b, a
+    out = empty()
+    if not a:
+        return out
+    append = out.append
+    nb = len(b)
+    if nb >= gallop_ratio * len(a):
+        lo = 0
+        for x in a:
+            lo = bisect_left(b, x, lo)
+            if lo == nb:
+                break
+            if b[lo] == x:
+                append(x)
+                lo += 1
+        return out
+
+    na = len(a)
+    i = j = 0
+    x = a[0]
+    y = b[0]
+    while True:
+        if x < y:
+            i += 1
+            if i == na:
+                break
+            x = a[i]
+        elif y < x:
+            j += 1
+            if j == nb:
+                break
+            y = b[j]
+        else:
+            append(x)
+            i += 1
+            j += 1
+            if i == na or j == nb:
+                break
+            x = a[i]
+            y = b[j]
+    return out
+
+
+def union(a, b):
+    """Report IDs in either `a` or `b` (OR)."""
+    if isinstance(a, Bitmap) or isinstance(b, Bitmap):
+        return _bitmap_op('OR', a, b)
+    if len(a) > len(b):
+        a, b = b, a
+    out = empty()
+    na = len(a)
+    nb = len(b)
+    if not na:
+        _extend(out, b)
+        return out
+    append = out.append
+    if nb >= gallop_ratio * na:
+        # copy the runs of the long list between the short list's IDs
+        lo = 0
+        for x in a:
+            k = bisect_left(b, x, lo)
+            _extend(out, b[lo:k])
+            append(x)
+            lo = k + 1 if k < nb and b[k] == x else k
+        _extend(out, b[lo:])
+        return out
+
+    i = j = 0
+    x = a[0]
+    y = b[0]
+    while True:
+        if x < y:
+            append(x)
+            i += 1
+            if i == na:
+                break
+            x = a[i]
+        elif y < x:
+            append(y)
+            j += 1
+            if j == nb:
+                break
+            y = b[j]
+        else:
+            append(x)
+            i += 1
+            j += 1
+            if i == na or j == nb:
+                break
+            x = a[i]
+            y = b[j]
+    _extend(out, a[i:])
+    _extend(out, b[j:])
+    return out
+
+
+def difference(a, b):
+    """Report IDs in `a` but not in `b` (NOT)."""
+    if isinstance(a, Bitmap) or isinstance(b, Bitmap):
+        return _bitmap_op('NOT', a, b)
+    out = empty()
+    na = len(a)
+    nb = len(b)
+    if not na or not nb:
+        _extend(out, a)
+        return out
+    append = out.append
+    if nb >= gallop_ratio * na:
+        # look each of a's IDs up in the long list b
+        lo = 0
+        for x in a:
+            lo = bisect_left(b, x, lo)
+            if lo == nb or b[lo] != x:
+                append(x)
+        return out
+    if na >= gallop_ratio * nb:
+        # copy the runs of the long list a between b's IDs
+        lo = 0
+        for y in b:
+            k = bisect_left(a, y, lo)
+            _extend(out, a[lo:k])
+            lo = k + 1 if k < na and a[k] == y else k
+            if lo == na:
+                break
+        _extend(out, a[lo:])
+        return out
+
+    i = j = 0
+    x = a[0]
+    y = b[0]
+    while True:
+        if x < y:
+            append(x)
+            i += 1
+            if i == na:
+                return out
+            x = a[i]
+        elif y < x:
+            j += 1
+            if j == nb:
+                break
+            y = b[j]
+        else:
+            i += 1
+            j += 1
+            if i == na:
+                return out
+            if j == nb:
+                break
+            x = a[i]
+            y = b[j]
+    _extend(out, a[i:])
+    return out
+
+
+def union_all(lists):
+    """Report IDs in any of `lists` (the OR of many terms, e.g. a wildcard's)."""
+    arrays = [ids for ids in lists if not isinstance(ids, Bitmap)]
+    if len(arrays) > 2:
+        # one C-level sort beats merging the lists two at a time
+        result = empty()
+        result.fromlist(sorted(set(chain.from_iterable(arrays))))
+    else:
+        result = empty()
+        for ids in arrays:
+            result = union(result, ids)
+    for ids in lists:
+        if isinstance(ids, Bitmap):
+            result = union(result, ids)
+    return result
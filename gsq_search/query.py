@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Boolean search expressions over the GSQ OCR Report Index.
+
+A search expression is made of terms joined by AND, OR and NOT, e.g.
+
+    (gold OR silver) AND "drill hole" NOT coal
+
+Operators must be written in capitals. Words next to each other form a single term,
+so `coal seam gas AND gold` searches for the phrase 'coal seam gas' and the word
+'gold'; quotes can also be used to mark a phrase. The operators have equal priority
+and are applied left to right, so `a OR b AND c` means `(a OR b) AND c`, the same
+as the advanced search form's '(term1 condition1 term2) condition2 term3'. NOT
+removes the reports on its right from the reports on its left.
+
+A single word containing `*` is a wildcard: `granit*` matches every term starting
+with 'granit', `*stone` every term ending in 'stone', and `gr*ite` both. It needs
+some letters before or after the `*`, and can't be part of a phrase.
+
+"""
+
+import re
+from collections import namedtuple
+
+from gsq_search.normalize import clean_term
+
+
+operators = ('AND', 'OR', 'NOT')
+
+_token = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+
+class QuerySyntaxError(ValueError):
+    """Raised when a search expression can't be parsed."""
+
+
+class Term(namedtuple('Term', 'text')):
+    """A single word or phrase looked up in the Index."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        if ' ' in self.text or self.text.upper() in operators:
+            return '"' + self.text + '"'
+        return self.text
+
+
+class Wildcard(namedtuple('Wildcard', 'pattern')):
+    """A word pattern with `*` standing for any letters, expanded to Index terms."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return self.pattern
+
+    @property
+    def prefix(self):
+        return self.pattern.split('*')[0]
+
+    @property
+    def suffix(self):
+        return self.pattern.split('*')[-1]
+
+
+class Operation(namedtuple('Operation', 'op left right')):
+    """`left op right`, where op is one of AND, OR, NOT."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '(%s %s %s)' % (self.left, self.op, self.right)
+
+
+def wildcard(text, clean=clean_term):
+    """A Wildcard for a word containing `*`, cleaned like any other search term."""
+    parts = [clean(part).strip() for part in text.split('*')]
+    if any(' ' in part for part in parts):
+        raise QuerySyntaxError('A wildcard (*) can only be used in a single word, not in "%s"' % text)
+    pattern = re.sub(r'\*+', '*', '*'.join(parts))
+    if not (parts[0] or parts[-1]):
+        raise QuerySyntaxError('"%s" needs some letters before or after the *' % text)
+    return Wildcard(pattern)
+
+
+def term_query(text, clean=clean_term):
+    """The Term (or Wildcard, if it contains `*`) for one search box entry."""
+    if '*' in text:
+        return wildcard(text, clean)
+    return Term(' '.join(clean(text).split()))
+
+
+def _tokens(text):
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _token.match(text, pos)
+        if match is None:
+            raise QuerySyntaxError('Unmatched quote in the search expression')
+        pos = match.end()
+        open_paren, close_paren, quoted, word = match.groups()
+        if open_paren:
+            yield '(', None
+        elif close_paren:
+            yield ')', None
+        elif quoted is not None:
+            yield 'term', quoted
+        elif word in operators:
+            yield 'op', word
+        elif '*' in word:
+            yield 'wildcard', word
+        else:
+            yield 'word', word
+
+
+def parse_query(text, clean=clean_term):
+    """Parse a search expression into a tree of Term and Operation nodes.
+
+    Each term is passed through `clean` (by default the same lowercase, letters-only
+    filtering the search boxes use).
+    """
+    tokens = []
+    for kind, value in _tokens(text):
+        # words next to each other make up one phrase term
+        if kind == 'word' and tokens and tokens[-1][0] == 'word':
+            tokens[-1] = ('word', tokens[-1][1] + ' ' + value)
+        else:
+            tokens.append((kind, value))
+    tokens = [('term', value) if kind == 'word' else (kind, value) for kind, value in tokens]
+
+    pos = 0
+
+    def operand():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise QuerySyntaxError('The search expression ends without a search term')
+        kind, value = tokens[pos]
+        pos += 1
+        if kind == '(':
+            node = expression()
+            if pos >= len(tokens) or tokens[pos][0] != ')':
+                raise QuerySyntaxError('Missing closing bracket in the search expression')
+            pos += 1
+            return node
+        if kind == 'wildcard':
+            return wildcard(value, clean)
+        if kind == 'term':
+            term = clean(value).strip()
+            if not term:
+                raise QuerySyntaxError('"%s" has no letters to search for' % value)
+            return Term(' '.join(term.split()))
+        raise QuerySyntaxError('Expected a search term but found "%s"' % (value or kind))
+
+    def expression():
+        nonlocal pos
+        node = operand()
+        while pos < len(tokens) and tokens[pos][0] == 'op':
+            op = tokens[pos][1]
+            pos += 1
+            node = Operation(op, node, operand())
+        return node
+
+    node = expression()
+    if pos < len(tokens):
+        kind, value = tokens[pos]
+        raise QuerySyntaxError('Expected AND, OR or NOT but found "%s"' % (value or kind))
+    return node
+
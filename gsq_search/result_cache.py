@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Search results shared between all sessions of a server process.
+
+The same few searches ('gold', 'coal seam gas', 'drill hole', ...) are run over and
+over, so each result is kept, keyed on the parsed search expression: `str()` of the
+query tree, which is the same however the search was typed (spacing, case, quotes,
+symbols), and on whether close spellings and other word forms were included. A
+cached result holds the matching report IDs, then the sorted report PIDs once they
+are listed and each download file (CSV, Parquet, ...) once it is asked for, so a
+repeated search runs no set operations and no CSV encoding. Pages of results are
+made straight from the report IDs (see export.py), so the app never lists them all.
+
+Least recently used results are dropped once the cache holds more than `max_bytes`
+(GSQ_RESULT_CACHE_MB, default 64). The cache empties itself when it is used with a
+new Index version.
+
+Hits and misses, result sizes and the time spent parsing, planning, looking up
+postings and combining them are recorded in metrics.py.
+
+"""
+
+import os
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+from gsq_search import export, metrics
+from gsq_search.bitmap import Bitmap
+from gsq_search.planner import execute, expansions, is_candidate, plan_query
+from gsq_search.postings import id_type
+from gsq_search.query import parse_query
+
+
+def default_max_bytes():
+    return int(float(os.environ.get('GSQ_RESULT_CACHE_MB', 64)) * 1024 * 1024)
+
+
+def _index_version(index):
+    version = getattr(index, 'version', None)
+    return version if version is not None else id(index)
+
+
+def _timed(postings):
+    def timed(term):
+        with metrics.phase('lookup'):
+            return postings(term)
+    return timed
+
+
+def _ids_bytes(ids):
+    return ids.nbytes() if isinstance(ids, Bitmap) else 4 * len(ids)
+
+
+class CachedResult:
+    """Report IDs matching one search, and their PIDs and download files once asked for."""
+
+    __slots__ = ('key', 'ids', 'count', 'candidate', 'expansions', 'pids', 'exports', 'nbytes')
+
+    def __init__(self, key, ids, candidate=False, expansions=()):
+        self.key = key
+        self.ids = ids
+        self.count = len(ids)
+        # True when a phrase was matched from its word pairs and triples (see planner.py)
+        self.candidate = candidate
+        # (pattern, terms searched for, terms matched) for each wildcard, close spelling or word form
+        self.expansions = list(expansions)
+        self.pids = None
+        # download format -> file bytes
+        self.exports = {}
+        self.nbytes = _ids_bytes(ids)
+
+    def __len__(self):
+        return self.count
+
+
+class ResultCache:
+    """LRU cache of search results, bounded by their size in bytes."""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = default_max_bytes() if max_bytes is None else max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, index):
+        # called with the lock held
+        version = _index_version(index)
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def _evict(self):
+        # called with the lock held
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
+
+    def _add_bytes(self, entry, nbytes):
+        # called with the lock held
+        entry.nbytes += nbytes
+        if self._entries.get(entry.key) is entry:
+            self._bytes += nbytes
+            self._evict()
+
+    def _entry(self, index, query, fuzzy=False, variants=False):
+        if isinstance(query, str):
+            with metrics.phase('parse'):
+                query = parse_query(query)
+        key = (str(query), bool(fuzzy), bool(variants))
+        with self._lock:
+            self._check_version(index)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.cache_request('results', 'miss' if entry is None else 'hit')
+        if entry is not None:
+            return entry
+
+        with metrics.phase('plan'):
+            plan = plan_query(index, query, fuzzy, variants)
+        with metrics.phase('set_ops'):
+            ids = execute(plan, _timed(index.postings))
+        if not isinstance(ids, (array, Bitmap)):
+            # a zero-copy view of the Index's postings; keep a copy instead
+            ids = array(id_type, ids)
+        expanded = [(e.pattern, [part.term for part in e.parts], e.total) for e in expansions(plan)]
+        entry = CachedResult(key, ids, is_candidate(plan), expanded)
+        metrics.observe_reports(entry.count)
+        with self._lock:
+            self._check_version(index)
+            if key not in self._entries and entry.nbytes <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.nbytes
+                self._evict()
+        return entry
+
+    def count(self, index, query, fuzzy=False, variants=False):
+        """Number of reports matching a search expression (a string or a parsed tree).
+
+        Only the report IDs are worked out (and cached), not the list of PIDs, so
+        this is cheap even for very common terms. Raises KeyError like `lookup`.
+        """
+        return self._entry(index, query, fuzzy, variants).count
+
+    def get(self, index, query, fuzzy=False, variants=False):
+        """The CachedResult for a search expression, without listing its PIDs.
+
+        Pages of the result are made with `export.page(index, result.ids, number)`.
+        Raises KeyError like `lookup`.
+        """
+        return self._entry(index, query, fuzzy, variants)
+
+    def lookup(self, index, query, fuzzy=False, variants=False):
+        """The CachedResult for a search expression, with its sorted report PIDs.
+
+        Runs the search on a miss; a KeyError for a term that isn't in the Index is
+        passed on and nothing is cached. With `fuzzy` and `variants`, close spellings
+        and other forms of each search word are searched for too (see planner.py).
+        """
+        entry = self._entry(index, query, fuzzy, variants)
+        if entry.pids is None:
+            with metrics.phase('pids'):
+                pids = index.pids_for(entry.ids)
+            with self._lock:
+                if entry.pids is None:
+                    entry.pids = pids
+                    self._add_bytes(entry, sys.getsizeof(pids) + sum(map(sys.getsizeof, pids)))
+        return entry
+
+    def export(self, index, entry, fmt='csv'):
+        """A CachedResult as a file in one of `export.formats`, made the first time."""
+        data = entry.exports.get(fmt)
+        if data is None:
+            with metrics.phase('export'):
+                data = export.export_bytes(index, entry.ids, fmt, entry.candidate)
+            with self._lock:
+                if fmt not in entry.exports:
+                    entry.exports[fmt] = data
+                    self._add_bytes(entry, len(data))
+                data = entry.exports[fmt]
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+# one cache per server process, shared by every session
+result_cache = ResultCache()
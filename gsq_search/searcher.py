@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Searching the GSQ OCR Report Index from a script or pipeline.
+
+`Searcher` runs the same searches as the app, with the same search expressions,
+results cache and download files, without Streamlit:
+
+    from gsq_search.searcher import Searcher
+
+    searcher = Searcher()
+    result = searcher.search('(gold OR silver) AND "drill hole" NOT coal')
+    print(result.count, searcher.page(result, 1))
+    with open('gold_silver.csv', 'wb') as f:
+        f.writelines(searcher.iter_csv(result))
+
+By default the Index is the process-wide one the app uses (`shared_index`, so the
+GSQ_INDEX_* settings apply), loaded on first use. `python -m gsq_search.batch` runs
+a file of searches in parallel on top of this (see batch.py).
+
+"""
+
+from gsq_search import autocomplete, export, fuzzy, metrics
+from gsq_search.index import index_url, shared_index
+from gsq_search.normalize import clean_term
+from gsq_search.query import Operation, parse_query, term_query
+from gsq_search.result_cache import result_cache
+
+
+def form_query(terms, joins):
+    """The search expression of the app's advanced search form: `terms` joined by
+    `joins` (AND, OR or NOT) from left to right, e.g. '(term1 AND term2) NOT term3'.
+
+    `terms` are the entries as typed. Each is a word, a phrase or a wildcard,
+    cleaned as the search forms clean them. Entries after the first two that are
+    left blank are left out, with their join; one that cleans to nothing (e.g.
+    '123') is searched for and isn't found.
+    """
+    query = term_query(clean_term(terms[0], keep='*'))
+    for i, (join, term) in enumerate(zip(joins, terms[1:])):
+        if i and not term.strip():
+            break
+        query = Operation(join, query, term_query(clean_term(term, keep='*')))
+    return query
+
+
+class Searcher:
+    """Searches of one Index.
+
+    `index` is an Index object, or None for the shared Index of `url` (loaded on
+    first use, and picking up a reload). `cache` is the ResultCache the results are
+    kept in (by default the one the app uses).
+
+    A search is a search expression (see query.py), or a query tree such as
+    `form_query` makes. A term that isn't in the Index raises KeyError, and an
+    expression that can't be read raises QuerySyntaxError.
+
+    Each call is traced (see metrics.py), joining the caller's trace if it has one.
+    """
+
+    def __init__(self, index=None, url=index_url, cache=result_cache):
+        self._index = index
+        self.url = url
+        self.cache = cache
+
+    @property
+    def index(self):
+        if self._index is not None:
+            return self._index
+        return shared_index.get(self.url)
+
+    def query(self, text):
+        """The query tree of a search expression (a tree is returned unchanged)."""
+        if not isinstance(text, str):
+            return text
+        with metrics.phase('parse'):
+            return parse_query(text)
+
+    def search(self, query, fuzzy=False, variants=False):
+        """The CachedResult of a search: its `count`, report `ids`, whether it is a
+        `candidate` result and the `expansions` of its wildcards, close spellings
+        (`fuzzy`) and other word forms (`variants`).
+        """
+        # the Index is loaded (on first use) in a trace of its own
+        index = self.index
+        with metrics.trace('search', query=str(query)):
+            return self.cache.get(index, self.query(query), fuzzy, variants)
+
+    def count(self, query, fuzzy=False, variants=False):
+        """Number of reports matching a search."""
+        index = self.index
+        with metrics.trace('search', query=str(query)):
+            return self.cache.count(index, self.query(query), fuzzy, variants)
+
+    def lookup(self, query, fuzzy=False, variants=False):
+        """The CachedResult of a search like `search`, with its sorted report `pids`."""
+        index = self.index
+        with metrics.trace('search', query=str(query)):
+            return self.cache.lookup(index, self.query(query), fuzzy, variants)
+
+    def pids(self, query, fuzzy=False, variants=False):
+        """Sorted report PIDs matching a search."""
+        return self.lookup(query, fuzzy, variants).pids
+
+    def page(self, result, number, size=export.page_size):
+        """Sorted report PIDs on page `number` (from 1) of a result from `search`."""
+        with metrics.trace('page'), metrics.phase('pids'):
+            return export.page(self.index, result.ids, number, size)
+
+    def iter_csv(self, result, chunk=export.chunk_size):
+        """The CSV of a result from `search`, as UTF-8 byte strings (see export.py)."""
+        return export.iter_csv(self.index, result.ids, result.candidate, chunk)
+
+    def export(self, result, fmt='csv'):
+        """A result from `search` as a file in one of `export.formats`, cached with it."""
+        with metrics.trace('export', format=fmt):
+            return self.cache.export(self.index, result, fmt)
+
+    def suggest(self, word):
+        """Close spellings of a search word that isn't in the Index."""
+        return fuzzy.suggest(self.index, word)
+
+    def complete(self, prefix, limit=10):
+        """`[(term, reports), ...]`: Index terms starting with `prefix`, the terms found
+        in the most reports first (see autocomplete.py).
+        """
+        return autocomplete.complete(self.index, prefix, limit)
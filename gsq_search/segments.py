@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+An Index made of an immutable base segment plus small delta segments.
+
+The Index is published again whenever another batch of reports has been OCR'd, and
+each new version used to mean downloading and parsing all of it. A delta segment is
+a file in the same format as the Index that only covers a new batch of reports (see
+`make_delta`), so picking up a batch costs time and bandwidth in proportion to the
+batch. A segments list names the base and the deltas in order:
+
+    {"format": "gsq-segments-1",
+     "base": "https://.../v02_GSQ_OCR_index_single_plus_ngrams.json",
+     "deltas": ["https://.../v02_delta_001.json", ...]}
+
+`SegmentedIndex` offers the same lookups as CompactIndex across all the segments.
+Report IDs run through the segments in order (the base's first, then each delta's),
+so a term's postings are the base's, followed by each delta's shifted by the number
+of reports before it; the segments never share a report. Sorted report IDs no longer
+give sorted PIDs, so `pids_for` and `iter_pids` merge the segments' (sorted) PIDs.
+
+`compact` folds the deltas into one index again; the app does this in the
+background and then swaps the compacted Index in (see index.py).
+
+"""
+
+import argparse
+import heapq
+import json
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby, islice, repeat
+from operator import itemgetter
+
+from gsq_search import bitmap
+from gsq_search import postings as ops
+from gsq_search.bitmap import Bitmap
+from gsq_search.compact_index import CompactIndexBuilder
+from gsq_search.postings import id_type
+from gsq_search.term_dictionary import sorted_terms
+
+
+logger = logging.getLogger(__name__)
+
+segments_format = 'gsq-segments-1'
+
+
+def read_segments_list(f):
+    """`(base_url, [delta_url, ...])` from a segments list file."""
+    listing = json.load(f)
+    if listing.get('format') != segments_format:
+        raise ValueError('Not a GSQ segments list: %r' % listing.get('format'))
+    return listing['base'], list(listing.get('deltas', []))
+
+
+def _shifted(ids, offset):
+    if isinstance(ids, Bitmap):
+        ids = ids.to_array()
+    return array(id_type, map(offset.__add__, ids))
+
+
+def _in_sorted(terms, term):
+    i = bisect_left(terms, term)
+    return i < len(terms) and terms[i] == term
+
+
+def _position(ids, report_id):
+    """Number of the sorted `ids` below `report_id`."""
+    if isinstance(ids, Bitmap):
+        return ids.rank(report_id)
+    return bisect_left(ids, report_id)
+
+
+class _MergedTermList:
+    """Sorted terms of a SegmentedIndex: the base's, with the deltas' new terms merged in."""
+
+    def __init__(self, base_terms, extra):
+        self._base = base_terms
+        self._extra = extra
+        # position of each extra term in the merged list
+        self._positions = [bisect_left(base_terms, term) + k for k, term in enumerate(extra)]
+
+    def __len__(self):
+        return len(self._base) + len(self._extra)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        k = bisect_right(self._positions, i)
+        if k and self._positions[k - 1] == i:
+            return self._extra[k - 1]
+        return self._base[i - k]
+
+    def __iter__(self):
+        return heapq.merge(self._base, self._extra)
+
+
+class SegmentedIndex:
+    """Read-only Index over a base segment and delta segments of new reports.
+
+    `compactor(index)`, if given, returns the compacted form of this index (see
+    `compact`); SharedIndex calls it in the background.
+    """
+
+    def __init__(self, segments, version=None, compactor=None):
+        self.segments = list(segments)
+        self.version = version
+        self.compactor = compactor
+        self._offsets = []
+        total = 0
+        for segment in self.segments:
+            self._offsets.append(total)
+            total += segment.doc_count
+        self._doc_count = total
+        # a sharded base would load a shard for each term looked up in its `terms`
+        base_terms = sorted_terms(self.segments[0])
+        extra = set()
+        for delta in self.segments[1:]:
+            extra.update(term for term in delta.terms if not _in_sorted(base_terms, term))
+        self.terms = _MergedTermList(base_terms, sorted(extra))
+
+    @property
+    def doc_count(self):
+        return self._doc_count
+
+    @property
+    def base(self):
+        return self.segments[0]
+
+    @property
+    def deltas(self):
+        return self.segments[1:]
+
+    def close(self):
+        """Close the segments that hold a file open (a mapped base)."""
+        for segment in self.segments:
+            if hasattr(segment, 'close'):
+                segment.close()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return self.terms
+
+    def __contains__(self, term):
+        return any(term in segment for segment in self.segments)
+
+    def postings(self, term):
+        """Sorted report IDs for `term` across the segments. Raises KeyError."""
+        parts = []
+        for segment, offset in zip(self.segments, self._offsets):
+            ids = segment.get_postings(term)
+            if ids is not None and len(ids):
+                parts.append(ids if offset == 0 else _shifted(ids, offset))
+        if not parts:
+            if term in self:
+                return ops.empty()
+            raise KeyError(term)
+        if len(parts) == 1:
+            return parts[0]
+        # the segments' report IDs are in ascending ranges, so the parts just follow on
+        rest = array(id_type)
+        for ids in parts[1:]:
+            rest.extend(ids)
+        if isinstance(parts[0], Bitmap):
+            return ops.union(parts[0], rest)
+        ids = array(id_type, parts[0])
+        ids.extend(rest)
+        return ids
+
+    def get_postings(self, term, default=None):
+        try:
+            return self.postings(term)
+        except KeyError:
+            return default
+
+    def df(self, term):
+        """Number of reports containing `term` (0 if it isn't in the Index)."""
+        return sum(segment.df(term) for segment in self.segments)
+
+    def _segment(self, report_id):
+        i = bisect_right(self._offsets, report_id) - 1
+        return self.segments[i], self._offsets[i]
+
+    def pid(self, report_id):
+        segment, offset = self._segment(report_id)
+        return segment.pid(report_id - offset)
+
+    def _runs(self, report_ids):
+        """`(segment, offset, ids)` for the part of sorted `report_ids` in each segment."""
+        stops = [_position(report_ids, offset) for offset in self._offsets[1:]] + [len(report_ids)]
+        start = 0
+        for segment, offset, stop in zip(self.segments, self._offsets, stops):
+            if stop > start:
+                if isinstance(report_ids, Bitmap):
+                    ids = report_ids.slice(start, stop)
+                else:
+                    ids = report_ids[start:stop]
+                yield segment, offset, ids
+            start = stop
+
+    def _run_pids(self, segment, offset, ids, chunk):
+        for start in range(0, len(ids), chunk):
+            part = ids[start:start + chunk]
+            yield from segment.pids_for(part if offset == 0 else array(id_type, (i - offset for i in part)))
+
+    def iter_pids(self, report_ids, chunk=10000):
+        """Sorted report PIDs for sorted `report_ids`, merged from the segments a
+        `chunk` at a time.
+        """
+        runs = [self._run_pids(segment, offset, ids, chunk) for segment, offset, ids in self._runs(report_ids)]
+        if len(runs) == 1:
+            return runs[0]
+        return heapq.merge(*runs)
+
+    def pids_for(self, report_ids):
+        """Sorted report PIDs for sorted report IDs."""
+        return list(self.iter_pids(report_ids))
+
+    def page_pids(self, report_ids, start, stop):
+        """Sorted report PIDs `start` to `stop` for sorted `report_ids`."""
+        return list(islice(self.iter_pids(report_ids, chunk=max(stop - start, 1)), start, stop))
+
+    @property
+    def pids(self):
+        return list(heapq.merge(*(segment.pids for segment in self.segments)))
+
+    def __getitem__(self, term):
+        """Sorted report PIDs containing `term`, like the JSON Index. Raises KeyError."""
+        return self.pids_for(self.postings(term))
+
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def compact(self):
+        """The compacted form of this index from `compactor`, or `compact(self)`."""
+        return (self.compactor or compact)(self)
+
+    def memory_usage(self):
+        usage = [segment.memory_usage() for segment in self.segments if hasattr(segment, 'memory_usage')]
+        return {'segments': len(self.segments), 'total': sum(part['total'] for part in usage)}
+
+
+def without_reports(segment, pids, dense_fraction=bitmap.dense_fraction):
+    """`segment` less the reports in the set `pids` (reports a delta repeats from an
+    earlier segment, which keeps them), or `segment` itself if it has none of them.
+    """
+    if not any(map(pids.__contains__, segment.pids)):
+        return segment
+    logger.warning('Ignoring reports a delta segment repeats from an earlier segment')
+    builder = CompactIndexBuilder(dense_fraction)
+    for term in segment.terms:
+        kept = [pid for pid in segment[term] if pid not in pids]
+        if kept:
+            builder.add(term, kept)
+    return builder.finish(version=segment.version)
+
+
+def compact(index, dense_fraction=bitmap.dense_fraction, version=None):
+    """Fold the segments of a SegmentedIndex into one in-memory CompactIndex.
+
+    The segments' sorted terms are merged in one pass, and each term's postings are
+    read only from the segments that have it and turned into PIDs with that
+    segment's own PID table (the builder renumbers the reports in PID order).
+    """
+    builder = CompactIndexBuilder(dense_fraction)
+    segments = index.segments
+    pid_tables = [segment.pids for segment in segments]
+    entries = heapq.merge(*(zip(segment.terms, repeat(k)) for k, segment in enumerate(segments)))
+    for term, found in groupby(entries, key=itemgetter(0)):
+        pids = []
+        for _, k in found:
+            pids.extend(map(pid_tables[k].__getitem__, segments[k].postings(term)))
+        builder.add(term, pids)
+    return builder.finish(version=version or index.version)
+
+
+def make_delta(old, new):
+    """The delta segment (a term -> report PID list dict) for the reports of `new`
+    that aren't in `old`, both term -> report PID list dicts of full Index versions.
+
+    Only new reports are carried: changes to the terms of reports already in `old`
+    need a new base.
+    """
+    old_pids = set()
+    for pids in old.values():
+        old_pids.update(pids)
+    delta = {}
+    for term, pids in new.items():
+        added = [pid for pid in pids if pid not in old_pids]
+        if added:
+            delta[term] = added
+    return delta
+
+
+def main(argv=None):
+    """Write the delta segment between two Index versions, for publishing next to
+    the base with a segments list.
+    """
+    from gsq_search.index_stream import iter_file, stream_index
+
+    parser = argparse.ArgumentParser(description=main.__doc__.split('\n\n')[0].replace('\n', ' '))
+    parser.add_argument('old', help='the Index version the base segment was made from (JSON)')
+    parser.add_argument('new', help='the new Index version (JSON)')
+    parser.add_argument('delta', help='where to write the delta segment (JSON)')
+    args = parser.parse_args(argv)
+    with open(args.old, 'rb') as f:
+        old = stream_index(iter_file(f))[0]
+    with open(args.new, 'rb') as f:
+        new = stream_index(iter_file(f))[0]
+    delta = make_delta(old, new)
+    reports = len({pid for pids in delta.values() for pid in pids})
+    # published the same way as the Index: a JSON string holding the JSON object
+    with open(args.delta, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(json.dumps(delta)))
+    print('%d new reports, %d terms' % (reports, len(delta)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+A local HTTP search service over the shared Index, for tools that need searches
+without the app, and for the app itself (GSQ_SEARCH_SERVICE_URL, see client.py).
+
+    python -m gsq_search.service --port 8765
+
+Endpoints (`q` is a search expression as typed in the app; `fuzzy=1` and
+`variants=1` include close spellings and other forms of each word):
+
+    GET  /search?q=...&page=1&size=200   count, candidate, expansions, Index version and one page of PIDs
+    GET  /count?q=...                    count only
+    POST /batch                          {"queries": [...], "count_only": false, "fuzzy": false, "variants": false}
+    GET  /pids?q=...&format=csv          every PID, streamed as CSV (or a Parquet or Arrow file)
+    GET  /suggest?word=...               close spellings of a word that isn't in the Index
+    GET  /complete?prefix=...&limit=10   Index terms starting with a prefix, most reports first
+    GET  /health                         Index version and size
+    GET  /metrics                        phase timings and cache counts (Prometheus text, see metrics.py)
+
+Answers are JSON. A term that isn't in the Index gives a 404 (with suggestions),
+and an expression that can't be read a 400.
+
+The service runs on Tornado (installed with Streamlit). The Index is loaded once
+when it starts and shared by every request; searches run on a small thread pool,
+so the event loop keeps accepting and answering requests (and keep-alive
+connections) while a long search runs, and `/pids` writes its CSV a chunk at a
+time. Results are kept in the same results cache as the app.
+
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+import tornado.web
+
+from gsq_search import autocomplete, export, fuzzy, metrics
+from gsq_search.index import index_url, shared_index
+from gsq_search.query import QuerySyntaxError
+from gsq_search.searcher import Searcher
+
+
+logger = logging.getLogger(__name__)
+
+default_port = 8765
+
+# largest page of PIDs /search returns, and most queries in one /batch request
+max_page_size = 10000
+max_batch = 1000
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def result_json(result):
+    return {
+        'count': result.count,
+        'candidate': result.candidate,
+        'expansions': [{'pattern': pattern, 'terms': terms, 'total': total}
+                       for pattern, terms, total in result.expansions],
+    }
+
+
+class _SearchError(Exception):
+    def __init__(self, status, body):
+        super().__init__(body)
+        self.status = status
+        self.body = body
+
+
+def _search(searcher, fn):
+    """Run `fn()` (a search), turning the errors of a search into _SearchError."""
+    try:
+        return fn()
+    except QuerySyntaxError as error:
+        # the parser's own message, which the app shows as it would a local search's
+        raise _SearchError(400, {'error': str(error)})
+    except KeyError as error:
+        term = str(error.args[0]) if error.args else ''
+        raise _SearchError(404, {'error': 'not in the Index', 'term': term,
+                                 'suggestions': searcher.suggest(term)[:10]})
+
+
+class _Handler(tornado.web.RequestHandler):
+
+    def initialize(self, searcher, executor):
+        self.searcher = searcher
+        self.executor = executor
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` on the search threads."""
+        return tornado.ioloop.IOLoop.current().run_in_executor(self.executor, fn, *args)
+
+    def int_argument(self, name, default):
+        try:
+            return int(self.get_argument(name, str(default)))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='%s must be a whole number' % name)
+
+    def flags(self):
+        return (_flag(self.get_argument('fuzzy', '0')), _flag(self.get_argument('variants', '0')))
+
+    async def search(self, fn, *args):
+        """`fn(*args)` on the search threads, or None after writing the error of a
+        search that failed.
+        """
+        try:
+            return await self.run(_search, self.searcher, lambda: fn(*args))
+        except _SearchError as error:
+            self.set_status(error.status)
+            self.finish(error.body)
+            return None
+
+    def write_error(self, status_code, **kwargs):
+        error = kwargs.get('exc_info', (None, None))[1]
+        self.finish({'error': getattr(error, 'log_message', None) or self._reason})
+
+
+class SearchHandler(_Handler):
+
+    async def get(self):
+        query = self.get_argument('q')
+        number = max(1, self.int_argument('page', 1))
+        size = min(max(0, self.int_argument('size', export.page_size)), max_page_size)
+        fuzzy_, variants = self.flags()
+
+        def page():
+            with metrics.trace('search', query=query):
+                result = self.searcher.search(query, fuzzy_, variants)
+                pids = self.searcher.page(result, number, size) if size else []
+            return result, pids
+
+        found = await self.search(page)
+        if found is None:
+            return
+        result, pids = found
+        body = result_json(result)
+        body.update(query=query, page=number, pages=export.page_count(result.count, size or 1),
+                    pids=pids, version=getattr(self.searcher.index, 'version', None))
+        self.finish(body)
+
+
+class CountHandler(_Handler):
+
+    async def get(self):
+        query = self.get_argument('q')
+        count = await self.search(self.searcher.count, query, *self.flags())
+        if count is not None:
+            self.finish({'query': query, 'count': count})
+
+
+class BatchHandler(_Handler):
+
+    async def post(self):
+        try:
+            request = json.loads(self.request.body)
+            queries = list(request['queries'])
+        except (ValueError, KeyError, TypeError):
+            raise tornado.web.HTTPError(400, reason='expected {"queries": [...]}')
+        if len(queries) > max_batch:
+            raise tornado.web.HTTPError(413, reason='at most %d queries per batch' % max_batch)
+        options = (_flag(request.get('fuzzy')), _flag(request.get('variants')))
+        count_only = _flag(request.get('count_only'))
+        results = await self.run(self._batch, queries, options, count_only)
+        self.finish({'results': results})
+
+    def _batch(self, queries, options, count_only):
+        # one trip to the search threads for the whole batch
+        results = []
+        for query in queries:
+            try:
+                if count_only:
+                    body = {'count': _search(self.searcher, lambda: self.searcher.count(query, *options))}
+                else:
+                    result = _search(self.searcher, lambda: self.searcher.lookup(query, *options))
+                    body = result_json(result)
+                    body['pids'] = result.pids
+            except _SearchError as error:
+                body = error.body
+            body['query'] = query
+            results.append(body)
+        return results
+
+
+class PidsHandler(_Handler):
+
+    async def get(self):
+        query = self.get_argument('q')
+        fmt = self.get_argument('format', 'csv')
+        if fmt not in export.available_formats():
+            raise tornado.web.HTTPError(400, reason='format must be one of %s' % ', '.join(export.available_formats()))
+        result = await self.search(self.searcher.search, query, *self.flags())
+        if result is None:
+            return
+        extension, mime = export.formats[fmt]
+        self.set_header('Content-Type', mime)
+        self.set_header('Content-Disposition', 'attachment; filename="search_results.%s"' % extension)
+        if fmt != 'csv':
+            self.finish(await self.run(self.searcher.export, result, fmt))
+            return
+        # the CSV is made and sent a chunk of reports at a time
+        chunks = self.searcher.iter_csv(result)
+        while True:
+            chunk = await self.run(next, chunks, None)
+            if chunk is None:
+                break
+            self.write(chunk)
+            await self.flush()
+        self.finish()
+
+
+class SuggestHandler(_Handler):
+
+    async def get(self):
+        word = self.get_argument('word')
+        suggestions = await self.run(self.searcher.suggest, word)
+        self.finish({'word': word, 'suggestions': suggestions})
+
+
+class CompleteHandler(_Handler):
+
+    async def get(self):
+        prefix = self.get_argument('prefix')
+        limit = min(max(1, self.int_argument('limit', 10)), autocomplete.max_completions)
+        completions = await self.run(self.searcher.complete, prefix, limit)
+        self.finish({'prefix': prefix, 'completions': [{'term': term, 'reports': reports}
+                                                       for term, reports in completions]})
+
+
+class HealthHandler(_Handler):
+
+    def get(self):
+        index = self.searcher.index
+        self.finish({'status': 'ok', 'version': getattr(index, 'version', None), 'terms': len(index),
+                     'reports': index.doc_count})
+
+
+class MetricsHandler(_Handler):
+
+    def get(self):
+        self.set_header('Content-Type', metrics.content_type)
+        self.finish(metrics.render())
+
+
+def make_app(searcher=None, threads=None):
+    """The Tornado Application of the service, searching with `searcher` (by
+    default a Searcher of the shared Index) on `threads` threads.
+    """
+    settings = {
+        'searcher': searcher or Searcher(),
+        'executor': ThreadPoolExecutor(threads or min(8, os.cpu_count() or 1), thread_name_prefix='gsq-search'),
+    }
+    return tornado.web.Application([
+        (r'/search', SearchHandler, settings),
+        (r'/count', CountHandler, settings),
+        (r'/batch', BatchHandler, settings),
+        (r'/pids', PidsHandler, settings),
+        (r'/suggest', SuggestHandler, settings),
+        (r'/complete', CompleteHandler, settings),
+        (r'/health', HealthHandler, settings),
+        (r'/metrics', MetricsHandler, settings),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve searches of the GSQ OCR Report Index over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: this machine only)')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--threads', type=int, default=None, help='search threads (default: up to 8, one per core)')
+    parser.add_argument('--url', default=index_url, help='Index URL (default: the v02 Index)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    # load the Index (and start the close-spellings index and the completions) before
+    # the first request
+    index = shared_index.get(args.url)
+    fuzzy.warm(index)
+    autocomplete.warm(index)
+    app = make_app(Searcher(url=args.url), args.threads)
+    app.listen(args.port, args.host)
+    logger.info('Serving searches on http://%s:%d', args.host, args.port)
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
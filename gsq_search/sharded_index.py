@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+GSQ OCR Report Index split into shards by sorted term range, loaded lazily.
+
+A sharded Index is a directory holding:
+
+    manifest.json     Index version, counts and, for every shard, its file, first
+                      term and number of terms
+    pids.gsqidx       the report PID table (a binary Index file with no terms)
+    shard-NNNNN.gsqidx
+                      the terms from one shard's first term up to the next shard's,
+                      with their postings (binary Index files, see binary_index.py)
+
+Opening a sharded Index only reads the manifest. A shard is read into memory the
+first time one of its terms is looked up, and at most `max_resident_shards` are kept;
+the least recently used one is dropped when another is needed. Going through all the
+terms (to build the close-spelling index, see fuzzy.py, or the completions, see
+autocomplete.py) maps each shard file just long enough to read its term dictionary,
+with each term's report count, so it doesn't load the shards.
+
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from gsq_search.binary_index import MappedIndex, write_binary_index
+from gsq_search.bitmap import Bitmap
+
+
+format_version = 1
+
+# start a new shard once the current one holds about this many bytes of postings
+shard_bytes = 4 << 20
+
+# shards kept in memory at once
+max_resident_shards = 16
+
+manifest_name = 'manifest.json'
+pids_name = 'pids.gsqidx'
+
+
+class _Part:
+    """Part of a CompactIndex (some of its terms, or just its PIDs) for write_binary_index."""
+
+    def __init__(self, index, terms, pids=()):
+        self.terms = terms
+        self.pids = pids
+        self.version = index.version
+        self.postings = index.postings
+
+
+def _postings_bytes(ids):
+    return ids.nbytes() if isinstance(ids, Bitmap) else 4 * len(ids)
+
+
+def write_sharded_index(index, directory, meta=None, shard_size=shard_bytes):
+    """Write a CompactIndex to `directory` as a sharded Index.
+
+    The shards are written to a temporary directory that is renamed into place at
+    the end, so a half-written Index is never opened.
+    """
+    meta = dict(meta or {})
+    meta.setdefault('version', index.version)
+    parent = os.path.dirname(os.path.abspath(directory))
+    tmp_dir = tempfile.mkdtemp(dir=parent, suffix='.part')
+    try:
+        write_binary_index(_Part(index, [], index.pids), os.path.join(tmp_dir, pids_name), meta)
+
+        shards = []
+        terms = index.terms
+        start = size = 0
+        for i, term in enumerate(terms):
+            size += len(term) + _postings_bytes(index.postings(term))
+            if size >= shard_size or i == len(terms) - 1:
+                name = 'shard-%05d.gsqidx' % len(shards)
+                write_binary_index(_Part(index, terms[start:i + 1]), os.path.join(tmp_dir, name), meta)
+                shards.append({'file': name, 'first_term': terms[start], 'terms': i + 1 - start})
+                start = i + 1
+                size = 0
+
+        manifest = {
+            'format': format_version,
+            'meta': meta,
+            'reports': len(index.pids),
+            'terms': len(terms),
+            'shards': shards,
+        }
+        with open(os.path.join(tmp_dir, manifest_name), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_dir, directory)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+class _ShardedTermList:
+    """Sorted terms of a ShardedIndex; looking one up loads its shard."""
+
+    def __init__(self, sharded):
+        self._sharded = sharded
+
+    def __len__(self):
+        return self._sharded._term_count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = bisect_right(self._sharded._term_starts, i) - 1
+        return self._sharded._shard(shard).terms[i - self._sharded._term_starts[shard]]
+
+    def __iter__(self):
+        for terms, _ in self._sharded._term_tables():
+            yield from terms
+
+
+class ShardedIndex:
+    """Read-only Index that loads its term shards on first use.
+
+    Offers the same lookups as CompactIndex. Iterating over all the terms only reads
+    each shard's term dictionary (see `_term_tables`), but looking terms up by
+    position loads their shards.
+    """
+
+    def __init__(self, directory, max_resident=max_resident_shards):
+        self.directory = directory
+        self.max_resident = max_resident
+        with open(os.path.join(directory, manifest_name), encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('format') != format_version:
+            raise ValueError('%s is not a version %d sharded Index' % (directory, format_version))
+        self.meta = manifest['meta']
+        self.version = self.meta.get('version')
+        self._pid_count = manifest['reports']
+        self._term_count = manifest['terms']
+        self._files = [shard['file'] for shard in manifest['shards']]
+        self._first_terms = [shard['first_term'] for shard in manifest['shards']]
+        self._term_starts = []
+        start = 0
+        for shard in manifest['shards']:
+            self._term_starts.append(start)
+            start += shard['terms']
+        self.terms = _ShardedTermList(self)
+        self._pid_table = None
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self.shard_loads = 0
+        self._term_table = None
+        self._table_lock = threading.Lock()
+
+    def _read(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'rb') as f:
+            return MappedIndex(path, data=f.read())
+
+    def _shard(self, i):
+        with self._lock:
+            shard = self._resident.get(i)
+            if shard is not None:
+                self._resident.move_to_end(i)
+                return shard
+            shard = self._resident[i] = self._read(self._files[i])
+            self.shard_loads += 1
+            # postings still held by a running search keep their shard's bytes
+            # alive, so an evicted shard is dropped rather than closed
+            while len(self._resident) > self.max_resident:
+                self._resident.popitem(last=False)
+            return shard
+
+    def _shard_for(self, term):
+        i = bisect_right(self._first_terms, term) - 1
+        return self._shard(i) if i >= 0 else None
+
+    def _term_tables(self):
+        """`(terms, report counts)` of each shard in turn, read from the term dictionary
+        in its file without loading the shard or its postings.
+        """
+        for name in self._files:
+            mapped = MappedIndex(os.path.join(self.directory, name))
+            try:
+                table = list(mapped.terms), mapped.term_dfs()
+            finally:
+                mapped.close()
+            yield table
+
+    @property
+    def resident_shards(self):
+        return list(self._resident)
+
+    @property
+    def _pids(self):
+        if self._pid_table is None:
+            self._pid_table = self._read(pids_name)
+        return self._pid_table
+
+    @property
+    def doc_count(self):
+        return self._pid_count
+
+    def __len__(self):
+        return self._term_count
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def keys(self):
+        return self.terms
+
+    def __contains__(self, term):
+        shard = self._shard_for(term)
+        return shard is not None and term in shard
+
+    def postings(self, term):
+        """Sorted report IDs for `term` (or a Bitmap). Raises KeyError."""
+        shard = self._shard_for(term)
+        if shard is None:
+            raise KeyError(term)
+        return shard.postings(term)
+
+    def get_postings(self, term, default=None):
+        try:
+            return self.postings(term)
+        except KeyError:
+            return default
+
+    def df(self, term):
+        """Number of reports containing `term` (0 if it isn't in the Index), from the
+        term table once it has been read, so without loading the term's shard.
+        """
+        table = self._term_table
+        if table is not None:
+            terms, dfs = table
+            i = bisect_left(terms, term)
+            return dfs[i] if i < len(terms) and terms[i] == term else 0
+        shard = self._shard_for(term)
+        return shard.df(term) if shard is not None else 0
+
+    def term_dfs(self):
+        """Number of reports containing each term, in term order (read without loading
+        the shards).
+        """
+        for _, dfs in self._term_tables():
+            yield from dfs
+
+    def term_table(self):
+        """`(terms, report counts)`: every term as a list, and how many reports contain
+        each, read without loading the shards (the first time) and kept. Looking terms
+        up in the list doesn't load their shards, as looking them up in `terms` does.
+        """
+        if self._term_table is None:
+            with self._table_lock:
+                if self._term_table is None:
+                    terms = []
+                    dfs = array('I')
+                    for shard_terms, shard_dfs in self._term_tables():
+                        terms.extend(shard_terms)
+                        dfs.extend(shard_dfs)
+                    self._term_table = terms, dfs
+        return self._term_table
+
+    def pid(self, report_id):
+        return self._pids.pid(report_id)
+
+    def pids_for(self, report_ids):
+        return self._pids.pids_for(report_ids)
+
+    @property
+    def pids(self):
+        return self._pids.pids
+
+    def __getitem__(self, term):
+        return self.pids_for(self.postings(term))
+
+    def get(self, term, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def memory_usage(self):
+        """Bytes held by the PID table and the shards currently in memory."""
+        usage = {
+            'pid_table': self._pid_table.memory_usage()['total'] if self._pid_table is not None else 0,
+            'shards': sum(shard.memory_usage()['total'] for shard in list(self._resident.values())),
+            'resident_shards': len(self._resident),
+        }
+        usage['total'] = usage['pid_table'] + usage['shards']
+        return usage
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Prefix and wildcard lookups in the Index's sorted term dictionary.
+
+Every Index keeps its terms sorted, so the terms starting with a prefix are one
+contiguous range found with two binary searches. Terms ending with a suffix are
+found the same way in a second sorted list of the reversed terms, which is built
+the first time a suffix is searched for. A pattern with letters at both ends
+(`gr*ite`) takes the smaller of the two ranges and checks each term in it against
+the pattern.
+
+At most `max_expansions` terms are returned for a pattern; the total number of
+matching terms is always reported.
+
+"""
+
+import re
+import threading
+from bisect import bisect_left
+
+
+# terms a single wildcard is expanded to
+max_expansions = 500
+
+# sorts after any character used in a term
+_last_char = '\U0010ffff'
+
+
+def sorted_terms(index):
+    """The sorted terms of an Index, as a sequence to look terms up in by position:
+    `index.terms`, or the list of a sharded Index's `term_table()`, as looking up
+    one of its `terms` loads that term's shard.
+    """
+    term_table = getattr(index, 'term_table', None)
+    return term_table()[0] if term_table is not None else index.terms
+
+
+def _range(terms, prefix):
+    return bisect_left(terms, prefix), bisect_left(terms, prefix + _last_char)
+
+
+def _pattern_regex(pattern):
+    return re.compile('.*'.join(map(re.escape, pattern.split('*'))) + r'\Z', re.DOTALL)
+
+
+class TermDictionary:
+    """Prefix, suffix and wildcard expansion over a sorted sequence of terms."""
+
+    def __init__(self, terms):
+        self.terms = terms
+        self._reversed = None
+        self._lock = threading.Lock()
+
+    @property
+    def reversed_terms(self):
+        """Every term spelt backwards, sorted (built on first use)."""
+        if self._reversed is None:
+            with self._lock:
+                if self._reversed is None:
+                    self._reversed = sorted(term[::-1] for term in self.terms)
+        return self._reversed
+
+    def with_prefix(self, prefix, limit=max_expansions):
+        """`(terms, total)`: the first `limit` terms starting with `prefix`, and how many there are."""
+        lo, hi = _range(self.terms, prefix)
+        return self.terms[lo:min(hi, lo + limit)], hi - lo
+
+    def with_suffix(self, suffix, limit=max_expansions):
+        """`(terms, total)`: up to `limit` terms ending with `suffix`, and how many there are."""
+        reversed_terms = self.reversed_terms
+        lo, hi = _range(reversed_terms, suffix[::-1])
+        return sorted(term[::-1] for term in reversed_terms[lo:min(hi, lo + limit)]), hi - lo
+
+    def expand(self, pattern, limit=max_expansions):
+        """`(terms, total)` for a pattern with `*` standing for any letters.
+
+        The pattern needs letters at the start or the end (see query.wildcard).
+        """
+        parts = pattern.split('*')
+        prefix, suffix = parts[0], parts[-1]
+        if len(parts) == 2 and not suffix:
+            return self.with_prefix(prefix, limit)
+        if len(parts) == 2 and not prefix:
+            return self.with_suffix(suffix, limit)
+
+        # letters in the middle, or at both ends: check each term in the smaller range
+        size = None
+        if prefix:
+            lo, hi = _range(self.terms, prefix)
+            size = hi - lo
+        if suffix:
+            reversed_terms = self.reversed_terms
+            rlo, rhi = _range(reversed_terms, suffix[::-1])
+        if suffix and (size is None or rhi - rlo < size):
+            candidates = sorted(term[::-1] for term in reversed_terms[rlo:rhi])
+        else:
+            candidates = self.terms[lo:hi]
+        matches = list(filter(_pattern_regex(pattern).match, candidates))
+        return matches[:limit], len(matches)
+
+
+_lock = threading.Lock()
+
+
+def term_dictionary(index):
+    """The TermDictionary of an Index, kept with the Index."""
+    dictionary = getattr(index, '_term_dictionary', None)
+    if dictionary is None:
+        with _lock:
+            dictionary = getattr(index, '_term_dictionary', None)
+            if dictionary is None:
+                dictionary = index._term_dictionary = TermDictionary(sorted_terms(index))
+    return dictionary
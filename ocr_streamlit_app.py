@@ -18,13 +18,18 @@ This app script was re-pointed to the 'version 2' Index file on 2022-09-28.
 
 # import the libraries
 import streamlit as st
-import json
 import pandas as pd
-import numpy as np
 from PIL import Image
 import os
 import re
-import requests
+
+from gsq_search import autocomplete, export, fuzzy, metrics
+from gsq_search.client import remote_searcher
+from gsq_search.index import index_url, shared_index
+from gsq_search.normalize import clean_term
+from gsq_search.query import QuerySyntaxError, parse_query, term_query
+from gsq_search.result_cache import result_cache
+from gsq_search.searcher import Searcher, form_query
 
 
 # st.set_page_config(
@@ -56,32 +61,149 @@ st.write("The Geological Survey of Queensland (GSQ) is the custodian of over 100
 st.write('The purpose of this search capability is to find reports that contain terms of interest based on text content, across commodities and report types, and to be able to download these reports in bulk. The GSQ Open Data Portal has an API that can access the reports, including any associated documents. The reports found in the search results here can be downloaded in full via the API. With the CSV of your search results, use the [ckan_downloader_example.py](https://github.com/geological-survey-of-queensland/open-data-api/blob/master/ckan_downloader_example.py) to download your report search results in bulk')
 st.markdown("This GSQ Report Index is our second version and was created from more than 83,000 open-file OCR\'d reports. As more reports become open-file in the future, the GSQ Report Index will be updated. Improvements to this app will be ongoing, please contact <GSQOpenData@resources.qld.gov.au> for app issues.")
 st.markdown('Please note, the GSQ Report Index contains only **words and letters**, no numbers. If you are looking for reports on a particular permit or borehole number, the [GSQ Open Data Portal](https://geoscience.data.qld.gov.au/) is a more suitable place for your search.')
-st.markdown('**A search term can be a single word, or a phrase of up to 3 words that you would expect to occur together in a sentence.**')
+st.markdown('**A search term can be a single word, or a phrase of words that you would expect to occur together in a sentence.**')
+st.markdown('The Index holds single words and frequent pairs and triples of words. Longer (or less common) phrases are matched from the word pairs/triples they are made of, so these results are *candidate* reports: they contain all the parts of the phrase, but not necessarily in that order.')
 
             
 
-# # import the S3 OCR JSON file (stored as a string)
-index_url = 'https://gsq-horizon.s3.ap-southeast-2.amazonaws.com/DATASETS/ds000079/v02_GSQ_OCR_index_single_plus_ngrams.json'
-
-
-@st.experimental_memo(suppress_st_warning=True)   
+# The Index is loaded once per server process and shared by reference with every
+# session and rerun (see gsq_search/index.py), rather than copied into each one.
+# It is only loaded when the first search is run, so the page above renders straight away
 def import_index():
-    st.write("Cache miss -- import_index called")
-    response = requests.get(index_url)
-    # import the S3 OCR Index JSON file (stored as a string)
-    ocr = response.json()
-        # convert the json string to a dictionary
-    ocr_index = json.loads(ocr)
+    if shared_index.is_loaded(index_url):
+        return shared_index.get(index_url)
+    
+    # show how far through downloading and reading the Index file we are
+    stages = {'download': 'Downloading the GSQ Report Index...',
+              'store': 'Saving the GSQ Report Index...',
+              'parse': 'Reading the GSQ Report Index...'}
+    status = st.empty()
+    bar = st.progress(0)
+    def show_progress(stage, done, total):
+        status.text(stages.get(stage, 'Loading the GSQ Report Index...'))
+        if total:
+            bar.progress(min(done / total, 1.0))
+    
+    ocr_index = shared_index.get(index_url, progress=show_progress)
+    status.empty()
+    bar.empty()
+    # the close-spellings index and the term completions are built in the background,
+    # ready for the first misspelling or the first term looked up
+    fuzzy.warm(ocr_index)
+    autocomplete.warm(ocr_index)
     return ocr_index
-  
-ocr_index = import_index() 
 
 
-# add function for converting results into CSV format
-@st.cache
-def convert_df(df):
-    # Cache the conversion to prevent computation on every rerun
-    return df.to_csv(index=False).encode('utf-8')
+# With GSQ_SEARCH_SERVICE_URL set, searches are sent to the local search service
+# (python -m gsq_search.service), which holds the one warm Index shared with other
+# tools, instead of being run against an Index loaded here
+service_url = os.environ.get('GSQ_SEARCH_SERVICE_URL')
+
+def get_searcher():
+    if service_url:
+        return remote_searcher(service_url)
+    return Searcher(import_index())
+
+
+# Timings of each phase of the searches and Index loads, and cache hits/misses
+# (see gsq_search/metrics.py), served for Prometheus on GSQ_METRICS_PORT if it is set
+if os.environ.get('GSQ_METRICS_PORT'):
+    metrics.serve(int(os.environ['GSQ_METRICS_PORT']))
+
+
+# Optional index status panel for whoever runs the server, e.g. to pick up a newly
+# published Index version without restarting. Enable with GSQ_INDEX_ADMIN=1
+if os.environ.get('GSQ_INDEX_ADMIN') == '1':
+    with st.sidebar.expander('Index status'):
+        report = shared_index.memory_report(deep=st.checkbox('Measure index size (slow)'))
+        st.write('Terms in Index:', report['terms'])
+        st.write('Load time (s):', round(report['load_seconds'] or 0, 1))
+        if report['parse_mb_per_s']:
+            st.write('Parse speed (MB/s):', round(report['parse_mb_per_s'], 1))
+        if report.get('index_bytes'):
+            st.write('Index size (MB):', round(report['index_bytes'] / 1e6, 1))
+        if report['process_rss_bytes']:
+            st.write('Server process memory (MB):', round(report['process_rss_bytes'] / 1e6, 1))
+        if report.get('resident_shards') is not None:
+            st.write('Index shards in memory:', report['resident_shards'])
+        cache_stats = result_cache.stats()
+        st.write('Cached search results:', cache_stats['entries'],
+                 '(%.1f MB)' % (cache_stats['bytes'] / 1e6))
+        st.write('Results cache hits / misses:', cache_stats['hits'], '/', cache_stats['misses'])
+        if st.button('Reload Index'):
+            shared_index.reload(index_url)
+            st.write('Index reloaded')
+
+
+# show one page of the results at a time; only that page's report IDs are turned
+# into PIDs, however many reports were found (see gsq_search/export.py)
+def show_result_page(searcher, result, key):
+    with metrics.trace('page'), metrics.phase('render'):
+        number = 1
+        pages = export.page_count(result.count)
+        if pages > 1:
+            st.write('The number of reports that contain your search term is too many to print them all out here. Browse them a page at a time below, or download the full list using the button below.')
+            # the page number lives in the session state only (a new search sets it
+            # back to 1), as a widget default as well makes Streamlit warn
+            if key not in st.session_state:
+                st.session_state[key] = 1
+            number = st.number_input('Page of results (%d reports per page)' % export.page_size,
+                                     min_value=1, max_value=pages, step=1, key=key)
+        return ', '.join(searcher.page(result, int(number)))
+
+# download button for the full list of results. The file is only made once it is asked
+# for: the download button needs the whole file, which for a search matching most of the
+# reports is several MB held in memory. It is made in chunks straight from the report IDs,
+# without a DataFrame, and kept with the search result in the results cache
+# (gsq_search/result_cache.py), so it is only made once per search and format
+def download_results(searcher, result, file_stem, key):
+    fmt = 'csv'
+    choices = export.available_formats()
+    if len(choices) > 1:
+        fmt = st.radio('File format', choices, format_func=str.upper, key=key + '_format')
+    extension, mime = export.formats[fmt]
+    # the search and format a file was made for stay asked for while the results are browsed
+    wanted = (result.key, fmt)
+    if st.session_state.get(key + '_file') != wanted:
+        if not st.button('Make the ' + fmt.upper() + ' file of the report list', key=key + '_make'):
+            return
+        st.session_state[key + '_file'] = wanted
+    with metrics.trace('export', format=fmt), metrics.phase('render'):
+        st.download_button(
+                label='Download Report List as ' + fmt.upper(), 
+                data=searcher.export(result, fmt), 
+                file_name=file_stem+'_'+'search_results.'+extension,
+                mime=mime,
+                key=key)
+
+# list the Index terms a wildcard search (e.g. granit*) was expanded to
+def show_expansions(result):
+    for pattern, terms, total in result.expansions:
+        shown = ', '.join(terms[:20]) + (', ...' if len(terms) > 20 else '')
+        st.write(pattern, 'matched', total, 'terms in the Index:', shown)
+        if total > len(terms):
+            st.write('Only the first', len(terms), 'of these terms were searched. Add more letters to narrow the search.')
+
+# 'did you mean' for a search word that isn't in the Index (OCR or typing errors)
+def show_suggestions(searcher, error):
+    word = str(error.args[0]) if error.args else ''
+    suggestions = searcher.suggest(word)
+    if suggestions:
+        st.write('Did you mean:', ', '.join(suggestions[:10]), '?')
+        st.write('Tick \'Include close spellings\' to search for these as well')
+
+
+# look up the Index terms (words, word pairs and triples) starting with some letters,
+# those in the most reports first, so searches use terms that are in the Index
+# (see gsq_search/autocomplete.py)
+with st.sidebar.expander('Find terms in the Index', expanded=True):
+    term_prefix = st.text_input('Terms starting with', key='term_prefix')
+    if term_prefix.strip():
+        completions = get_searcher().complete(term_prefix, limit=15)
+        if completions:
+            st.table(pd.DataFrame(completions, columns=['Term', 'Reports']))
+        else:
+            st.write('No terms in the Index start with', term_prefix)
 
 
 # Add a simple search option widget
@@ -96,26 +218,34 @@ if "basic_submit_button" not in st.session_state:
 
 
 with st.form(key='basic_search_form'):
-    basic_text_input1 = st.text_input(label='Enter the search term   (maximum of 3 consecutive words)')
+    basic_text_input1 = st.text_input(label='Enter the search term   (a word or a phrase)')
+    basic_fuzzy = st.checkbox('Include close spellings (words misread by the OCR or mistyped)', key='basic_fuzzy')
+    basic_variants = st.checkbox('Include other forms of each word (e.g. sample, samples, sampled, sampling)', key='basic_variants')
     basic_submit_button = st.form_submit_button(label='Search')
 
 if basic_submit_button or st.session_state.basic_submit_button:
+    # the results stay on the page while they are browsed or downloaded;
+    # a new search starts again from the first page of results
     st.session_state.basic_submit_button = True
+    if basic_submit_button:
+        st.session_state.basic_page = 1
     st.markdown('*Searching the OCR\'d open-file GSQ Reports...*')
     st.write('\n')
     st.spinner(text='searching...')
+    # searches run through the same Searcher as scripts and the batch CLI (gsq_search/searcher.py)
+    searcher = get_searcher()
     
     # Process search term to lowercase
     w01 = basic_text_input1.lower()
     
     
-    # Remove numbers, symbols and punctuation
-    w0 = "".join([ w if (w.isalpha() or w == " ") else "" for w in w01])
+    # Remove numbers, symbols and punctuation (keeping * for wildcard searches)
+    w0 = clean_term(w01, keep='*')
     if w01.isalpha() == False:
         st.write("Modifying search term to", w0)
         
-    # lemmatise search term
-    #word0 = wnl.lemmatize(w0)  # this index file not lemmatised so skip
+    # the Index isn't lemmatised; other forms of the search words are searched for
+    # with the 'Include other forms' option (see gsq_search/normalize.py)
     word0 = w0
     
     # easter egg
@@ -123,39 +253,30 @@ if basic_submit_button or st.session_state.basic_submit_button:
         st.balloons()
     
     try:
-        result0 = ocr_index[word0]
-    
+        # a word, a phrase or a wildcard such as granit*
+        basic_query = term_query(word0)
         
-    # Create list to hold results
-        search_result = []
+        # repeated searches are answered from the results cache shared by all sessions
+        result_count = searcher.count(basic_query, fuzzy=basic_fuzzy, variants=basic_variants)
         
-        if result0:
-            for item in result0:
-                search_result.append(item)
-            search_result.sort()
-            output = ', '.join(search_result)
-            st.write(len(search_result),'results found')
-            if len(search_result) > 200:
-                st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-            else:
-                st.write('The following reports contain the term',w0,':')
-                output
+        if result_count:
+            st.write(result_count,'results found')
+            
+            # the matching report IDs; PIDs are only listed a page at a time
+            result0 = searcher.search(basic_query, fuzzy=basic_fuzzy, variants=basic_variants)
+            show_expansions(result0)
+            if result0.candidate:
+                st.write('This phrase is not in the Index as a whole, so these are candidate reports that contain all of its word pairs/triples (or words)')
+            output = show_result_page(searcher, result0, key='basic_page')
+            st.write('The following reports contain the term',w0,':')
+            output
         
             st.write('\n')
             st.write('\n')
             
-            # Convert the output to csv format
-            results_df = pd.DataFrame(search_result, columns=['report_pid'])
-            
-            results_csv = convert_df(results_df)
+            st.markdown('**Download the basic search results as a file?**')
             
-            st.markdown('**Download the basic search results as a CSV file?**')
-            
-            st.download_button(
-                    label='Download Report List as CSV', 
-                    data=results_csv, 
-                    file_name=basic_text_input1+'_'+'search_results.csv',
-                    mime='text/csv')
+            download_results(searcher, result0, basic_text_input1, key='basic_download')
             
             st.write('\n')
             st.write('The GSQ Open Data Portal has an API that allows access to the reports, including any associated documents. The reports found in the search results here can be downloaded in full via the API')
@@ -164,12 +285,13 @@ if basic_submit_button or st.session_state.basic_submit_button:
             # st.markdown('**Download the report documents in full?**')
             # if st.button('Download full Reports'):
             #     st.write('still working on this part....')
-            
-            st.session_state.basic_submit_button = False
     
-    except:
-        KeyError()
+    except QuerySyntaxError as error:
+        st.write('Sorry, the search term could not be read:', str(error))
+    
+    except KeyError as error:
         st.write('Sorry, the search term was not found in the GSQ reports')
+        show_suggestions(searcher, error)
         st.write('Try searching the words in a different order')
         st.write('\n')
 
@@ -178,17 +300,30 @@ if basic_submit_button or st.session_state.basic_submit_button:
 # Add the advanced search term input widget
 if advanced:
     st.header('Advanced Search')
-    st.write('Each search term may be a single word or a phrase of up to 3 consecutive words that you\'d expect to occur together in a sentence)')
+    st.write('Each search term may be a single word or a phrase of consecutive words that you\'d expect to occur together in a sentence')
     st.write('Please note: The advanced search looks for \'(term1 condition1 term2) condition2 term3\'')
+    st.write('Alternatively, type a full search expression using AND, OR, NOT and brackets, for example: (gold OR silver) AND "drill hole" NOT coal. Conditions are applied from left to right; put phrases in quotes.')
+    st.write('A search term ending or starting with * matches every term in the Index beginning or ending with those letters, e.g. granit* or *stone')
+    if "advanced_submit_button" not in st.session_state:
+        st.session_state.advanced_submit_button = False
+    
     with st.form(key='advanced_search_form'):
         text_input1 = st.text_input(label='Enter the first search term (term1)')
         join1 = st.selectbox('first conditional search type (condition1)',('AND', 'OR', 'NOT'))
         text_input2 = st.text_input(label='Enter the second search term (term2)')
         join2 = st.selectbox('second conditional search type (condition2)',('AND', 'OR', 'NOT'))
         text_input3 = st.text_input(label='Enter the third search term (term3)')
+        expression_input = st.text_input(label='Or enter a full search expression (optional, used instead of the terms above)')
+        advanced_fuzzy = st.checkbox('Include close spellings (words misread by the OCR or mistyped)', key='advanced_fuzzy')
+        advanced_variants = st.checkbox('Include other forms of each word (e.g. sample, samples, sampled, sampling)', key='advanced_variants')
         advanced_submit_button = st.form_submit_button(label='Search')
     
-    if advanced_submit_button:
+    if advanced_submit_button or st.session_state.advanced_submit_button:
+        # the results stay on the page while they are browsed or downloaded;
+        # a new search starts again from the first page of results
+        st.session_state.advanced_submit_button = True
+        if advanced_submit_button:
+            st.session_state.advanced_page = 1
         st.markdown('*Searching the OCR\'d open-file GSQ Reports...*')
         st.write('\n')
         st.spinner(text='searching...')
@@ -204,337 +339,76 @@ if advanced:
         w2 = text_input2.lower()
         w3 = text_input3.lower()
         
-        # Remove numbers, symbols and punctuation
-        w11 = "".join([w if (w.isalpha() or w == " ") else "" for w in w1])
+        # Remove numbers, symbols and punctuation (keeping * for wildcard searches)
+        w11 = clean_term(w1, keep='*')
         
-        w22 = "".join([w if (w.isalpha() or w == " ") else "" for w in w2])
+        w22 = clean_term(w2, keep='*')
         
-        w33 = "".join([w if (w.isalpha() or w == " ") else "" for w in w3])
+        w33 = clean_term(w3, keep='*')
         
         
-        if (w1.isalpha() or w2.isalpha() or w3.isalpha()) == False:
+        if (w1.isalpha() or w2.isalpha() or w3.isalpha()) == False and not expression_input.strip():
             st.write("Modifying search term to", w11, join1, w22, join2, w33)
         
         
-        # lemmatise search term       # this index not lemmatised so skip
-        #word1 = wnl.lemmatize(w11)
-        #word2 = wnl.lemmatize(w22)
-        #word3 = wnl.lemmatize(w33)
-        
-        word1 = w11
-        word2 = w22
-        word3 = w33
         
                     
-        # Create lists to hold results
-        search_result = []
-        final_search_result = []
+        # a typed search expression is used instead of the three search terms
+        if expression_input.strip():
+            try:
+                query = parse_query(expression_input)
+            except QuerySyntaxError as error:
+                st.write('Sorry, the search expression could not be read:', str(error))
+                st.stop()
+            search_terms = [str(query)]
+            file_stem = re.sub(r'\W+', '_', str(query)).strip('_')
+        else:
+            # Build the search expression '(term1 condition1 term2) condition2 term3',
+            # or 'term1 condition1 term2' when there is no third search term
+            try:
+                # the entries as typed: a third term left blank is left out
+                query = form_query([text_input1, text_input2, text_input3], [join1, join2])
+                if text_input3.strip():
+                    search_terms = [text_input1, join1, text_input2, join2, text_input3]
+                else:
+                    search_terms = [text_input1, join1, text_input2]
+            except QuerySyntaxError as error:
+                st.write('Sorry, the search terms could not be read:', str(error))
+                st.stop()
+            file_stem = text_input1+'_'+join1+'_'+text_input2+'_'+join2+'_'+text_input3
+
+
+        searcher = get_searcher()
 
         # catch the KeyError when Index doesn't contain search term
         try:
 
-            # Check the third search term exists, then search '(term1 condition1 term2) condition2 term3'
-            if text_input3 != '':
-                
-                result1 = ocr_index[word1]
-                result2 = ocr_index[word2]
-                result3 = ocr_index[word3]
-                                   
-                # Add AND/AND Boolean search conditions
-                if (join1 == 'AND' and join2 == 'AND'):
-                    for item in result2:
-                        if item in result1:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in result3:
-                        if item in search_result:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-                        
-                # Add AND/OR Boolean search conditions
-                elif (join1 == 'AND' and join2 == 'OR'):
-                    for item in result2:
-                        if item in result1:
-                            search_result.append(item)
-                    for item in result3:
-                        if item not in search_result:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in search_result:
-                        final_search_result.append(item)
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-                        
-                # Add AND/NOT Boolean search conditions                    
-                elif (join1 == 'AND' and join2 == 'NOT'):
-                    for item in result2:
-                        if item in result1:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in search_result:
-                        if item not in result3:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-     
-                # Add OR/AND Boolean search conditions
-                elif (join1 == 'OR' and join2 == 'AND'):
-                    for item in result1:
-                        search_result.append(item)
-                    for item in result2:
-                        if item not in result1:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in result3:
-                        if item in search_result:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-     
-                # Add OR/OR Boolean search conditions
-                elif (join1 == 'OR' and join2 == 'OR'):
-                    for item in result1:
-                        search_result.append(item)
-                    for item in result2:
-                        if item not in result1:
-                            search_result.append(item)
-                    for item in result3:
-                        if item not in search_result:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in search_result:
-                        final_search_result.append(item)
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output   
-    
-                # Add OR/NOT Boolean search conditions
-                elif (join1 == 'OR' and join2 == 'NOT'):
-                    for item in result1:
-                        search_result.append(item)
-                    for item in result2:
-                        if item not in result1:
-                            search_result.append(item)
-                    for item in search_result:
-                        if item not in result3:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-    
-                # Add NOT/AND Boolean search conditions        
-                elif (join1 == 'NOT' and join2 == 'AND'):
-                    for item in result1:
-                        if item not in result2:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in result3:
-                        if item in search_result:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-    
-                # Add NOT/OR Boolean search conditions    
-                elif (join1 == 'NOT' and join2 == 'OR'):
-                    for item in result1:
-                        if item not in result2:
-                            search_result.append(item)
-                    for item in result3:
-                        if item not in search_result:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in search_result:
-                        final_search_result.append(item)
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-    
-                # Add NOT/NOT Boolean search conditions
-                elif (join1 == 'NOT' and join2 == 'NOT'):
-                    for item in result1:
-                        if item not in result2:
-                            search_result.append(item)
-                    search_result.sort()
-                    for item in search_result:
-                        if item not in result3:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2, join2, text_input3,':')
-                        output
-                
-                
-            # search 'term1 condition1 term2' only
+            # evaluate the AND/OR/NOT search conditions (rarest terms first), and show
+            # the number of results before the report list is made
+            result_count = searcher.count(query, fuzzy=advanced_fuzzy, variants=advanced_variants)
+            if result_count == 0:
+                st.write('Sorry, no results were found for that specific search')
+                st.write('You could try the search using similar words instead, or try the same words in a different order')
+                st.write('\n') 
             else:
-                result1 = ocr_index[word1]
-                result2 = ocr_index[word2]
-                        
-            # Add first Boolean search condition
-                if join1 == 'AND':
-                    for item in result2:
-                        if item in result1:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(final_search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2,':')
-                        output
-    
+                st.write(result_count,'results found')
+            # the matching report IDs; PIDs are only listed a page at a time
+            final_result = searcher.search(query, fuzzy=advanced_fuzzy, variants=advanced_variants)
+            show_expansions(final_result)
+            if final_result.candidate:
+                st.write('Some phrases are not in the Index as a whole, so these are candidate reports that contain all of their word pairs/triples (or words)')
+            if result_count:
+                output = show_result_page(searcher, final_result, key='advanced_page')
+                st.write('The following reports contain the terms', *search_terms, ':')
+                output
                 
-                elif join1 == 'OR':
-                    for item in result1:
-                        final_search_result.append(item)
-                    for item in result2:
-                        if item not in result1:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(final_search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2,':')
-                        output
-                    
-                elif join1 == 'NOT':
-                    for item in result1:
-                        if item not in result2:
-                            final_search_result.append(item)
-                    final_search_result.sort()
-                    output = ', '.join(final_search_result)
-                    if len(final_search_result) == 0:
-                        st.write('Sorry, no results were found for that specific search')
-                        st.write('You could try the search using similar words instead, or try the same words in a different order')
-                        st.write('\n') 
-                    else:
-                        st.write(len(final_search_result),'results found')
-                    if len(final_search_result) > 200:
-                        st.write('The number of reports that contain your search term is too many to print them all out here. Download the full list using the button below.')
-                    else:
-                        st.write('The following reports contain the terms',text_input1, join1, text_input2,':')
-                        output
-    
                     
             st.write('\n')
             st.write('\n')
             
             
-            # Convert the output to csv format
-            df = pd.DataFrame(final_search_result, columns=['report_pid'])
-            
-            results_csv = convert_df(df)
-            
-            st.markdown('**Download the basic search results as a CSV file?**')
-            st.download_button(
-                    label='Download Report List as CSV', 
-                    data=results_csv, 
-                    file_name=text_input1+'_'+join1+'_'+text_input2+'_'+join2+'_'+text_input3+'_'+'search_results.csv',
-                    mime='text/csv')
+            st.markdown('**Download the advanced search results as a file?**')
+            download_results(searcher, final_result, file_stem, key='advanced_download')
         
             st.write('\n')
             st.write('The GSQ Open Data Portal has an API that allows access to the reports, including any associated documents. The reports found in the search results here can be downloaded in full via the API')
@@ -544,13 +418,26 @@ if advanced:
             # if st.button('Get the full Reports'):
             #     st.write('still working on this part....')
 
-        except:
-            KeyError()
+        except KeyError as error:
             st.write('The search term is not found in the GSQ Report Index')
+            show_suggestions(searcher, error)
             st.write('You could try the search again using similar words instead')
             st.write('\n') 
 
 
+# Optional debug panel with the timings of the last searches and Index loads of this
+# server process (all sessions), and the cache hits/misses. Enable with GSQ_DEBUG=1
+if os.environ.get('GSQ_DEBUG') == '1':
+    with st.sidebar.expander('Search timings'):
+        traces = [trace.as_dict() for trace in metrics.recent_traces()]
+        if traces:
+            st.dataframe(pd.DataFrame(traces))
+        else:
+            st.write('No searches yet')
+        st.write('Cache requests:')
+        st.json({'%s %s' % key: count for key, count in metrics.cache_requests.items()})
+
+
 # Add a 'clear form' option
 # st.write('\n')
 # st.write('\n')
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the S3 bucket the Index is published in, for the download
+and cache tests.
+
+`s3.put(name, body)` publishes an object (with an MD5 ETag and a Last-Modified
+date, as S3 gives them) and `s3.url(name)` is its URL. HEAD and GET answer
+If-None-Match and If-Modified-Since with 304, GET answers a Range header with 206
+(and a failed If-Match with 412), and every request is kept in `s3.requests`.
+`s3.fail(start, ...)` makes the next Range requests starting at byte `start` fail,
+with a 500 or a body cut off part way through.
+
+"""
+
+import hashlib
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class Object:
+
+    def __init__(self, body, etag=None, last_modified=None):
+        self.body = body
+        self.etag = etag if etag is not None else '"%s"' % hashlib.md5(body).hexdigest()
+        self.last_modified = last_modified or formatdate(usegmt=True)
+
+
+class S3Handler(BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        s3 = self.server.s3
+        s3.requests.append((self.command, self.path, dict(self.headers)))
+        found = s3.objects.get(self.path.lstrip('/'))
+        if found is None:
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match'):
+            if self.headers['If-None-Match'] == found.etag:
+                return self.not_modified()
+        elif self.headers.get('If-Modified-Since') == found.last_modified:
+            return self.not_modified()
+        if self.headers.get('If-Match') and self.headers['If-Match'] != found.etag:
+            self.send_error(412)
+            return
+
+        body, status, failure = found.body, 200, None
+        requested = self.headers.get('Range')
+        if requested and s3.ranges and self.command == 'GET':
+            start, end = map(int, requested.split('=')[1].split('-'))
+            body, status = found.body[start:end + 1], 206
+            failures = s3.failures.get(start)
+            if failures:
+                failure = failures.pop(0)
+        if failure == 'error':
+            self.send_error(500)
+            return
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if found.etag:
+            self.send_header('ETag', found.etag)
+        self.send_header('Last-Modified', found.last_modified)
+        if s3.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if failure == 'truncate':
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        elif send_body:
+            self.wfile.write(body)
+
+    def not_modified(self):
+        self.send_response(304)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class S3StandIn:
+
+    def __init__(self):
+        self.objects = {}
+        self.requests = []
+        # whether Range requests are answered
+        self.ranges = True
+        # range start -> failures still to come
+        self.failures = {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), S3Handler)
+        self._server.daemon_threads = True
+        self._server.s3 = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+
+    def url(self, name):
+        return 'http://127.0.0.1:%d/%s' % (self._server.server_address[1], name)
+
+    def put(self, name, body, etag=None, last_modified=None):
+        self.objects[name] = Object(body, etag, last_modified)
+        return self.url(name)
+
+    def fail(self, start, *failures):
+        """Fail the next Range requests starting at `start`, one per failure given:
+        'error' (a 500) or 'truncate' (half the body, then the connection closes).
+        """
+        self.failures.setdefault(start, []).extend(failures)
+
+    def ranges_sent(self):
+        """The first byte of each Range request received."""
+        return [int(headers['Range'].split('=')[1].split('-')[0])
+                for method, path, headers in self.requests if 'Range' in headers]
+
+    def sent(self, method=None):
+        """The requests received (of one method), as `(method, path, headers)`."""
+        return [request for request in self.requests if method is None or request[0] == method]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def s3():
+    server = S3StandIn()
+    yield server
+    server.stop()
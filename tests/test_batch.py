@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for running a file of searches (gsq_search/batch.py) against an Index
+published in the S3 stand-in.
+
+"""
+
+import csv
+import json
+
+import pytest
+
+from gsq_search import batch
+from gsq_search.index import shared_index
+from gsq_search.query import QuerySyntaxError, parse_query
+
+postings = {
+    'gold': ['CR1', 'CR2', 'CR5'],
+    'coal': ['CR2', 'CR3'],
+    'drill': ['CR3', 'CR4', 'CR5'],
+    'hole': ['CR3', 'CR4', 'CR5'],
+    'core': ['CR4', 'CR5'],
+    'drill hole': ['CR3', 'CR4', 'CR5'],
+}
+
+queries = '''# searches for the batch tests
+gold
+
+gold AND coal
+"drill hole core"
+unobtainium OR gold
+gold AND (coal
+  coal NOT gold
+'''
+
+
+@pytest.fixture
+def url(s3, tmp_path, monkeypatch):
+    monkeypatch.setenv('GSQ_INDEX_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('GSQ_INDEX_LAYOUT', 'mapped')
+    monkeypatch.delenv('GSQ_INDEX_SEGMENTS_URL', raising=False)
+    # the Index file holds the JSON index as a JSON string
+    yield s3.put('index.json', json.dumps(json.dumps(postings)).encode('utf-8'))
+    shared_index.invalidate()
+
+
+@pytest.fixture
+def queries_file(tmp_path):
+    path = tmp_path / 'queries.txt'
+    path.write_text(queries, encoding='utf-8')
+    return path
+
+
+def syntax_error(query):
+    with pytest.raises(QuerySyntaxError) as error:
+        parse_query(query)
+    return 'could not read the query: %s' % error.value
+
+
+def expected_rows():
+    # (query_number, query, report_pid, match, count, error)
+    return [
+        ('2', 'gold', 'CR1', '', '3', ''),
+        ('2', 'gold', 'CR2', '', '3', ''),
+        ('2', 'gold', 'CR5', '', '3', ''),
+        ('4', 'gold AND coal', 'CR2', '', '1', ''),
+        ('5', '"drill hole core"', 'CR4', 'candidate', '2', ''),
+        ('5', '"drill hole core"', 'CR5', 'candidate', '2', ''),
+        ('6', 'unobtainium OR gold', '', '', '0', 'not in the Index: unobtainium'),
+        ('7', 'gold AND (coal', '', '', '0', syntax_error('gold AND (coal')),
+        ('8', 'coal NOT gold', 'CR3', '', '1', ''),
+    ]
+
+
+def read_results(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        assert next(reader) == batch.columns
+        rows = list(reader)
+    for row in rows:
+        assert float(row[5]) >= 0
+    return [tuple(row[:5] + row[6:]) for row in rows]
+
+
+def test_read_queries_skips_blank_and_comment_lines(queries_file):
+    with open(queries_file, encoding='utf-8') as f:
+        assert [number for number, _ in batch.read_queries(f)] == [2, 4, 5, 6, 7, 8]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_results_file(url, queries_file, tmp_path, workers):
+    output = tmp_path / 'results.csv'
+    batch.main([str(queries_file), str(output), '--url', url, '--workers', str(workers)])
+    assert read_results(output) == expected_rows()
+
+
+def test_run_batch_yields_each_query_in_order(url, queries_file):
+    with open(queries_file, encoding='utf-8') as f:
+        found = list(batch.run_batch(batch.read_queries(f), url, workers=1))
+    assert [(number, query) for number, query, *_ in found] == [
+        (2, 'gold'), (4, 'gold AND coal'), (5, '"drill hole core"'), (6, 'unobtainium OR gold'),
+        (7, 'gold AND (coal'), (8, 'coal NOT gold')]
+    number, query, pids, candidate, seconds, error = found[4]
+    assert (pids, candidate) == ([], False)
+    assert error == syntax_error('gold AND (coal')
+
+
+def test_format_rows_quotes_the_query():
+    text = batch.format_rows(3, 'gold, "coal"', ['CR1', 'CR2'], True, 0.25, '')
+    assert list(csv.reader(text.splitlines())) == [
+        ['3', 'gold, "coal"', 'CR1', 'candidate', '2', '0.250000', ''],
+        ['3', 'gold, "coal"', 'CR2', 'candidate', '2', '0.250000', ''],
+    ]
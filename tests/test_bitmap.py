@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that Bitmaps (gsq_search/bitmap.py), and postings operations mixing them with
+sorted arrays (gsq_search/postings.py), give what plain sorted lists give.
+
+"""
+
+import random
+from array import array
+
+import pytest
+
+from gsq_search import postings as ops
+from gsq_search.bitmap import Bitmap, array_limit
+
+rng = random.Random(1)
+
+
+def ids(*per_container):
+    """Sorted random IDs, with the given number in each 65,536-ID container."""
+    found = []
+    for high, count in enumerate(per_container):
+        found.extend(sorted(rng.sample(range(high << 16, (high + 1) << 16), count)))
+    return found
+
+
+sparse = 50
+dense = array_limit + 5000
+shapes = {
+    'sparse': lambda: ids(sparse, sparse, 0, sparse),
+    'dense': lambda: ids(dense, dense, 0, dense),
+    'mixed': lambda: ids(dense, sparse, dense, 0),
+    'boundary': lambda: ids(array_limit, array_limit + 1),
+    'empty': lambda: [],
+}
+pairs = [(a, b) for a in shapes for b in shapes]
+
+
+@pytest.fixture(scope='module')
+def lists():
+    return {name: make() for name, make in shapes.items()}
+
+
+@pytest.mark.parametrize('name', sorted(shapes))
+def test_bitmap_holds_its_ids(lists, name):
+    found = lists[name]
+    bitmap = Bitmap.from_ids(array('I', found))
+    assert list(bitmap.to_array()) == found
+    assert len(bitmap) == len(found)
+    assert bool(bitmap) == bool(found)
+    members = set(found)
+    for report_id in found[::97] + [0, 1 << 16, 3 << 16, (4 << 16) - 1]:
+        assert (report_id in bitmap) == (report_id in members)
+
+
+@pytest.mark.parametrize('name', sorted(shapes))
+def test_slice_and_rank(lists, name):
+    found = lists[name]
+    bitmap = Bitmap.from_ids(array('I', found))
+    for start, stop in [(0, 10), (0, len(found)), (len(found) // 3, len(found) // 2), (sparse - 3, dense + 7),
+                        (len(found) - 5, len(found) + 5)]:
+        assert list(bitmap.slice(start, stop)) == found[start:stop]
+    for report_id in found[::251] + [0, 5 << 16]:
+        assert bitmap.rank(report_id) == len([i for i in found if i < report_id])
+
+
+@pytest.mark.parametrize('a, b', pairs)
+def test_bitmap_operations(lists, a, b):
+    left, right = lists[a], lists[b]
+    x, y = Bitmap.from_ids(array('I', left)), Bitmap.from_ids(array('I', right))
+    assert list((x & y).to_array()) == sorted(set(left) & set(right))
+    assert list((x | y).to_array()) == sorted(set(left) | set(right))
+    assert list((x - y).to_array()) == sorted(set(left) - set(right))
+    assert list(x.filter(array('I', right))) == sorted(set(left) & set(right))
+    assert list(x.filter(array('I', right), keep=False)) == sorted(set(right) - set(left))
+
+
+@pytest.mark.parametrize('a, b', pairs)
+@pytest.mark.parametrize('a_bitmap, b_bitmap', [(True, False), (False, True), (False, False)])
+def test_postings_operations_on_bitmaps_and_arrays(lists, a, b, a_bitmap, b_bitmap):
+    left, right = lists[a], lists[b]
+    x = Bitmap.from_ids(array('I', left)) if a_bitmap else array('I', left)
+    y = Bitmap.from_ids(array('I', right)) if b_bitmap else array('I', right)
+    assert list(ops.intersect(x, y)) == sorted(set(left) & set(right))
+    assert list(ops.union(x, y)) == sorted(set(left) | set(right))
+    assert list(ops.difference(x, y)) == sorted(set(left) - set(right))
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the RemoteSearcher (gsq_search/client.py) against the search service
+(gsq_search/service.py) run in a thread.
+
+"""
+
+import asyncio
+import threading
+
+import pytest
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+
+from gsq_search.client import RemoteSearcher
+from gsq_search.compact_index import from_dict
+from gsq_search.download import make_session
+from gsq_search.query import QuerySyntaxError, parse_query
+from gsq_search.result_cache import ResultCache
+from gsq_search.searcher import Searcher, form_query
+from gsq_search.service import make_app
+
+postings = {'gold': ['CR1', 'CR2'], 'coal': ['CR2', 'CR3'], 'granite': ['CR%d' % i for i in range(3, 13)]}
+
+
+@pytest.fixture
+def service():
+    searcher = Searcher(from_dict(postings, version='v1'), cache=ResultCache())
+    started = threading.Event()
+    running = {}
+
+    def serve():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        tornado.httpserver.HTTPServer(make_app(searcher, threads=2)).add_sockets(sockets)
+        running['port'] = sockets[0].getsockname()[1]
+        running['loop'] = tornado.ioloop.IOLoop.current()
+        started.set()
+        running['loop'].start()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait(5)
+    yield searcher, 'http://127.0.0.1:%d' % running['port']
+    running['loop'].add_callback(running['loop'].stop)
+    thread.join(5)
+
+
+@pytest.fixture
+def remote(service):
+    session = make_session()
+    session.sent = []
+    session.hooks['response'].append(lambda response, *args, **kwargs: session.sent.append(response.request.path_url))
+    return RemoteSearcher(service[1], session)
+
+
+def pids_requests(remote):
+    return [path for path in remote.session.sent if path.startswith('/pids')]
+
+
+def test_export_is_fetched_once_per_search_and_format(remote):
+    result = remote.search('gold OR coal')
+    data = remote.export(result)
+    assert data.decode('utf-8').split() == ['report_pid', 'CR1', 'CR2', 'CR3']
+
+    # the page is run again, with a new result object
+    assert remote.export(remote.search('gold OR coal')) == data
+    assert len(pids_requests(remote)) == 1
+
+    remote.export(remote.search('gold OR coal', fuzzy=True))
+    remote.export(remote.search('gold'))
+    assert len(pids_requests(remote)) == 3
+
+
+def test_export_is_fetched_again_for_a_new_index_version(service, remote):
+    searcher, _ = service
+    remote.export(remote.search('gold'))
+    searcher._index = from_dict(dict(postings, gold=['CR1']), version='v2')
+    data = remote.export(remote.search('gold'))
+    assert data.decode('utf-8').split() == ['report_pid', 'CR1']
+    assert len(pids_requests(remote)) == 2
+
+
+def test_export_cache_drops_the_least_recently_used_files(remote, monkeypatch):
+    small = len(remote.export(remote.search('gold')))
+    # room for two small files
+    monkeypatch.setattr('gsq_search.client.max_export_bytes', 2 * small + 1)
+    for query in ('coal', 'gold', 'coal'):
+        remote.export(remote.search(query))
+    assert len(pids_requests(remote)) == 2
+    # a third drops gold, the least recently used
+    remote.export(remote.search('gold OR gold'))
+    remote.export(remote.search('coal'))
+    assert len(pids_requests(remote)) == 3
+    remote.export(remote.search('gold'))
+    assert len(pids_requests(remote)) == 4
+
+
+def test_query_syntax_error_has_the_parsers_message(remote):
+    with pytest.raises(QuerySyntaxError) as local:
+        parse_query('gold AND')
+    with pytest.raises(QuerySyntaxError) as error:
+        remote.count('gold AND')
+    assert str(error.value) == str(local.value)
+
+
+def test_missing_term_raises_key_error(remote):
+    with pytest.raises(KeyError) as error:
+        remote.search('unobtainium')
+    assert error.value.args == ('unobtainium',)
+
+
+@pytest.mark.parametrize('terms', [['gold', 'coal', '123'], ['--', 'gold', ''], ['gold', '42', '']])
+def test_empty_term_raises_key_error_as_locally(service, remote, terms):
+    query = form_query(terms, ['AND', 'OR'])
+    with pytest.raises(KeyError) as local:
+        service[0].search(query)
+    sent = len(remote.session.sent)
+    with pytest.raises(KeyError) as error:
+        remote.search(query)
+    assert error.value.args == local.value.args == ('',)
+    # not sent to the service
+    assert len(remote.session.sent) == sent
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the parallel, resumable ranged download (gsq_search/download.py) and its
+checksum check in the Index cache.
+
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import random
+
+import pytest
+
+from gsq_search import download
+from gsq_search.download import DownloadError, ObjectChanged, RangedDownload
+from gsq_search.index_cache import IndexCache, IndexUnavailable
+
+range_size = 1024
+rng = random.Random(1)
+body = bytes(rng.getrandbits(8) for _ in range(10 * range_size + 123))
+starts = list(range(0, len(body), range_size))
+
+
+def ranged(s3, tmp_path, etag=None):
+    url = s3.url('index.json')
+    return RangedDownload(url, str(tmp_path / 'index.json.part'), len(body),
+                          etag or s3.objects['index.json'].etag, workers=4, range_size=range_size, timeout=5)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_downloads_every_range(s3, tmp_path):
+    s3.put('index.json', body)
+    seen = []
+    path = ranged(s3, tmp_path).run(lambda stage, done, total: seen.append((done, total)))
+    assert read(path) == body
+    assert sorted(s3.ranges_sent()) == starts
+    assert seen[-1] == (len(body), len(body))
+
+
+def test_cut_off_range_is_retried(s3, tmp_path):
+    s3.put('index.json', body)
+    s3.fail(2 * range_size, 'truncate')
+    path = ranged(s3, tmp_path).run()
+    assert read(path) == body
+    assert s3.ranges_sent().count(2 * range_size) == 2
+
+
+def test_server_error_on_a_range_is_retried(s3, tmp_path):
+    s3.put('index.json', body)
+    s3.fail(range_size, 'error')
+    path = ranged(s3, tmp_path).run()
+    assert read(path) == body
+    assert s3.ranges_sent().count(range_size) == 2
+
+
+def test_failed_download_resumes_with_only_the_missing_ranges(s3, tmp_path):
+    s3.put('index.json', body)
+    missing = 3 * range_size
+    s3.fail(missing, *['error'] * download.retries)
+    with pytest.raises(DownloadError):
+        ranged(s3, tmp_path).run()
+    with open(str(tmp_path / 'index.json.part.json'), encoding='utf-8') as f:
+        done = json.load(f)['done']
+    assert sorted(done) == [i for i in range(len(starts)) if starts[i] != missing]
+
+    s3.requests.clear()
+    path = ranged(s3, tmp_path).run()
+    assert s3.ranges_sent() == [missing]
+    assert read(path) == body
+
+
+def test_pieces_of_another_version_are_not_resumed(s3, tmp_path):
+    s3.put('index.json', body)
+    s3.fail(0, *['error'] * download.retries)
+    with pytest.raises(DownloadError):
+        ranged(s3, tmp_path).run()
+
+    new_body = body[::-1]
+    s3.put('index.json', new_body)
+    s3.requests.clear()
+    path = ranged(s3, tmp_path).run()
+    assert sorted(s3.ranges_sent()) == starts
+    assert read(path) == new_body
+
+
+def test_object_replaced_during_the_download(s3, tmp_path):
+    s3.put('index.json', body)
+    download_ = ranged(s3, tmp_path, etag='"%s"' % hashlib.md5(b'old version').hexdigest())
+    with pytest.raises(ObjectChanged):
+        download_.run()
+    assert not os.path.exists(download_.part_path)
+    assert not os.path.exists(download_.state_path)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, 'range_size', range_size)
+    return IndexCache(str(tmp_path / 'cache'), offline=False, timeout=5, workers=4)
+
+
+def leftovers(cache):
+    return [name for name in os.listdir(cache.cache_dir) if '.part' in name]
+
+
+def test_index_cache_downloads_in_ranges(s3, cache):
+    url = s3.put('index.json', body)
+    with gzip.open(cache.fetch(url), 'rb') as f:
+        assert f.read() == body
+    assert sorted(s3.ranges_sent()) == starts
+    assert leftovers(cache) == []
+
+
+def test_download_not_matching_the_etag_is_rejected(s3, cache):
+    url = s3.put('index.json', body, etag='"%s"' % hashlib.md5(b'something else').hexdigest())
+    with pytest.raises(IndexUnavailable):
+        cache.fetch(url)
+    assert not os.path.exists(cache.snapshot_path(url))
+    assert leftovers(cache) == []
+
+
+def test_download_not_matching_the_etag_keeps_the_cached_copy(s3, cache):
+    url = s3.put('index.json', body)
+    path = cache.fetch(url)
+    s3.put('index.json', body[::-1], etag='"%s"' % hashlib.md5(b'something else').hexdigest())
+
+    assert cache.fetch(url) == path
+    with gzip.open(path, 'rb') as f:
+        assert f.read() == body
+    assert cache.read_meta(url)['etag'] == '"%s"' % hashlib.md5(body).hexdigest()
+    assert leftovers(cache) == []
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for pages and CSV downloads of search results (gsq_search/export.py).
+
+"""
+
+import random
+
+import pandas as pd
+import pytest
+
+from gsq_search import export
+from gsq_search.bitmap import Bitmap
+from gsq_search.compact_index import from_dict
+from gsq_search.segments import SegmentedIndex
+
+rng = random.Random(1)
+# PIDs the CSV has to quote
+pids = sorted(['CR%04d' % i for i in range(1000)] + ['CR,1001', 'CR"1002', 'CR 1003'])
+postings = {'gold': sorted(rng.sample(pids, 700)), 'coal': sorted(rng.sample(pids, 40)), 'quartz': pids}
+
+
+def compact_layout():
+    return from_dict(postings)
+
+
+def segmented_layout():
+    # the segments' PIDs interleave, so sorted report IDs don't give sorted PIDs
+    parts = [set(pids[0::3]), set(pids[1::3]), set(pids[2::3])]
+    return SegmentedIndex([from_dict({term: [pid for pid in found if pid in part]
+                                      for term, found in postings.items()}) for part in parts])
+
+
+@pytest.fixture(params=[compact_layout, segmented_layout], ids=['compact', 'segmented'])
+def index(request):
+    return request.param()
+
+
+def app_csv(found, candidate=False):
+    # the app's download before iter_csv (pandas writes '\n' line ends on Linux)
+    df = pd.DataFrame(found, columns=['report_pid'])
+    if candidate:
+        df['match'] = 'candidate'
+    return df.to_csv(index=False, lineterminator='\n').encode('utf-8')
+
+
+@pytest.mark.parametrize('term', sorted(postings))
+@pytest.mark.parametrize('chunk', [1, 7, 256, export.chunk_size])
+@pytest.mark.parametrize('candidate', [False, True])
+def test_csv_matches_the_apps_dataframe_csv(index, term, chunk, candidate):
+    ids = index.postings(term)
+    assert b''.join(export.iter_csv(index, ids, candidate, chunk)) == app_csv(postings[term], candidate)
+
+
+def test_csv_of_a_bitmap_result(index):
+    ids = Bitmap.from_ids(list(index.postings('gold')))
+    assert b''.join(export.iter_csv(index, ids, chunk=33)) == app_csv(postings['gold'])
+
+
+def test_csv_of_an_empty_result(index):
+    assert b''.join(export.iter_csv(index, export.ids_slice(index.postings('gold'), 0, 0))) == b'report_pid\n'
+
+
+@pytest.mark.parametrize('term', sorted(postings))
+@pytest.mark.parametrize('size', [1, 13, export.page_size])
+def test_pages_cover_the_sorted_pids(index, term, size):
+    ids = index.postings(term)
+    found = postings[term]
+    pages = export.page_count(len(found), size)
+    assert pages == max(1, -(-len(found) // size))
+    for number in range(1, pages + 1):
+        assert export.page(index, ids, number, size) == found[(number - 1) * size:number * size]
+    assert export.page(index, ids, pages + 1, size) == []
+    bitmap = Bitmap.from_ids(list(ids))
+    assert export.page(index, bitmap, pages, size) == found[(pages - 1) * size:pages * size]
+
+
+def test_page_count():
+    assert export.page_count(0) == 1
+    assert export.page_count(export.page_size) == 1
+    assert export.page_count(export.page_size + 1) == 2
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for close-spelling lookups (gsq_search/fuzzy.py).
+
+"""
+
+import random
+
+import pytest
+
+from gsq_search import fuzzy
+from gsq_search.compact_index import from_dict
+from gsq_search.fuzzy import FuzzyIndex, edit_distance, word_distance
+from gsq_search.sharded_index import ShardedIndex, write_sharded_index
+
+rng = random.Random(1)
+pids = ['CR%04d' % i for i in range(500)]
+postings = {}
+while len(postings) < 3000:
+    # few letters, so most words have close spellings
+    word = ''.join(rng.choice('abcdef') for _ in range(rng.randint(3, 10)))
+    postings[word] = sorted(rng.sample(pids, rng.choice((1, 5, 50))))
+postings['drill hole'] = pids[:10]
+terms = sorted(postings)
+words = [term for term in terms if ' ' not in term]
+
+
+def osa_distance(a, b):
+    # edit distance counting a swap of neighbouring letters as one edit, in full
+    d = [[i + j if not i or not j else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[-1][-1]
+
+
+def brute_force(word):
+    distance = word_distance(word)
+    found = [(edit_distance(word, term, distance), term) for term in words]
+    return sorted((term, d) for d, term in found if d <= distance)
+
+
+def searched_words():
+    # Index words, and misspellings of them: a letter changed, added, removed or two swapped
+    rng = random.Random(2)
+    for word in rng.sample(words, 12):
+        i = rng.randrange(len(word))
+        yield word
+        yield word[:i] + rng.choice('abcdefg') + word[i + 1:]
+        yield word[:i] + rng.choice('abcdefg') + word[i:]
+        yield word[:i] + word[i + 1:]
+        if i + 1 < len(word):
+            yield word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def test_edit_distance_matches_the_full_table():
+    rng = random.Random(3)
+    for _ in range(2000):
+        a, b = rng.choice(words), rng.choice(words)
+        if rng.random() < 0.5:
+            i = rng.randrange(len(a) - 1)
+            b = a[:i] + a[i + 1] + a[i] + a[i + 2:]
+        for limit in (1, 2):
+            assert edit_distance(a, b, limit) == min(osa_distance(a, b), limit + 1)
+
+
+@pytest.fixture(scope='module')
+def fuzzy_index():
+    return FuzzyIndex(terms)
+
+
+@pytest.mark.parametrize('word', sorted(set(searched_words())))
+def test_lookup_matches_brute_force(fuzzy_index, word):
+    found = fuzzy_index.lookup(word)
+    assert sorted(found) == brute_force(word)
+    assert [d for _, d in found] == sorted(d for _, d in found)
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    directory = str(tmp_path / 'shards')
+    write_sharded_index(from_dict(postings), directory, meta={'version': 'v1'}, shard_size=20000)
+    index = ShardedIndex(directory, max_resident=2)
+    assert len(index._files) > 4
+    return index
+
+
+def test_close_matches_on_a_sharded_index_load_no_shards(sharded):
+    compact = from_dict(postings)
+    for word in sorted(set(searched_words())):
+        assert fuzzy.close_matches(sharded, word) == fuzzy.close_matches(compact, word)
+    assert sharded.shard_loads == 0
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for SharedIndex (gsq_search/index.py).
+
+"""
+
+import itertools
+import os
+import time
+
+from gsq_search import index as shared
+from gsq_search.binary_index import MappedIndex, write_binary_index
+from gsq_search.compact_index import from_dict
+
+postings = {'gold': ['CR1'], 'coal': ['CR2'], 'granite': ['CR%d' % i for i in range(3, 13)]}
+
+
+def mapped_loader(directory):
+    numbers = itertools.count()
+
+    def loader(url, progress=None):
+        path = os.path.join(str(directory), 'index%d.gsqidx' % next(numbers))
+        write_binary_index(from_dict(postings, dense_fraction=None), path, meta={'version': 'v1'})
+        return MappedIndex(path), None
+
+    return loader
+
+
+def wait_for(condition, seconds=5):
+    deadline = time.time() + seconds
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_reload_closes_the_replaced_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, 'retire_seconds', 0.01)
+    index = shared.SharedIndex(mapped_loader(tmp_path))
+    old = index.get('url')
+    new = index.reload()
+    assert new is not old
+    assert wait_for(lambda: old._map.closed and old._file.closed)
+    assert new['gold'] == ['CR1']
+
+
+def test_replaced_index_stays_open_while_a_search_holds_its_postings(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, 'retire_seconds', 0.05)
+    index = shared.SharedIndex(mapped_loader(tmp_path))
+    old = index.get('url')
+    held = old.postings('granite')
+    index.reload()
+    # the first attempt to close it has been made
+    time.sleep(0.08)
+    assert not old._map.closed
+    assert len(held) == 10
+    held.release()
+    assert wait_for(lambda: old._map.closed)
+
+
+def test_invalidate_closes_the_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared, 'retire_seconds', 0.01)
+    index = shared.SharedIndex(mapped_loader(tmp_path))
+    old = index.get('url')
+    index.invalidate()
+    assert wait_for(lambda: old._map.closed)
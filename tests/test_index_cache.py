@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the on-disk Index cache and its revalidation (gsq_search/index_cache.py).
+
+"""
+
+import gzip
+import socket
+
+import pytest
+
+from gsq_search.index_cache import IndexCache, IndexUnavailable
+
+body = b'"{\\"gold\\": [\\"CR1\\", \\"CR2\\"]}"'
+new_body = b'"{\\"gold\\": [\\"CR1\\", \\"CR2\\", \\"CR3\\"]}"'
+
+
+def snapshot(path):
+    with gzip.open(path, 'rb') as f:
+        return f.read()
+
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    return 'http://127.0.0.1:%d/index.json' % port
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return IndexCache(str(tmp_path / 'cache'), offline=False, timeout=5)
+
+
+def test_first_fetch_downloads_and_records_the_validators(s3, cache):
+    url = s3.put('index.json', body)
+    path = cache.fetch(url)
+    assert snapshot(path) == body
+    meta = cache.read_meta(url)
+    assert meta['etag'] == s3.objects['index.json'].etag
+    assert meta['last_modified'] == s3.objects['index.json'].last_modified
+
+
+def test_unchanged_index_is_revalidated_with_a_304(s3, cache):
+    url = s3.put('index.json', body)
+    path = cache.fetch(url)
+    s3.requests.clear()
+
+    assert cache.fetch(url) == path
+    (method, _, headers), = s3.sent()
+    assert method == 'HEAD'
+    assert headers['If-None-Match'] == s3.objects['index.json'].etag
+    assert headers['If-Modified-Since'] == s3.objects['index.json'].last_modified
+    assert snapshot(path) == body
+
+
+def test_changed_index_is_downloaded_again(s3, cache):
+    url = s3.put('index.json', body)
+    cache.fetch(url)
+    s3.put('index.json', new_body, last_modified='Tue, 02 Jan 2024 00:00:00 GMT')
+
+    assert snapshot(cache.fetch(url)) == new_body
+    meta = cache.read_meta(url)
+    assert meta['etag'] == s3.objects['index.json'].etag
+    assert meta['last_modified'] == 'Tue, 02 Jan 2024 00:00:00 GMT'
+
+
+def test_last_modified_alone_revalidates(s3, cache):
+    # no ETag: only If-Modified-Since is sent
+    url = s3.put('index.json', body, etag='')
+    path = cache.fetch(url)
+    assert cache.read_meta(url)['etag'] is None
+    s3.requests.clear()
+
+    assert cache.fetch(url) == path
+    (method, _, headers), = s3.sent()
+    assert 'If-None-Match' not in headers
+    assert headers['If-Modified-Since'] == s3.objects['index.json'].last_modified
+    assert not s3.sent('GET')
+
+
+def test_offline_mode_uses_the_cached_copy_without_a_request(s3, cache):
+    url = s3.put('index.json', body)
+    path = cache.fetch(url)
+    s3.requests.clear()
+
+    offline = IndexCache(cache.cache_dir, offline=True)
+    assert offline.fetch(url) == path
+    assert s3.requests == []
+
+
+def test_offline_mode_without_a_cached_copy(s3, tmp_path):
+    offline = IndexCache(str(tmp_path / 'empty'), offline=True)
+    with pytest.raises(IndexUnavailable):
+        offline.fetch(s3.put('index.json', body))
+    assert s3.requests == []
+
+
+def test_unreachable_s3_falls_back_to_the_cached_copy(s3, cache):
+    url = s3.put('index.json', body)
+    path = cache.fetch(url)
+    s3.stop()
+
+    assert cache.fetch(url) == path
+    assert snapshot(path) == body
+
+
+def test_unreachable_s3_without_a_cached_copy(cache):
+    with pytest.raises(IndexUnavailable):
+        cache.fetch(closed_port_url())
+
+
+def test_server_error_falls_back_to_the_cached_copy(s3, cache):
+    url = s3.put('index.json', body)
+    path = cache.fetch(url)
+    del s3.objects['index.json']
+
+    assert cache.fetch(url) == path
+    assert snapshot(path) == body
+
+
+def test_server_error_without_a_cached_copy(s3, cache):
+    with pytest.raises(IndexUnavailable):
+        cache.fetch(s3.url('missing.json'))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the streaming Index file parser (gsq_search/index_stream.py).
+
+"""
+
+import io
+import json
+from json.decoder import JSONDecodeError
+
+import pytest
+
+from gsq_search.index_stream import iter_file, stream_index
+
+# terms and PIDs with every kind of escape, in the JSON index and again in the
+# string that holds it
+index = {
+    'gold': ['CR1', 'CR2', 'CR10'],
+    'say "gold"': ['CR"3"'],
+    'back\\slash': ['CR\\4', 'CR\\\\5'],
+    'café': ['CR6'],
+    'naïve ünïcode': ['CR7', 'CRé8'],
+    'ore 🪨 rock': ['CR🪨9'],
+    'tab\there\nnewline': ['CR\t11'],
+    'brackets ] and [': ['CR]12', 'CR[13', 'CR,14'],
+    'control \x01': ['CR\x1f15'],
+    'empty': [],
+    '': ['CR16'],
+}
+index.update(('term%d' % i, ['CR%d' % j for j in range(i % 7)]) for i in range(40))
+
+chunk_sizes = [1, 2, 3, 5, 7, 11, 64, 1024 * 1024]
+
+
+def documents():
+    for ensure_ascii in (True, False):
+        for indent in (None, 1):
+            inner = json.dumps(index, ensure_ascii=ensure_ascii, indent=indent)
+            # the Index as a JSON object, and as the JSON string the S3 file holds
+            yield inner.encode('utf-8')
+            yield json.dumps(inner, ensure_ascii=ensure_ascii).encode('utf-8')
+
+
+def load(data):
+    # what the app did before the streaming parser
+    loaded = json.loads(data)
+    return json.loads(loaded) if isinstance(loaded, str) else loaded
+
+
+@pytest.mark.parametrize('chunk', chunk_sizes)
+@pytest.mark.parametrize('data', list(documents()), ids=lambda data: '%d-bytes' % len(data))
+def test_stream_matches_json_loads(data, chunk):
+    expected = load(data)
+    assert expected == index
+    parsed, stats = stream_index(iter_file(io.BytesIO(data), chunk))
+    assert parsed == expected
+    assert list(parsed) == list(expected)
+    assert stats.bytes_read == len(data)
+    assert stats.terms == len(index)
+    assert stats.postings == sum(map(len, index.values()))
+
+
+@pytest.mark.parametrize('chunk', [1, 2, 3, 5, 7])
+@pytest.mark.parametrize('escape', ['\\"', '\\\\', '\\u00e9', '\\ud83e\\udea8', '\\n', '\\/'])
+def test_escape_split_at_every_position(escape, chunk):
+    # the escape lands across a chunk boundary at each offset of the file
+    for pad in range(chunk + 1):
+        inner = '{"%s%s": ["CR%s1"]}' % ('x' * pad, escape, escape)
+        for data in (inner, json.dumps(inner)):
+            parsed, _ = stream_index(iter_file(io.BytesIO(data.encode('utf-8')), chunk))
+            assert parsed == load(data)
+
+
+def test_add_gets_entries_in_file_order():
+    entries = []
+    data = json.dumps(json.dumps(index)).encode('utf-8')
+    parsed, stats = stream_index(iter_file(io.BytesIO(data), 5), lambda term, pids: entries.append((term, pids)))
+    assert parsed is None
+    assert entries == list(index.items())
+
+
+def test_pids_are_interned():
+    data = json.dumps({'gold': ['CR%d' % i for i in range(5)], 'coal': ['CR%d' % i for i in range(3, 8)]})
+    parsed, _ = stream_index(iter_file(io.BytesIO(data.encode('utf-8')), 3))
+    assert parsed['gold'][3] is parsed['coal'][0]
+
+
+@pytest.mark.parametrize('data', [b'', b'  ', b'[]', b'{"gold": ["CR1"]', b'{"gold": ["CR1",',
+                                  b'"{\\"gold\\": [\\"CR1\\"]}', b'{"gold": "CR1"}'])
+def test_broken_files_raise(data):
+    with pytest.raises(JSONDecodeError):
+        stream_index(iter_file(io.BytesIO(data), 2))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the phase timings and traces (gsq_search/metrics.py).
+
+"""
+
+import time
+
+from gsq_search import metrics
+
+
+def test_phases_add_up_to_the_trace():
+    with metrics.trace('test_trace', query='gold') as trace:
+        with metrics.phase('parse'):
+            pass
+        with metrics.phase('set_ops'):
+            with metrics.phase('lookup'):
+                time.sleep(0.02)
+    assert list(trace.phases) == ['parse', 'lookup', 'set_ops']
+    assert trace.phases['lookup'] >= 0.02
+    assert trace.phases['set_ops'] < trace.phases['lookup']
+    assert sum(trace.phases.values()) <= trace.seconds
+    assert metrics.recent_traces()[0] is trace
+    assert trace.as_dict()['query'] == 'gold'
+
+
+def test_nested_trace_joins_the_outer_trace():
+    with metrics.trace('test_outer') as outer:
+        with metrics.trace('test_inner', reports=3) as inner:
+            with metrics.phase('pids'):
+                pass
+    assert inner is outer
+    assert 'pids' in outer.phases
+    assert outer.info['reports'] == 3
+
+
+def test_trace_started_inside_a_phase():
+    with metrics.phase('render'):
+        with metrics.trace('test_trace') as trace:
+            with metrics.phase('export'):
+                time.sleep(0.01)
+        time.sleep(0.01)
+    assert list(trace.phases) == ['export']
+    assert metrics.recent_traces()[0] is trace
+    assert metrics._local.stack == []
+
+
+def test_failed_trace_records_the_error():
+    try:
+        with metrics.trace('test_trace') as trace:
+            raise KeyError('gold')
+    except KeyError:
+        pass
+    assert trace.error == 'KeyError'
+    assert 'test_trace' in metrics.render()
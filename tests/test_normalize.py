@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that `clean_term` (gsq_search/normalize.py) gives exactly what the app's
+original per-character filter gave, and for the word-form groups of `LemmaGroups`.
+
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from gsq_search.normalize import LemmaGroups, clean_term
+
+
+def original(text):
+    # the app's filter before clean_term, on the lowercased term
+    return "".join(c for c in text.lower() if c.isalpha() or c == " ")
+
+
+terms = [
+    '',
+    'gold',
+    'Drill Hole',
+    'COAL SEAM GAS',
+    # digits
+    'EPM 12345',
+    'ATP1234',
+    'h2o',
+    '1234567890',
+    # punctuation and symbols
+    "o'brien",
+    'drill-hole',
+    'gold, silver & copper!',
+    '"coal seam"',
+    '(gold OR silver) AND coal',
+    'granit*',
+    '*stone',
+    '~`@#$%^&*()_+={}[]|\\:;<>,.?/',
+    # whitespace
+    '  gold  ',
+    'gold\tsilver',
+    'gold\nsilver\r\n',
+    'gold\u00a0silver',
+    'gold\u2003silver',
+    # Unicode letters, digits and punctuation
+    'Müller',
+    'ÉCOLE des MINES',
+    'straße',
+    'İstanbul',
+    'ǅemal',
+    'Ωmega',
+    'Ѐ кварц',
+    '石英 quartz',
+    'गोल्ड',
+    'gold\u0301',
+    'café²',
+    '٣ gold ٤',
+    '½ ounce',
+    'gold—silver',
+    '«gold»',
+    'gold\u200bsilver',
+    '😀 gold',
+]
+
+
+@pytest.mark.parametrize('text', terms)
+def test_clean_term_matches_the_original_filter(text):
+    assert clean_term(text) == original(text)
+
+
+def test_clean_term_matches_the_original_filter_on_every_ascii_character():
+    text = ''.join(map(chr, range(128)))
+    assert clean_term(text) == original(text)
+
+
+def test_clean_term_matches_the_original_filter_on_the_basic_multilingual_plane():
+    text = ''.join(map(chr, range(0x80, 0xd800)))
+    assert clean_term(text) == original(text)
+
+
+def test_kept_characters():
+    assert clean_term('Granit* 99', keep='*') == 'granit* '
+    assert clean_term('granit*') == 'granit'
+
+
+words = ['the', 'thing', 'things', 'bee', 'being', 'beings', 'mine', 'mined', 'mines',
+         'sample', 'samples', 'sampled', 'sampling', 'sing', 'sings', 'singe', 'singing']
+
+forms_script = """
+import json, sys
+from gsq_search.normalize import LemmaGroups
+groups = LemmaGroups(json.loads(sys.argv[1]))
+print(json.dumps({word: groups.forms(word) for word in json.loads(sys.argv[1])}))
+"""
+
+
+def forms_with_hash_seed(seed):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONHASHSEED=str(seed))
+    output = subprocess.check_output([sys.executable, '-c', forms_script, json.dumps(words)], cwd=root, env=env)
+    return json.loads(output)
+
+
+def test_lemma_groups_are_the_same_for_any_hash_seed():
+    first = forms_with_hash_seed(1)
+    for seed in (2, 3, 4, 5):
+        assert forms_with_hash_seed(seed) == first
+
+
+def test_lemma_groups_are_symmetric():
+    groups = LemmaGroups(words)
+    for word in words:
+        for form in groups.forms(word):
+            assert groups.forms(form) == groups.forms(word)
+
+
+def test_short_stems_are_not_given_an_e():
+    groups = LemmaGroups(words)
+    assert groups.forms('thing') == ['thing', 'things']
+    assert groups.forms('being') == ['being', 'beings']
+    assert groups.forms('the') == []
+    assert groups.forms('bee') == []
+    assert groups.forms('mine') == ['mine', 'mined', 'mines']
+    assert groups.forms('sampling') == ['sample', 'sampled', 'samples', 'sampling']
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that searches give exactly what the app's original AND/OR/NOT branches gave,
+for every pair of joins and on every Index layout (gsq_search/query.py and
+gsq_search/planner.py).
+
+"""
+
+import random
+
+import pytest
+
+from gsq_search.binary_index import MappedIndex, write_binary_index
+from gsq_search.compact_index import from_dict
+from gsq_search.planner import Lookup, Phrase, is_candidate, plan_query, run_query
+from gsq_search.result_cache import ResultCache
+from gsq_search.searcher import Searcher, form_query
+from gsq_search.segments import SegmentedIndex
+from gsq_search.sharded_index import ShardedIndex, write_sharded_index
+
+joins = ('AND', 'OR', 'NOT')
+words = ('gold', 'silver', 'coal', 'granite', 'quartz', 'drill hole')
+
+rng = random.Random(1)
+pids = ['CR%04d' % i for i in range(2000)]
+# some terms in most reports (stored as bitmaps), the rest in a few
+postings = {word: sorted(rng.sample(pids, rng.choice((5, 40, 1500)))) for word in words}
+
+
+def original(r1, join1, r2, join2=None, r3=None):
+    # the app's branches before the query parser, on the terms' sets of PIDs
+    if join2 is None:
+        if join1 == 'AND':
+            return sorted(r1 & r2)
+        if join1 == 'OR':
+            return sorted(r1 | r2)
+        return sorted(r1 - r2)
+    if join1 == 'AND' and join2 == 'AND':
+        return sorted((r1 & r2) & r3)
+    if join1 == 'AND' and join2 == 'OR':
+        return sorted((r1 & r2) | r3)
+    if join1 == 'AND' and join2 == 'NOT':
+        return sorted((r1 & r2) - r3)
+    if join1 == 'OR' and join2 == 'AND':
+        return sorted((r1 | r2) & r3)
+    if join1 == 'OR' and join2 == 'OR':
+        return sorted(r1 | r2 | r3)
+    if join1 == 'OR' and join2 == 'NOT':
+        return sorted((r1 | r2) - r3)
+    if join1 == 'NOT' and join2 == 'AND':
+        return sorted((r1 - r2) & r3)
+    if join1 == 'NOT' and join2 == 'OR':
+        return sorted((r1 - r2) | r3)
+    return sorted((r1 - r2) - r3)
+
+
+def compact_layout(tmp_path):
+    return from_dict(postings)
+
+
+def mapped_layout(tmp_path):
+    path = str(tmp_path / 'index.gsqidx')
+    write_binary_index(from_dict(postings), path, meta={'version': 'v1'})
+    return MappedIndex(path)
+
+
+def sharded_layout(tmp_path):
+    directory = str(tmp_path / 'shards')
+    write_sharded_index(from_dict(postings), directory, meta={'version': 'v1'}, shard_size=64)
+    return ShardedIndex(directory, max_resident=2)
+
+
+def segmented_layout(tmp_path):
+    # the first 1500 reports in the base, the rest in two deltas
+    parts = [pids[:1500], pids[1500:1900], pids[1900:]]
+    segments = []
+    for part in parts:
+        kept = set(part)
+        segments.append(from_dict({word: [pid for pid in found if pid in kept]
+                                   for word, found in postings.items()
+                                   if any(pid in kept for pid in found)}))
+    return SegmentedIndex(segments, version='v1')
+
+
+@pytest.fixture(params=[compact_layout, mapped_layout, sharded_layout, segmented_layout],
+                ids=['compact', 'mapped', 'sharded', 'segmented'])
+def index(request, tmp_path):
+    index = request.param(tmp_path)
+    yield index
+    if hasattr(index, 'close'):
+        index.close()
+
+
+def sets(*terms):
+    return [set(postings[term]) for term in terms]
+
+
+@pytest.mark.parametrize('join1', joins)
+def test_two_terms(index, join1):
+    r1, r2 = sets('gold', 'silver')
+    expected = original(r1, join1, r2)
+    assert run_query(index, form_query(['gold', 'silver', ''], [join1, 'AND'])) == expected
+    assert run_query(index, 'gold %s silver' % join1) == expected
+
+
+@pytest.mark.parametrize('join2', joins)
+@pytest.mark.parametrize('join1', joins)
+@pytest.mark.parametrize('terms', [('gold', 'silver', 'coal'), ('granite', 'drill hole', 'quartz'),
+                                   ('coal', 'coal', 'gold')])
+def test_three_terms(index, terms, join1, join2):
+    r1, r2, r3 = sets(*terms)
+    expected = original(r1, join1, r2, join2, r3)
+    assert run_query(index, form_query(list(terms), [join1, join2])) == expected
+    # typed without brackets, the joins apply from left to right
+    assert run_query(index, '%s %s %s %s %s' % (terms[0], join1, terms[1], join2, terms[2])) == expected
+    assert run_query(index, '(%s %s %s) %s %s' % (terms[0], join1, terms[1], join2, terms[2])) == expected
+
+
+@pytest.mark.parametrize('join1', joins)
+def test_missing_term_raises_key_error(index, join1):
+    with pytest.raises(KeyError):
+        run_query(index, form_query(['gold', 'unobtainium', ''], [join1, 'AND']))
+    with pytest.raises(KeyError):
+        run_query(index, form_query(['gold', 'silver', 'unobtainium'], [join1, 'OR']))
+
+
+@pytest.mark.parametrize('typed', ['123', '--', ' 42! '])
+@pytest.mark.parametrize('join2', joins)
+def test_third_term_of_no_letters_isnt_found(index, typed, join2):
+    # left out only when left blank, as the app always did
+    with pytest.raises(KeyError):
+        run_query(index, form_query(['gold', 'silver', typed], ['OR', join2]))
+
+
+@pytest.mark.parametrize('blank', ['', '   '])
+def test_blank_third_term_is_left_out(index, blank):
+    query = form_query(['Gold', 'Silver', blank], ['OR', 'NOT'])
+    assert str(query) == str(form_query(['gold', 'silver', ''], ['OR', 'AND'])) == '(gold OR silver)'
+
+
+# word pairs and triples stored in the Index, each in some of the reports that have
+# all of its words
+grams = ('diamond drill', 'drill hole', 'diamond drill hole', 'drill hole core', 'core sample')
+phrase_postings = {}
+for gram in grams:
+    phrase_postings[gram] = found = sorted(rng.sample(pids, 600))
+    for word in gram.split():
+        phrase_postings.setdefault(word, set()).update(found)
+for word in ('diamond', 'drill', 'hole', 'core', 'sample', 'granite'):
+    phrase_postings.setdefault(word, set()).update(rng.sample(pids, 300))
+phrase_postings = {term: sorted(found) for term, found in phrase_postings.items()}
+
+
+@pytest.fixture(params=['compact', 'sharded'])
+def phrase_index(request, tmp_path):
+    index = from_dict(phrase_postings)
+    if request.param == 'sharded':
+        directory = str(tmp_path / 'shards')
+        write_sharded_index(index, directory, meta={'version': 'v1'}, shard_size=64)
+        index = ShardedIndex(directory, max_resident=2)
+    yield index
+    if hasattr(index, 'close'):
+        index.close()
+
+
+def all_of(*terms):
+    return sorted(set.intersection(*(set(phrase_postings[term]) for term in terms)))
+
+
+def test_stored_phrase_is_looked_up(phrase_index):
+    plan = plan_query(phrase_index, '"diamond drill hole"')
+    assert plan == Lookup('diamond drill hole', len(phrase_postings['diamond drill hole']))
+    assert not is_candidate(plan)
+
+
+def test_long_phrase_from_overlapping_triples_and_pairs(phrase_index):
+    plan = plan_query(phrase_index, '"diamond drill hole core sample"')
+    assert isinstance(plan, Phrase) and is_candidate(plan)
+    # 'hole core sample' isn't stored, so words 4 and 5 come from the pair
+    assert sorted(part.term for part in plan.keep) == ['core sample', 'diamond drill hole', 'drill hole core']
+    assert run_query(phrase_index, '"diamond drill hole core sample"') == \
+        all_of('diamond drill hole', 'drill hole core', 'core sample')
+
+
+def test_phrase_without_stored_pairs_falls_back_to_words(phrase_index):
+    # neither 'granite core' nor 'granite core sample' is stored
+    plan = plan_query(phrase_index, '"granite core sample"')
+    assert isinstance(plan, Phrase)
+    assert sorted(part.term for part in plan.keep) == ['core', 'core sample', 'granite']
+    assert run_query(phrase_index, '"granite core sample"') == all_of('granite', 'core', 'core sample')
+    with pytest.raises(KeyError) as error:
+        plan_query(phrase_index, '"granite core unobtainium"')
+    assert error.value.args == ('unobtainium',)
+
+
+@pytest.mark.parametrize('query, candidate', [
+    ('"drill hole"', False),
+    ('"drill hole core sample"', True),
+    ('diamond AND "granite core"', True),
+    ('granite OR "diamond drill hole core"', True),
+    ('granite NOT "drill hole core sample"', True),
+])
+def test_candidate_flag_reaches_the_searcher(phrase_index, query, candidate):
+    searcher = Searcher(phrase_index, cache=ResultCache())
+    result = searcher.search(query)
+    assert result.candidate is candidate
+    assert searcher.lookup(query).candidate is candidate
+    header = next(searcher.iter_csv(result)).split(b'\n', 1)[0]
+    assert header == (b'report_pid,match' if candidate else b'report_pid')
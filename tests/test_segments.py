@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for opening and compacting a SegmentedIndex (gsq_search/segments.py).
+
+"""
+
+import random
+
+from gsq_search.binary_index import MappedIndex, write_binary_index
+from gsq_search.compact_index import from_dict
+from gsq_search.segments import SegmentedIndex, compact
+from gsq_search.sharded_index import ShardedIndex, write_sharded_index
+
+rng = random.Random(1)
+pids = ['CR%04d' % i for i in range(2000)]
+words = ['gold', 'silver', 'coal', 'granite', 'quartz', 'drill hole', 'coal seam gas']
+# the base holds the first 1500 reports, each delta a later batch; the PIDs of the
+# batches interleave, so compacting has to renumber them
+batches = [pids[0::4] + pids[1::4] + pids[2::4], pids[3::4][:300], pids[3::4][300:]]
+
+
+def segment_dicts():
+    segments = []
+    for batch in batches:
+        segment = {}
+        for word in words:
+            # some terms only in some segments, some in most of their reports
+            if rng.random() < 0.8:
+                segment[word] = rng.sample(batch, rng.choice((1, 20, len(batch) * 9 // 10)))
+        segments.append(segment)
+    return segments
+
+
+def combined(segments):
+    index = {}
+    for segment in segments:
+        for word, found in segment.items():
+            index.setdefault(word, []).extend(found)
+    return {word: sorted(found) for word, found in index.items()}
+
+
+def assert_same(index, expected):
+    assert list(index.terms) == sorted(expected)
+    assert index.pids == from_dict(expected).pids
+    for word, found in expected.items():
+        assert index[word] == found
+
+
+def test_compact_matches_the_combined_index():
+    segments = segment_dicts()
+    index = SegmentedIndex([from_dict(segment) for segment in segments], version='v2')
+    compacted = compact(index)
+    assert compacted.version == 'v2'
+    assert_same(compacted, combined(segments))
+
+
+def test_compact_with_a_mapped_base(tmp_path):
+    segments = segment_dicts()
+    path = str(tmp_path / 'base.gsqidx')
+    write_binary_index(from_dict(segments[0]), path, meta={'version': 'v1'})
+    base = MappedIndex(path)
+    try:
+        index = SegmentedIndex([base] + [from_dict(segment) for segment in segments[1:]], version='v2')
+        assert_same(compact(index, dense_fraction=None), combined(segments))
+    finally:
+        base.close()
+
+
+def test_sharded_base_is_not_loaded_to_open_the_segments(tmp_path):
+    segments = segment_dicts()
+    directory = str(tmp_path / 'shards')
+    write_sharded_index(from_dict(segments[0]), directory, meta={'version': 'v1'}, shard_size=64)
+    base = ShardedIndex(directory, max_resident=2)
+    index = SegmentedIndex([base] + [from_dict(segment) for segment in segments[1:]], version='v2')
+    expected = combined(segments)
+    assert list(index.terms) == sorted(expected)
+    assert [index.terms[i] for i in range(len(expected))] == sorted(expected)
+    assert base.shard_loads == 0
+    assert_same(compact(index), expected)
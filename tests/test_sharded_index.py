@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests that going through a sharded Index's terms doesn't load its shards
+(gsq_search/sharded_index.py).
+
+"""
+
+import random
+
+import pytest
+
+from gsq_search import autocomplete, fuzzy
+from gsq_search.compact_index import from_dict
+from gsq_search.sharded_index import ShardedIndex, write_sharded_index
+
+rng = random.Random(1)
+pids = ['CR%04d' % i for i in range(500)]
+postings = {}
+while len(postings) < 3000:
+    word = ''.join(rng.choice('abcdefghij') for _ in range(rng.randint(3, 8)))
+    postings[word] = sorted(rng.sample(pids, rng.choice((1, 5, 50))))
+postings['drill hole'] = pids[:10]
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    directory = str(tmp_path / 'shards')
+    write_sharded_index(from_dict(postings), directory, meta={'version': 'v1'}, shard_size=20000)
+    index = ShardedIndex(directory, max_resident=2)
+    assert len(index._files) > 4
+    return index
+
+
+def test_iterating_over_the_terms_loads_no_shards(sharded):
+    assert list(sharded.terms) == sorted(postings)
+    assert list(sharded) == sorted(postings)
+    assert sharded.shard_loads == 0
+
+
+def test_fuzzy_index_is_built_without_loading_the_shards(sharded):
+    index = fuzzy.fuzzy_index(sharded)
+    assert sharded.shard_loads == 0
+    assert index.words == len(postings) - 1
+    word = sorted(postings)[100]
+    typo = word[:-1] + ('a' if word[-1] != 'a' else 'b')
+    assert word in fuzzy.close_matches(sharded, typo)
+
+
+def test_term_dfs_are_read_without_loading_the_shards(sharded):
+    assert list(sharded.term_dfs()) == [len(postings[term]) for term in sorted(postings)]
+    terms, dfs = sharded.term_table()
+    assert terms == sorted(postings)
+    assert list(dfs) == [len(postings[term]) for term in terms]
+    assert sharded.shard_loads == 0
+
+
+def test_completions_are_built_and_used_without_loading_the_shards(sharded):
+    compact = from_dict(postings)
+    for prefix in ('a', 'ab', 'abc', 'j', 'drill ', 'x'):
+        assert autocomplete.complete(sharded, prefix) == autocomplete.complete(compact, prefix)
+    assert sharded.shard_loads == 0
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for prefix, suffix and wildcard expansion (gsq_search/term_dictionary.py).
+
+"""
+
+import itertools
+import random
+import re
+from bisect import bisect_right
+
+import pytest
+
+from gsq_search.compact_index import from_dict
+from gsq_search.planner import run_query
+from gsq_search.result_cache import ResultCache
+from gsq_search.searcher import Searcher
+from gsq_search.sharded_index import ShardedIndex, write_sharded_index
+from gsq_search.term_dictionary import TermDictionary, max_expansions, term_dictionary
+
+rng = random.Random(1)
+pids = ['CR%04d' % i for i in range(500)]
+postings = {}
+while len(postings) < 3000:
+    word = ''.join(rng.choice('abcdefghij') for _ in range(rng.randint(3, 8)))
+    postings[word] = sorted(rng.sample(pids, rng.choice((1, 5, 50))))
+# more terms starting with 'quartz' than a wildcard is expanded to
+for letters in itertools.islice(itertools.product('abcdefghij', repeat=3), max_expansions + 100):
+    postings['quartz' + ''.join(letters)] = [rng.choice(pids)]
+postings['drill hole'] = pids[:10]
+terms = sorted(postings)
+
+
+def matching(pattern):
+    regex = re.compile('.*'.join(map(re.escape, pattern.split('*'))) + r'\Z')
+    return [term for term in terms if regex.match(term)]
+
+
+@pytest.mark.parametrize('pattern', ['abc*', 'a*', 'j*', '*abc', '*j', 'a*c', 'ab*cd', 'a*b*c', 'drill*',
+                                     'quartz*', '*xyz', 'xyz*'])
+def test_expand_matches_every_term(pattern):
+    found = matching(pattern)
+    assert TermDictionary(terms).expand(pattern) == (found[:max_expansions], len(found))
+
+
+def test_expansion_is_capped():
+    dictionary = TermDictionary(terms)
+    found = matching('a*')
+    assert dictionary.expand('a*', limit=5) == (found[:5], len(found))
+    # some of the terms ending with the suffix
+    found = matching('*a')
+    capped, total = dictionary.expand('*a', limit=5)
+    assert len(capped) == 5 and set(capped) < set(found) and total == len(found)
+    found = matching('a*a')
+    assert dictionary.expand('a*a', limit=5) == (found[:5], len(found))
+
+
+def test_search_for_a_wildcard_with_too_many_terms():
+    result = Searcher(from_dict(postings), cache=ResultCache()).lookup('quartz*')
+    (pattern, searched, total), = result.expansions
+    assert pattern == 'quartz*'
+    assert searched == matching('quartz*')[:max_expansions]
+    assert total == max_expansions + 100
+    assert result.pids == sorted({pid for term in searched for pid in postings[term]})
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    directory = str(tmp_path / 'shards')
+    write_sharded_index(from_dict(postings), directory, meta={'version': 'v1'}, shard_size=20000)
+    index = ShardedIndex(directory, max_resident=2)
+    assert len(index._files) > 4
+    return index
+
+
+def test_wildcards_on_a_sharded_index_load_no_shards(sharded):
+    dictionary = term_dictionary(sharded)
+    for pattern in ('abc*', '*abc', 'a*c'):
+        found = matching(pattern)
+        assert dictionary.expand(pattern) == (found[:max_expansions], len(found))
+    assert sharded.shard_loads == 0
+
+
+def test_wildcard_search_on_a_sharded_index_loads_only_the_matching_shards(sharded):
+    found = matching('abc*')
+    assert run_query(sharded, 'abc*') == sorted({pid for term in found for pid in postings[term]})
+    shards = {bisect_right(sharded._first_terms, term) for term in found}
+    assert sharded.shard_loads == len(shards) == 1